@@ -16,7 +16,7 @@ import tracking #bird audio and video tracking
 logger = logging.getLogger(__name__)
 
 
-def main(camera: int, mic: str, recordings_directory: Path, detections_directory: Path, location: tuple, node_name: str, min_confidence: float, save_audio: str):    
+def main(camera: int, mic: str, recordings_directory: Path, detections_directory: Path, location: tuple, node_name: str, min_confidence: float, save_audio: str, capture_mode: str, overlap: float, batch_size: int, backlog_policy: str, max_backlog: int, channels: int, sample_rate: int, archive_format: str, flush_interval: float, fsync_interval: float, fsync_count: int, server_url: str, server_token: str, spool_directory: Path, video_width: int, jpeg_quality: int, max_fps: float, analyzer_variant: str, threads: int, replay_directory: Path, replay_speed: float, metrics_port: int):    
     
     ''' START '''
     date_today_str = datetime.now().strftime("%Y-%m-%d")
@@ -29,22 +29,30 @@ def main(camera: int, mic: str, recordings_directory: Path, detections_directory
     os.makedirs(recordings_directory, exist_ok=True) 
     os.makedirs(detections_directory, exist_ok=True)
     
+    ''' workers send metrics to this process, which serves them for prometheus '''
+    metrics_queue = mp.Queue(maxsize=10000) if metrics_port else None
+
     ''' create worker instances for bird tracking '''
-    bird_server_workers = []
+    bird_server_workers = {}
     # add audio worker
-    bird_server_workers.append(
-        mp.Process(target=tracking.listen_for_birds,args=(mic, recordings_directory, detections_directory, location, node_name, min_confidence, save_audio, ))
-        )
-    # add video worker if --camera exists
-    if camera is not None:
-        bird_server_workers.append(mp.Process(target=tracking.look_for_birds,args=(camera, node_name, )))
+    bird_server_workers["audio"] = mp.Process(target=tracking.listen_for_birds,args=(mic, recordings_directory, detections_directory, location, node_name, min_confidence, save_audio, capture_mode, overlap, batch_size, backlog_policy, max_backlog, channels, sample_rate, archive_format, flush_interval, fsync_interval, fsync_count, server_url, server_token, spool_directory, analyzer_variant, threads, replay_directory, replay_speed, metrics_queue, ))
+    # add video worker if --camera exists (not while replaying, so the node exits once the replay is done)
+    if camera is not None and replay_directory is None:
+        bird_server_workers["video"] = mp.Process(target=tracking.look_for_birds,args=(camera, node_name, video_width, jpeg_quality, max_fps, metrics_queue, ))
     
     ''' start each collection worker '''
-    for worker in bird_server_workers:
+    for worker in bird_server_workers.values():
         worker.start()
 
+    if metrics_queue is not None:
+        registry = tracking.MetricsRegistry(metrics_queue)
+        for name, worker in bird_server_workers.items():
+            registry.register_worker(name, worker)
+        registry.start()
+        tracking.serve_metrics(registry, metrics_port)
+
     ''' wait for each collection worker to finish. '''
-    for worker in bird_server_workers:
+    for worker in bird_server_workers.values():
         worker.join()
     
     ''' End of Sever, Shutdown '''
@@ -104,14 +112,37 @@ def parse_args():
     # Command line arguments for input.
     input_group = parser.add_argument_group("Input")
     input_group.add_argument("--camera",type=int,required=False,help="Integer of camera device for video tracking")
-    input_group.add_argument("--mic",type=str,required=True,help="Name of microphone device for audio tracking")
+    input_group.add_argument("--video-width",type=int,required=False,default=640,help="Width the camera stream is scaled down to, 0 keeps the camera resolution (default=640)")
+    input_group.add_argument("--jpeg-quality",type=int,required=False,default=80,help="JPEG quality of the camera stream frames (default=80, range=0-100)")
+    input_group.add_argument("--max-fps",type=float,required=False,default=10,help="Max frames per second of the camera stream, 0 for no limit (default=10)")
+    input_group.add_argument("--mic",type=str,required=False,help="Name of microphone device for audio tracking (required unless benchmarking or replaying)")
     input_group.add_argument("--location",type=float,nargs=2,required=True,help="GPS location tuple such like: lat lon")
     input_group.add_argument("--node-name",type=str,required=False,default="default",help="Name for node")
+    input_group.add_argument("--capture-mode",type=str,choices=["files", "stream"],default="files",required=False,help="How audio reaches the analyzer: arecord wav files picked up by a directory watcher, or streamed from arecord into memory (files or stream, default=files)")
+    input_group.add_argument("--overlap",type=float,required=False,default=0.0,help="Seconds of overlap between 3s analysis windows when streaming, audio is carried over between chunks (default=0.0, range=0.0<=x<3.0)")
+    input_group.add_argument("--batch-size",type=int,required=False,default=16,help="Number of 3s analysis windows run through the model per call when streaming (default=16)")
+    input_group.add_argument("--backlog-policy",type=str,choices=["none", "skip-alternate", "lite-model", "catch-up"],default="none",required=False,help="What audio analysis does when it falls behind arecord in files capture mode (default=none, only logs the lag)")
+    input_group.add_argument("--max-backlog",type=int,required=False,default=4,help="Number of recordings waiting for analysis above which the backlog policy kicks in (default=4)")
+    input_group.add_argument("--channels",type=int,choices=[1, 2],default=2,required=False,help="Number of channels to record, BirdNET analyzes mono so 1 halves the audio written and read (default=2)")
+    input_group.add_argument("--sample-rate",type=int,required=False,default=48000,help="Sample rate to record at in Hz, audio is resampled to 48000 for analysis (default=48000)")
+    input_group.add_argument("--analyzer",type=str,choices=["full", "lite"],default="full",required=False,help="BirdNET model to analyze audio with, full (BirdNET 2.4) or lite (BirdNET-Lite, files capture mode only) (default=full)")
+    input_group.add_argument("--threads",type=int,required=False,default=1,help="Number of cpu threads the BirdNET model runs on (default=1)")
+    input_group.add_argument("--benchmark",type=Path,required=False,help="Path to a folder of wav files to run through each analyzer and thread count, prints latency, realtime factor and peak memory, then exits")
+    input_group.add_argument("--replay",type=Path,required=False,help="Path to a folder of wav files to feed through the audio pipeline in place of the mic (same capture mode, analyzer and save policy), prints per chunk latency, realtime factor, detections/sec and file I/O, then exits")
+    input_group.add_argument("--replay-speed",type=float,required=False,default=1.0,help="Multiple of realtime the --replay audio is fed at, 0 for as fast as the analyzer keeps up (default=1.0)")
     input_group.add_argument("--min-confidence",type=float,required=False,default=0.2,help="Minimum confidence of model for audio detection (default=0.2, range=0.0<x<1.0)")
     
     output_group = parser.add_argument_group("Output")
     output_group.add_argument("--recordings-directory",type=Path,required=False,default=Path("./audio_recordings/"),help="Path to directory to save audio recordings")
     output_group.add_argument("--detections-directory",type=Path,required=False,default=Path("./detections/"),help="Path to directory to save detections from analyzers")
+    output_group.add_argument("--archive-format",type=str,choices=["wav", "flac", "opus"], default="wav", required=False, help="Format that kept audio recordings are compressed to after analysis (wav, flac, or opus, default=wav)")
+    output_group.add_argument("--flush-interval",type=float,required=False,default=5.0,help="Max seconds detections are buffered before they are written to the detections file (default=5.0)")
+    output_group.add_argument("--fsync-interval",type=float,required=False,default=30.0,help="Seconds between fsyncs of the detections file, 0 disables (default=30.0)")
+    output_group.add_argument("--fsync-count",type=int,required=False,default=0,help="Number of written detections that triggers an fsync of the detections file, 0 disables (default=0)")
+    output_group.add_argument("--server-url",type=str,required=False,help="Base url of the server (e.g. http://192.168.1.10:8080) to push detections to, omit to only write the detections directory")
+    output_group.add_argument("--server-token",type=str,required=False,help="Token the server expects from nodes pushing detections (matches the server's --ingest-token)")
+    output_group.add_argument("--spool-directory",type=Path,required=False,default=Path("./spool/"),help="Path to directory detections wait in until the server has received them")
+    output_group.add_argument("--metrics-port",type=int,required=False,default=0,help="Port to serve node metrics on in the prometheus text format at /metrics (unauthenticated, on all interfaces), e.g. 5001. Default is 0 (off)")
     output_group.add_argument("--save-audio",type=str,choices=["always", "detections-only", "never"], default="detections-only", required=False, help="Options for saving audio files after processing (always, detections-only, or never)")
 
     # Command line arguments for logging configuration.
@@ -128,7 +159,10 @@ def parse_args():
     )
     logging_group.add_argument("--log-file-path",required=False,default=Path("./logs/"),type=Path,help="log file path. (deafult is cwd)")
     
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.mic is None and args.benchmark is None and args.replay is None:
+        parser.error("--mic is required")
+    return args
 
 
 if __name__ == '__main__':
@@ -150,8 +184,19 @@ if __name__ == '__main__':
             log_file=Path(args.log_file_path / Path(f'{datetime.today().year}-{str(datetime.today().month).zfill(2)}-node-{args.node_name}.log'))
         )
         
+        ''' benchmark analyzer configurations instead of listening '''
+        if args.benchmark:
+            results = tracking.benchmark_analyzers(args.benchmark, tuple(args.location), args.min_confidence, thread_counts=sorted({1, 2, 4, args.threads}))
+            print(f"{'analyzer':<10}{'threads':>8}{'load s':>8}{'mean s/file':>13}{'max s/file':>12}{'realtime':>10}{'peak MB':>9}")
+            for result in results:
+                if 'error' in result:
+                    print(f"{result['variant']:<10}{result['threads']:>8}  error: {result['error']}")
+                    continue
+                print(f"{result['variant']:<10}{result['threads']:>8}{result['load_secs']:>8}{result['mean_file_secs']:>13}{result['max_file_secs']:>12}{str(result['realtime_factor']) + 'x':>10}{result['peak_rss_mb']:>9}")
+            sys.exit(0)
+
         ''' run main '''
-        main(args.camera, args.mic, args.recordings_directory, args.detections_directory, tuple(args.location), args.node_name, args.min_confidence, args.save_audio)
+        main(args.camera, args.mic, args.recordings_directory, args.detections_directory, tuple(args.location), args.node_name, args.min_confidence, args.save_audio, args.capture_mode, args.overlap, args.batch_size, args.backlog_policy, args.max_backlog, args.channels, args.sample_rate, args.archive_format, args.flush_interval, args.fsync_interval, args.fsync_count, args.server_url, args.server_token, args.spool_directory, args.video_width, args.jpeg_quality, args.max_fps, args.analyzer, args.threads, args.replay, args.replay_speed, args.metrics_port)
     except Exception as e:
         logger.error(f'Unknown exception of type: {type(e)} - {e}')
         raise e
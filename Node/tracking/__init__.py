@@ -1,4 +1,6 @@
 from tracking.audio import listen_for_birds
 from tracking.video import look_for_birds
+from tracking.analyzers import benchmark_analyzers
+from tracking.metrics import MetricsRegistry, serve_metrics
 
-__all__ = ['listen_for_birds', 'look_for_birds']
+__all__ = ['listen_for_birds', 'look_for_birds', 'benchmark_analyzers', 'MetricsRegistry', 'serve_metrics']
@@ -0,0 +1,140 @@
+import logging, os, queue, resource, statistics, time
+import multiprocessing as mp
+import soundfile as sf
+
+from pathlib import Path
+
+from birdnetlib import Recording
+from birdnetlib import analyzer as birdnet_analyzer
+from birdnetlib import analyzer_lite as birdnet_analyzer_lite
+from birdnetlib.analyzer import Analyzer
+from birdnetlib.analyzer_lite import LiteAnalyzer
+
+logger = logging.getLogger(__name__)
+
+ANALYZER_VARIANTS = ["full", "lite"]
+
+class ThreadedAnalyzer(Analyzer):
+    """
+    BirdNET 2.4 analyzer whose tflite interpreter runs on more than one cpu thread.
+
+    birdnetlib always builds its interpreter with 1 thread, so load_model is overridden to build it
+    with threads instead. It mirrors Analyzer.load_model of the birdnetlib version pinned in
+    requirements.txt, recheck it when upgrading.
+
+    Args:
+        threads (int): Cpu threads the interpreter runs on.
+    """
+
+    def __init__(self, threads: int = 1, **kwargs):
+        self.threads = threads # load_model is called from Analyzer.__init__
+        super().__init__(**kwargs)
+
+    def load_model(self):
+        self.interpreter = birdnet_analyzer.tflite.Interpreter(model_path=self.model_path, num_threads=self.threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self.input_layer_index = self.input_details[0]["index"]
+        if self.use_custom_classifier: # embeddings feed the custom classifier instead of the class scores
+            self.output_layer_index = self.output_details[0]["index"] - 1
+        else:
+            self.output_layer_index = self.output_details[0]["index"]
+
+class ThreadedLiteAnalyzer(LiteAnalyzer):
+    """
+    BirdNET-Lite analyzer whose tflite interpreter runs on more than one cpu thread.
+
+    Overrides LiteAnalyzer.load_lite_model the same way ThreadedAnalyzer overrides load_model,
+    mirroring the birdnetlib version pinned in requirements.txt.
+
+    Args:
+        threads (int): Cpu threads the interpreter runs on.
+    """
+
+    def __init__(self, threads: int = 1, **kwargs):
+        self.threads = threads # load_lite_model is called from LiteAnalyzer.__init__
+        super().__init__(**kwargs)
+
+    def load_lite_model(self):
+        self.interpreter = birdnet_analyzer_lite.tflite.Interpreter(model_path=birdnet_analyzer_lite.MODEL_PATH, num_threads=self.threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self.input_layer_index = self.input_details[0]["index"]
+        self.mdata_input_index = self.input_details[1]["index"]
+        self.output_layer_index = self.output_details[0]["index"]
+        with open(birdnet_analyzer_lite.LABEL_PATH, "r") as labels_file:
+            self.classes.extend(line.replace("\n", "") for line in labels_file.readlines())
+
+def create_analyzer(variant: str = "full", threads: int = 1):
+    ''' BirdNET analyzer, full (BirdNET 2.4) or lite (BirdNET-Lite), running its model on threads cpu threads '''
+    if variant not in ANALYZER_VARIANTS:
+        raise ValueError(f"Unknown analyzer variant: {variant}")
+    if variant == "lite":
+        analyzer = LiteAnalyzer() if threads == 1 else ThreadedLiteAnalyzer(threads=threads)
+    else:
+        analyzer = Analyzer() if threads == 1 else ThreadedAnalyzer(threads=threads)
+    logger.info(f"{variant} analyzer loaded with {threads} thread(s)")
+    return analyzer
+
+''' Benchmark '''
+def _benchmark_configuration(variant: str, threads: int, wav_paths: list, location: tuple, min_confidence: float, results):
+    ''' runs in its own process, so the peak RSS belongs to this configuration only '''
+    try:
+        started = time.perf_counter()
+        analyzer = create_analyzer(variant, threads)
+        load_secs = time.perf_counter() - started
+
+        latencies = []
+        audio_secs = 0.0
+        for wav_path in wav_paths:
+            recording = Recording(analyzer, str(wav_path), lon=location[1], lat=location[0], min_conf=min_confidence)
+            started = time.perf_counter()
+            recording.analyze()
+            latencies.append(time.perf_counter() - started)
+            audio_secs += sf.info(str(wav_path)).duration
+
+        results.put({
+            'variant': variant,
+            'threads': threads,
+            'load_secs': round(load_secs, 2),
+            'mean_file_secs': round(statistics.mean(latencies), 3),
+            'max_file_secs': round(max(latencies), 3),
+            'realtime_factor': round(audio_secs / sum(latencies), 1),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), # linux reports KB
+        })
+    except Exception as e:
+        results.put({'variant': variant, 'threads': threads, 'error': str(e)})
+
+def benchmark_analyzers(wav_directory: Path, location: tuple, min_confidence: float = 0.2, variants: list = None, thread_counts: list = None) -> list:
+    '''
+    run every wav in wav_directory through each analyzer variant and thread count, one process per configuration.
+    returns a list of results with per file latency, realtime factor (above 1 keeps up with live audio) and peak RSS
+    '''
+    wav_paths = sorted(Path(wav_directory).glob("*.wav"))
+    if not wav_paths:
+        raise ValueError(f"No wav files found in {wav_directory}")
+    variants = variants or ANALYZER_VARIANTS
+    thread_counts = thread_counts or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    context = mp.get_context("spawn") # fresh process without another configuration's memory
+    results = []
+    for variant in variants:
+        for threads in thread_counts:
+            logger.info(f"Benchmarking {variant} analyzer with {threads} thread(s) on {len(wav_paths)} files")
+            result_queue = context.Queue()
+            process = context.Process(target=_benchmark_configuration, args=(variant, threads, wav_paths, location, min_confidence, result_queue))
+            process.start()
+            while True:
+                try:
+                    result = result_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not process.is_alive():
+                        result = {'variant': variant, 'threads': threads, 'error': f"benchmark process exited with code {process.exitcode}"}
+                        break
+            process.join()
+            logger.info(str(result))
+            results.append(result)
+    return results
@@ -0,0 +1,38 @@
+import logging, os
+import numpy as np
+import soundfile as sf
+
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = ["wav", "flac", "opus"]
+
+OPUS_SAMPLE_RATES = [8000, 12000, 16000, 24000, 48000]
+
+def archive_path_for(path: Path, archive_format: str) -> Path:
+    return Path(path).with_suffix("." + archive_format)
+
+def write_recording(path: Path, samples: np.ndarray, rate: int, archive_format: str = "wav") -> Path:
+    ''' write int16 samples in the archive format, returns the path written (extension matches the format) '''
+    if archive_format == "opus" and rate not in OPUS_SAMPLE_RATES:
+        logger.warning(f"Opus doesn't support a {rate}Hz sample rate, saving as flac instead")
+        archive_format = "flac"
+    path = archive_path_for(path, archive_format)
+    if archive_format == "flac":
+        sf.write(str(path), samples, rate, format="FLAC", subtype="PCM_16")
+    elif archive_format == "opus":
+        sf.write(str(path), samples, rate, format="OGG", subtype="OPUS")
+    else:
+        sf.write(str(path), samples, rate, format="WAV", subtype="PCM_16")
+    return path
+
+def archive_recording(wav_path: Path, archive_format: str) -> Path:
+    ''' compress a kept wav recording, the wav is removed once the archive is written. returns the playable path '''
+    if archive_format == "wav":
+        return Path(wav_path)
+    samples, rate = sf.read(str(wav_path), dtype="int16")
+    archived_path = write_recording(wav_path, samples, rate, archive_format)
+    os.remove(wav_path)
+    logger.debug(f"Archived {wav_path} as {archived_path}")
+    return archived_path
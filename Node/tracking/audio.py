@@ -1,55 +1,91 @@
-import logging, time, sys, signal, json, os
+import logging, time, sys, signal, os
 
 from pathlib import Path
 from subprocess import Popen
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from birdnetlib.watcher import DirectoryWatcher
-from birdnetlib.analyzer_lite import LiteAnalyzer
-from birdnetlib.analyzer import Analyzer
+from birdnetlib import Recording
+
+from tracking.audiostream import StreamingCapture
+from tracking.detectionswriter import DetectionsWriter
+from tracking.shipper import DetectionsShipper
+from tracking.analyzers import create_analyzer
+from tracking.archive import archive_recording, write_recording
+from tracking.inference import BatchedInference
+from tracking.metrics import metrics
+from tracking.replay import ReplayCapture, ReplayRecordings, print_replay_summary
+from tracking.scheduler import AnalysisScheduler, watch_recordings
 
 logger = logging.getLogger(__name__)
 
-def format_and_save_detections_to_file(detections, recording_path: Path, detections_directory: Path, location: tuple, node_name: str):
-    ''' Get start date of recording from filename '''
-    datetime_str = str(recording_path).split("/")[-1] #remove subfolder from filename (still has .wav)
-    rec_start_time_obj = datetime.strptime(datetime_str, "%Y-%m-%d-birdnet-%H:%M:%S.wav")
-    
-    with open(detections_directory / Path("detections-" + datetime_str.split("-birdnet")[0] +".jsonl"), "a") as fileout:
-        for detection in detections:
-            json_out = {}
-            json_out["start_ts"] = (rec_start_time_obj + timedelta(seconds=detection['start_time']) ).strftime("%Y-%m-%dT%H:%M:%S")
-            json_out["end_ts"] = (rec_start_time_obj + timedelta(seconds=detection['end_time']) ).strftime("%Y-%m-%dT%H:%M:%S")
-            json_out["confidence"] = round(detection['confidence'],2) # round to 2 sig figs
-            json_out["common_name"] = detection['common_name']
-            json_out["scientific_name"] = detection['scientific_name']
-            json_out["location"] = str(location)
-            json_out["node_name"] = node_name
-            json_out["filename"] = str(recording_path)
-            
-            print(json_out)
-            fileout.write(json.dumps(json_out)+"\n")
+def format_and_save_detections_to_file(detections, recording_path: Path, writer: DetectionsWriter, shipper: DetectionsShipper = None, rec_start_time_obj: datetime = None):
+    ''' Get start date of recording from filename (unless start time is known, e.g. streamed audio) '''
+    if rec_start_time_obj is None:
+        datetime_str = Path(recording_path).stem #remove subfolder and extension (.wav, .flac or .opus) from filename
+        rec_start_time_obj = datetime.strptime(datetime_str, "%Y-%m-%d-birdnet-%H:%M:%S")
 
+    rows = [writer.format_detection(detection, rec_start_time_obj, recording_path) for detection in detections]
+    writer.write(rows)
+    if shipper is not None:
+        shipper.ship(rows) # push to the server too
+    for detection in detections:
+        metrics.inc('birdnode_detections_total', species=detection['common_name'])
+    logger.info(f"{len(detections)} detections in {recording_path}")
 
-def main(mic_name: str, recording_dir: Path, detections_directory: Path, location: tuple, node_name: str, min_confidence: float, save_audio: str):
+
+def main(mic_name: str, recording_dir: Path, detections_directory: Path, location: tuple, node_name: str, min_confidence: float, save_audio: str, capture_mode: str = "files", overlap: float = 0.0, batch_size: int = 16, backlog_policy: str = "none", max_backlog: int = 4, channels: int = 2, sample_rate: int = 48000, archive_format: str = "wav",
+         flush_interval: float = 5.0, fsync_interval: float = 30.0, fsync_count: int = 0, server_url: str = None, server_token: str = None, spool_directory: Path = Path("./spool/"),
+         analyzer_variant: str = "full", threads: int = 1, replay_directory: Path = None, replay_speed: float = 1.0):
 
     duration_secs = 15
     RECORD_PROCESS = None
+
+    ''' detections are buffered and written to the held open daily file by one writer for the life of the process '''
+    writer = DetectionsWriter(detections_directory, location, node_name, flush_interval=flush_interval, fsync_interval=fsync_interval, fsync_count=fsync_count)
+
+    ''' detections are also pushed to the server when a server url is given, spooled on disk until the server has them '''
+    shipper = None
+    if server_url:
+        shipper = DetectionsShipper(server_url, spool_directory, node_name, token=server_token)
+        logger.info(f"Pushing detections to {server_url} ({shipper.backlog()} spooled batches waiting)")
+
+    ''' Stream audio straight from arecord to the analyzer, skipping the wav files and directory watcher '''
+    if capture_mode == "stream":
+        if analyzer_variant != "full":
+            logger.warning("Batched streaming inference needs the full analyzer, ignoring --analyzer " + analyzer_variant)
+        if backlog_policy != "none" or max_backlog != 4:
+            logger.warning(f"Backlog policies only apply to --capture-mode files, ignoring --backlog-policy {backlog_policy} and --max-backlog {max_backlog} (streamed audio that falls behind is dropped from the ring buffer)")
+        listen_streaming(mic_name, recording_dir, writer, shipper, location, min_confidence, save_audio, duration_secs, overlap, batch_size, channels, sample_rate, archive_format, threads, replay_directory, replay_speed)
+        return
     
     ''' Create Analyzer Functions '''
     def on_analyze_complete(recording):
         # after each analyze is complete, determine if saving audio or not
+        ''' compress kept audio first, so detections point to the file that is kept '''
+        recording_path = Path(recording.path)
+        wav_bytes = os.path.getsize(recording_path)
+        if save_audio == "always" or (save_audio == "detections-only" and recording.detections):
+            try:
+                recording_path = archive_recording(recording_path, archive_format)
+                if recording_path.suffix != ".wav":
+                    metrics.inc('birdnode_audio_bytes_deleted_total', wav_bytes) # archiving replaced the wav
+                metrics.inc('birdnode_audio_bytes_written_total', os.path.getsize(recording_path))
+            except Exception as e:
+                logger.error(f"Error while archiving {recording.path} as {archive_format}: {e}")
+
         ''' check for detections, write if exist '''
         if recording.detections:
-            format_and_save_detections_to_file(recording.detections, recording.path, detections_directory, location, node_name)
+            format_and_save_detections_to_file(recording.detections, recording_path, writer, shipper)
         
         ''' save or delete audio files '''
         if save_audio == "never":
             os.remove(recording.path)
+            metrics.inc('birdnode_audio_bytes_deleted_total', wav_bytes)
         elif (save_audio == "detections-only") and not (recording.detections): 
             ''' No detections from recording, so delete file to save space '''
             logger.info("No detections, deleting file: " + str(recording.path))
             os.remove(recording.path)
+            metrics.inc('birdnode_audio_bytes_deleted_total', wav_bytes)
     
             
     def on_error(recording, error):
@@ -58,8 +94,14 @@ def main(mic_name: str, recording_dir: Path, detections_directory: Path, locatio
 
     ''' Create Signal Handler '''
     def signal_handler(sig, frame):
-        RECORD_PROCESS.terminate()
-        RECORD_PROCESS.wait()
+        if RECORD_PROCESS is not None:
+            RECORD_PROCESS.terminate()
+            RECORD_PROCESS.wait()
+        if replay is not None:
+            replay.stop()
+        writer.close()
+        if shipper is not None:
+            shipper.close()
         logger.info("Gracefully exiting process ...")
         sys.exit(0)
 
@@ -70,8 +112,8 @@ def main(mic_name: str, recording_dir: Path, detections_directory: Path, locatio
         "arecord",
         "-f",
         "S16_LE",
-        "-c2",
-        "-r48000",
+        f"-c{channels}",
+        f"-r{sample_rate}",
         "-t",
         "wav",
         "-D",
@@ -82,40 +124,189 @@ def main(mic_name: str, recording_dir: Path, detections_directory: Path, locatio
         f"{recording_dir}/%F-birdnet-%H:%M:%S.wav",
     ]
 
-    ''' Start recording process '''
-    logger.info("Starting to record audio with arecord now.")
-    RECORD_PROCESS = Popen(arecord_command_list)
+    ''' Start recording process, or replay a directory of wav files in its place (started once the analyzer is ready) '''
+    replay = None
+    if replay_directory is None:
+        logger.info("Starting to record audio with arecord now.")
+        RECORD_PROCESS = Popen(arecord_command_list)
+    else:
+        replay = ReplayRecordings(replay_directory, recording_dir, channels, sample_rate, speed=replay_speed)
     
     ''' Start Analyzer '''
     try:
-        analyzer = Analyzer()
-        analyzers = [analyzer,]
+        analyzer = create_analyzer(analyzer_variant, threads)
         logger.info("Analyzer started")
     except Exception as e:
         logger.error(f"Error while starting the analyzer: {e}")
-    
-    ''' Start directory watcher to analyze new audio files '''
-    directory = recording_dir
-    watcher = DirectoryWatcher(
-        directory,
-        analyzers=analyzers,
-        lon=location[1],
-        lat=location[0],
-        min_conf=min_confidence, #default 0.2
+
+    ''' lighter model is only loaded if the backlog policy can switch to it '''
+    lite_analyzer = None
+    if backlog_policy == "lite-model":
+        lite_analyzer = analyzer if analyzer_variant == "lite" else create_analyzer("lite", threads)
+        logger.info("Lite analyzer started for backlog policy")
+
+    def analyze_recording(path: Path, lightweight: bool):
+        recording = Recording(
+            lite_analyzer if lightweight else analyzer,
+            str(path),
+            lon=location[1],
+            lat=location[0],
+            min_conf=min_confidence, #default 0.2
+        )
+        if replay is not None:
+            replay.stats.started(path.name)
+        detections_count = 0
+        started = time.perf_counter()
+        try:
+            recording.analyze()
+            detections_count = len(recording.detections)
+            on_analyze_complete(recording)
+            metrics.observe('birdnode_analysis_seconds', time.perf_counter() - started, mode="files")
+            metrics.inc('birdnode_chunks_total', result="analyzed")
+        except Exception as error: # SystemExit from the SIGINT handler and KeyboardInterrupt stop the node
+            on_error(recording, error)
+            metrics.inc('birdnode_chunks_total', result="error")
+        if replay is not None:
+            replay.stats.completed(path.name, detections_count)
+
+        ''' backlog after each recording, so a node falling behind shows up before the lag warning '''
+        backlog = scheduler.stats()
+        metrics.set('birdnode_analysis_backlog', backlog['backlog'] + backlog['catchup_backlog'])
+        metrics.set('birdnode_analysis_lag_seconds', backlog['lag_secs'])
+        if shipper is not None:
+            metrics.set('birdnode_shipper_backlog', shipper.backlog())
+
+    def skip_recording(path: Path):
+        ''' recording won't be analyzed, so only keep it (archived like analyzed audio) if all audio is being saved '''
+        logger.info("Analysis behind, skipping file: " + str(path))
+        wav_bytes = os.path.getsize(path)
+        if save_audio == "always":
+            try:
+                archived_path = archive_recording(path, archive_format)
+                if archived_path.suffix != ".wav":
+                    metrics.inc('birdnode_audio_bytes_deleted_total', wav_bytes)
+                metrics.inc('birdnode_audio_bytes_written_total', os.path.getsize(archived_path))
+                logger.info(f"Kept skipped recording unanalyzed as {archived_path}")
+            except Exception as e:
+                logger.error(f"Error while archiving skipped recording {path} as {archive_format}: {e}")
+        else:
+            metrics.inc('birdnode_audio_bytes_deleted_total', wav_bytes)
+            os.remove(path)
+        metrics.inc('birdnode_chunks_total', result="skipped")
+        if replay is not None:
+            replay.stats.completed(path.name, skipped=True)
+
+    ''' Scheduler queues new audio files for analysis, tracks the backlog and applies the backlog policy when behind '''
+    scheduler = AnalysisScheduler(
+        analyze_recording,
+        skip_recording,
+        policy=backlog_policy,
+        max_backlog=max_backlog,
+        catchup_directory=recording_dir / Path("catchup"),
     )
-    
-    ''' Set function call after analyze of each recording is completed '''
-    watcher.on_analyze_complete = on_analyze_complete
-    watcher.on_error = on_error
-    
-    ''' Watch '''
-    watcher.watch()
+    watch_recordings(recording_dir, scheduler.enqueue)
+    logger.info(f"Watching {recording_dir} for new recordings (backlog policy={backlog_policy}, max backlog={max_backlog})")
+
+    ''' Analyze '''
+    if replay is not None:
+        replay.start(on_finished=scheduler.stop)
+    scheduler.run()
+
+    ''' only reached once a replay is done '''
+    writer.close()
+    if shipper is not None:
+        shipper.close()
+    print_replay_summary(replay.stats.summary())
+
+
+def listen_streaming(mic_name: str, recording_dir: Path, writer: DetectionsWriter, shipper: DetectionsShipper, location: tuple, min_confidence: float, save_audio: str, duration_secs: int, overlap: float = 0.0, batch_size: int = 16,
+                     channels: int = 2, sample_rate: int = 48000, archive_format: str = "wav", threads: int = 1, replay_directory: Path = None, replay_speed: float = 1.0):
+    ''' analyze fixed windows of audio from an in-memory ring buffer, audio is only written to disk when it is kept '''
+    if replay_directory is None:
+        capture = StreamingCapture(mic_name, capture_rate=sample_rate, channels=channels)
+    else:
+        capture = ReplayCapture(replay_directory, capture_rate=sample_rate, channels=channels, window_secs=duration_secs, speed=replay_speed)
+
+    ''' Create Signal Handler '''
+    def signal_handler(sig, frame):
+        capture.stop()
+        writer.close()
+        if shipper is not None:
+            shipper.close()
+        logger.info("Gracefully exiting process ...")
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+
+    ''' Start Analyzer, 3s windows (optionally overlapping, carried over between chunks) are run through the model in batches '''
+    try:
+        analyzer = create_analyzer("full", threads)
+        inference = BatchedInference(analyzer, location, min_confidence, overlap_secs=overlap, batch_size=batch_size, rate=capture.rate)
+        logger.info(f"Analyzer started (overlap={overlap}s, batch size={batch_size})")
+    except Exception as e:
+        logger.error(f"Error while starting the analyzer: {e}")
+
+    ''' Start streaming audio '''
+    capture.start()
+    dropped_samples = 0
+    chunks_analyzed = 0
+    for samples, start_time in capture.windows(duration_secs):
+        if replay_directory is not None:
+            capture.stats.started(start_time)
+        started = time.perf_counter()
+        try:
+            detections, base_time, analyzed_samples = inference.analyze(samples, start_time)
+        except Exception as e:
+            logger.error("An exception occurred: {}".format(e))
+            logger.error(start_time)
+            metrics.inc('birdnode_chunks_total', result="error")
+            if replay_directory is not None:
+                capture.stats.completed(start_time)
+            continue
+        recording_path = recording_dir / Path(base_time.strftime("%Y-%m-%d-birdnet-%H:%M:%S.wav"))
+
+        ''' only write audio when it is being kept, file covers the carried over audio so detection times line up '''
+        if save_audio == "always" or (save_audio == "detections-only" and detections):
+            recording_path = write_recording(recording_path, analyzed_samples, capture.rate, archive_format)
+            metrics.inc('birdnode_audio_bytes_written_total', os.path.getsize(recording_path))
+
+        ''' check for detections, write if exist '''
+        if detections:
+            format_and_save_detections_to_file(detections, recording_path, writer, shipper, rec_start_time_obj=base_time)
+        if replay_directory is not None:
+            capture.stats.completed(start_time, len(detections))
+        metrics.observe('birdnode_analysis_seconds', time.perf_counter() - started, mode="stream")
+        metrics.inc('birdnode_chunks_total', result="analyzed")
+        if shipper is not None:
+            metrics.set('birdnode_shipper_backlog', shipper.backlog())
+
+        chunks_analyzed += 1
+        if chunks_analyzed % 20 == 0:
+            logger.info(f"Audio analysis running at {inference.realtime_factor:.1f}x realtime")
+
+        if capture.ring_buffer.dropped_samples > dropped_samples:
+            dropped_samples = capture.ring_buffer.dropped_samples
+            metrics.set('birdnode_audio_dropped_seconds', dropped_samples / capture.rate)
+            logger.warning(f"Analyzer fell behind the audio stream, {capture.ring_buffer.dropped_samples / capture.rate:.1f}s of audio dropped so far")
 
+    ''' the stream only ends once a replay runs out of audio '''
+    writer.close()
+    if shipper is not None:
+        shipper.close()
+    if replay_directory is not None:
+        print_replay_summary(capture.stats.summary())
 
-def listen_for_birds(mic: str, recording_directory: Path, detections_directory: Path, location: tuple, node_name: str, min_confidence: float, save_audio: str):
-    logger.info(f"Starting Bird Audio Listener with Microphone: {mic}")
+def listen_for_birds(mic: str, recording_directory: Path, detections_directory: Path, location: tuple, node_name: str, min_confidence: float, save_audio: str, capture_mode: str = "files", overlap: float = 0.0, batch_size: int = 16, backlog_policy: str = "none", max_backlog: int = 4,
+                     channels: int = 2, sample_rate: int = 48000, archive_format: str = "wav", flush_interval: float = 5.0, fsync_interval: float = 30.0, fsync_count: int = 0,
+                     server_url: str = None, server_token: str = None, spool_directory: Path = Path("./spool/"),
+                     analyzer_variant: str = "full", threads: int = 1, replay_directory: Path = None, replay_speed: float = 1.0, metrics_queue=None):
+    metrics.connect(metrics_queue, "audio")
+    if replay_directory is None:
+        logger.info(f"Starting Bird Audio Listener with Microphone: {mic}")
+    else:
+        logger.info(f"Starting Bird Audio Listener replaying: {replay_directory}")
     try:
-        main(mic, recording_directory, detections_directory, location, node_name, min_confidence, save_audio)
+        main(mic, recording_directory, detections_directory, location, node_name, min_confidence, save_audio, capture_mode, overlap, batch_size, backlog_policy, max_backlog, channels, sample_rate, archive_format, flush_interval, fsync_interval, fsync_count, server_url, server_token, spool_directory, analyzer_variant, threads, replay_directory, replay_speed)
     except KeyboardInterrupt:
         logger.info("KeyboardInterrupt")
     except Exception as e:
@@ -0,0 +1,150 @@
+import logging, threading
+import numpy as np
+import soxr
+
+from subprocess import Popen, PIPE
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+class AudioRingBuffer:
+    """
+    Fixed size ring buffer of mono int16 samples shared by a capture thread and the analyzer.
+
+    If the reader falls more than a full buffer behind, the oldest samples are overwritten and
+    counted in dropped_samples.
+
+    Args:
+        capacity_samples (int): Number of samples the buffer holds.
+    """
+
+    def __init__(self, capacity_samples: int):
+        self.capacity = capacity_samples
+        self.buffer = np.zeros(capacity_samples, dtype=np.int16)
+        self.write_pos = 0 # total samples ever written
+        self.read_pos = 0 # total samples ever consumed
+        self.dropped_samples = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def write(self, samples: np.ndarray):
+        with self.condition:
+            if len(samples) > self.capacity:
+                self.dropped_samples += len(samples) - self.capacity
+                self.write_pos += len(samples) - self.capacity
+                samples = samples[-self.capacity:]
+            start = self.write_pos % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self.buffer[start:start + first] = samples[:first]
+            self.buffer[:len(samples) - first] = samples[first:]
+            self.write_pos += len(samples)
+            if self.write_pos - self.read_pos > self.capacity:
+                self.dropped_samples += self.write_pos - self.capacity - self.read_pos
+                self.read_pos = self.write_pos - self.capacity
+            self.condition.notify_all()
+
+    def read(self, window_samples: int, advance_samples: int = None):
+        '''
+        block until window_samples are available, returns (samples, index of first sample) or (None, None) once closed.
+        the read position moves forward by advance_samples (default window_samples), less than the window gives overlap
+        '''
+        if advance_samples is None:
+            advance_samples = window_samples
+        with self.condition:
+            while self.write_pos - self.read_pos < window_samples:
+                if self.closed:
+                    return None, None
+                self.condition.wait()
+            start_index = self.read_pos
+            indexes = np.arange(start_index, start_index + window_samples) % self.capacity
+            samples = self.buffer[indexes]
+            self.read_pos += advance_samples
+            return samples, start_index
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class StreamingCapture:
+    """
+    Captures raw PCM from arecord's stdout into a ring buffer, so audio never has to be written to
+    disk before it is analyzed. Stereo input is mixed down to mono and other sample rates are
+    resampled to 48kHz (BirdNET analyzes mono 48kHz audio).
+
+    Args:
+        mic_name (str): arecord device name.
+        capture_rate (int): Sample rate arecord captures at in Hz.
+        channels (int): Number of channels to capture.
+        buffer_secs (float): Seconds of audio the ring buffer holds.
+    """
+
+    rate = 48000 # sample rate of the buffered audio
+
+    def __init__(self, mic_name: str, capture_rate: int = 48000, channels: int = 2, buffer_secs: float = 120):
+        self.mic_name = mic_name
+        self.capture_rate = capture_rate
+        self.channels = channels
+        self.ring_buffer = AudioRingBuffer(int(self.rate * buffer_secs))
+        self.process = None
+        self.start_time = None
+
+    def start(self):
+        arecord_command_list = [
+            "arecord",
+            "-f",
+            "S16_LE",
+            f"-c{self.channels}",
+            f"-r{self.capture_rate}",
+            "-t",
+            "raw",
+            "-D",
+            self.mic_name,
+        ]
+        logger.info("Starting to stream audio with arecord now.")
+        self.process = Popen(arecord_command_list, stdout=PIPE)
+        self.start_time = datetime.now()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def _read_loop(self):
+        frame_bytes = 2 * self.channels
+        block_bytes = frame_bytes * (self.capture_rate // 10) # read 100ms at a time
+        leftover = b""
+        resampler = None
+        if self.capture_rate != self.rate:
+            resampler = soxr.ResampleStream(self.capture_rate, self.rate, 1, dtype="int16")
+        try:
+            while True:
+                data = self.process.stdout.read(block_bytes)
+                if not data:
+                    break
+                data = leftover + data
+                usable = len(data) - (len(data) % frame_bytes)
+                leftover = data[usable:]
+                samples = np.frombuffer(data[:usable], dtype=np.int16)
+                if self.channels > 1:
+                    samples = samples.reshape(-1, self.channels).mean(axis=1).astype(np.int16)
+                if resampler is not None:
+                    samples = resampler.resample_chunk(samples)
+                self.ring_buffer.write(samples)
+        finally:
+            logger.info("Audio stream from arecord ended")
+            self.ring_buffer.close()
+
+    def windows(self, window_secs: float, advance_secs: float = None):
+        ''' yield (samples, start datetime) for each window of audio as it becomes available '''
+        window_samples = int(window_secs * self.rate)
+        advance_samples = int((advance_secs or window_secs) * self.rate)
+        while True:
+            samples, start_index = self.ring_buffer.read(window_samples, advance_samples)
+            if samples is None:
+                return
+            yield samples, self.start_time + timedelta(seconds=start_index / self.rate)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        self.ring_buffer.close()
+
@@ -0,0 +1,139 @@
+import json, logging, os, threading, time
+
+from pathlib import Path
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class DetectionsWriter:
+    """
+    Long lived writer for the daily detections jsonl files.
+
+    The current day's file is held open, detections are buffered and written in batches, and
+    fsync runs on a time and/or count policy. The writer rotates to a new file when a detection
+    belongs to a new (local) day. Reopening a file whose last line was torn by a power cut starts
+    on a fresh line, so only the torn line is lost.
+
+    Args:
+        detections_directory (Path): Directory the detections-YYYY-MM-DD.jsonl files are written to.
+        location (tuple): (lat, lon) of the node.
+        node_name (str): Name of the node.
+        batch_size (int): Buffered detections that trigger a write.
+        flush_interval (float): Max seconds a detection stays buffered before it is written.
+        fsync_interval (float): Seconds between fsyncs of written detections (0 disables).
+        fsync_count (int): Written detections that trigger an fsync (0 disables).
+    """
+
+    def __init__(self, detections_directory: Path, location: tuple, node_name: str, batch_size: int = 32, flush_interval: float = 5.0, fsync_interval: float = 30.0, fsync_count: int = 0):
+        self.detections_directory = Path(detections_directory)
+        self.node_name = node_name
+        self.lat, self.lon = float(location[0]), float(location[1])
+        self.location_str = str(location) # converted once, not per detection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.fsync_count = fsync_count
+        self.lock = threading.Lock()
+        self.pending = [] # (date string, json line)
+        self.oldest_pending = None
+        self.fileout = None
+        self.file_date_str = None
+        self.unsynced = 0
+        self.last_fsync = time.time()
+        self.closed = False
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def format_detection(self, detection: dict, rec_start_time_obj: datetime, recording_path: Path) -> dict:
+        start = rec_start_time_obj.timestamp() + detection['start_time']
+        end = rec_start_time_obj.timestamp() + detection['end_time']
+        json_out = {}
+        json_out["start_ts"] = datetime.fromtimestamp(start).strftime("%Y-%m-%dT%H:%M:%S")
+        json_out["end_ts"] = datetime.fromtimestamp(end).strftime("%Y-%m-%dT%H:%M:%S")
+        json_out["confidence"] = round(detection['confidence'],2) # round to 2 sig figs
+        json_out["common_name"] = detection['common_name']
+        json_out["scientific_name"] = detection['scientific_name']
+        json_out["location"] = self.location_str
+        json_out["node_name"] = self.node_name
+        json_out["filename"] = str(recording_path)
+        ''' compact numeric fields '''
+        json_out["lat"] = self.lat
+        json_out["lon"] = self.lon
+        json_out["start_epoch"] = round(start, 3)
+        json_out["end_epoch"] = round(end, 3)
+        return json_out
+
+    def write(self, rows: list):
+        ''' buffer formatted detection rows, written once the batch is full or flush_interval passes '''
+        with self.lock:
+            for row in rows:
+                self.pending.append((row["start_ts"][:10], json.dumps(row) + "\n"))
+            if self.oldest_pending is None:
+                self.oldest_pending = time.time()
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def _open(self, date_str: str):
+        ''' must be called with the lock held, rotates to the file for date_str '''
+        if self.fileout is not None:
+            self._fsync()
+            self.fileout.close()
+        file_path = self.detections_directory / Path("detections-" + date_str + ".jsonl")
+        self.fileout = open(file_path, "a+b")
+        self.file_date_str = date_str
+
+        ''' a torn last line (power cut mid write) must not swallow the next detection '''
+        if self.fileout.tell() > 0:
+            self.fileout.seek(-1, os.SEEK_END)
+            if self.fileout.read(1) != b"\n":
+                logger.warning(f"Detections file {file_path} ends with a partial line, starting a new line")
+                self.fileout.write(b"\n")
+        logger.info(f"Writing detections to {file_path}")
+
+    def _fsync(self):
+        if self.fileout is not None and self.unsynced:
+            self.fileout.flush()
+            os.fsync(self.fileout.fileno())
+        self.unsynced = 0
+        self.last_fsync = time.time()
+
+    def _flush(self):
+        ''' must be called with the lock held '''
+        if not self.pending:
+            return
+        for date_str, line in self.pending:
+            if date_str != self.file_date_str:
+                self._open(date_str)
+            self.fileout.write(line.encode())
+            self.unsynced += 1
+        self.fileout.flush()
+        logger.debug(f"Wrote {len(self.pending)} detections to {self.fileout.name}")
+        self.pending = []
+        self.oldest_pending = None
+
+        if (self.fsync_count and self.unsynced >= self.fsync_count) or (self.fsync_interval and time.time() - self.last_fsync >= self.fsync_interval):
+            self._fsync()
+
+    def _flush_loop(self):
+        while not self.closed:
+            time.sleep(min(1.0, self.flush_interval))
+            with self.lock:
+                if self.closed:
+                    return
+                if self.oldest_pending is not None and time.time() - self.oldest_pending >= self.flush_interval:
+                    self._flush()
+                elif self.fsync_interval and self.unsynced and time.time() - self.last_fsync >= self.fsync_interval:
+                    self._fsync()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        ''' write anything buffered, fsync and close the file '''
+        with self.lock:
+            self._flush()
+            self._fsync()
+            if self.fileout is not None:
+                self.fileout.close()
+                self.fileout = None
+            self.closed = True
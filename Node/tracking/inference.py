@@ -0,0 +1,113 @@
+import logging, time
+import numpy as np
+
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+class BatchedInference:
+    """
+    Runs BirdNET over fixed 3 second windows of a continuous audio stream, many windows per model call.
+
+    Windows can overlap, and audio that doesn't fill a whole window (or is needed for the next
+    overlapping window) is carried over to the next chunk, so calls that cross a chunk boundary
+    are still seen in one window. The birdnetlib interpreter is only resized when the batch size
+    changes, instead of on every window.
+
+    Args:
+        analyzer: birdnetlib Analyzer that provides the tflite interpreter, labels and species list.
+        location (tuple): (lat, lon) used to filter species by location.
+        min_confidence (float): Minimum confidence of a detection.
+        overlap_secs (float): Seconds of overlap between consecutive windows (0 <= overlap < 3).
+        batch_size (int): Maximum number of windows per model call.
+        rate (int): Sample rate of the audio, BirdNET expects 48000.
+    """
+
+    sample_secs = 3.0
+
+    def __init__(self, analyzer, location: tuple, min_confidence: float, overlap_secs: float = 0.0, batch_size: int = 16, rate: int = 48000):
+        if not 0 <= overlap_secs < self.sample_secs:
+            raise ValueError(f"overlap must be at least 0 and less than {self.sample_secs} seconds")
+        self.analyzer = analyzer
+        self.min_confidence = max(0.01, min(min_confidence, 0.99))
+        self.overlap_secs = overlap_secs
+        self.batch_size = max(1, batch_size)
+        self.rate = rate
+        self.window_samples = int(self.sample_secs * rate)
+        self.hop_samples = int((self.sample_secs - overlap_secs) * rate)
+        self.allocated_batch = None
+
+        ''' location species filter is the same for every window, so look it up once '''
+        self.allow_list = set(analyzer.return_predicted_species_list(lon=location[1], lat=location[0], week_48=-1))
+
+        ''' audio carried over from the previous chunk and the time of its first sample '''
+        self.carry = np.zeros(0, dtype=np.int16)
+        self.carry_start_time = None
+
+        ''' throughput, seconds of audio analyzed vs seconds spent in the model '''
+        self.audio_secs = 0.0
+        self.inference_secs = 0.0
+
+    @property
+    def realtime_factor(self) -> float:
+        ''' seconds of audio analyzed per second of inference (above 1 keeps up with live audio) '''
+        if not self.inference_secs:
+            return None
+        return self.audio_secs / self.inference_secs
+
+    def predict_batch(self, windows: np.ndarray) -> np.ndarray:
+        ''' sigmoid activations with shape (windows, labels) '''
+        interpreter = self.analyzer.interpreter
+        if self.allocated_batch != len(windows):
+            interpreter.resize_tensor_input(self.analyzer.input_layer_index, [len(windows), self.window_samples])
+            interpreter.allocate_tensors()
+            self.allocated_batch = len(windows)
+        interpreter.set_tensor(self.analyzer.input_layer_index, windows)
+        interpreter.invoke()
+        prediction = interpreter.get_tensor(self.analyzer.output_layer_index)
+        return self.analyzer.flat_sigmoid(np.array(prediction), sensitivity=-1.0)
+
+    def analyze(self, samples: np.ndarray, start_time: datetime):
+        '''
+        analyze a chunk of mono int16 audio that starts at start_time.
+        returns (detections, base_time, analyzed_samples), detection start/end times are seconds from base_time,
+        which is the start of analyzed_samples (carried over audio followed by this chunk)
+        '''
+        if self.carry_start_time is None or not len(self.carry):
+            self.carry_start_time = start_time
+        audio = np.concatenate([self.carry, samples.astype(np.int16)])
+        base_time = self.carry_start_time
+        self.audio_secs += len(samples) / self.rate
+
+        starts = list(range(0, len(audio) - self.window_samples + 1, self.hop_samples))
+        detections = []
+        for batch_start in range(0, len(starts), self.batch_size):
+            batch_starts = starts[batch_start:batch_start + self.batch_size]
+            windows = np.stack([audio[s:s + self.window_samples] for s in batch_starts]).astype(np.float32) / 32768.0
+
+            started = time.perf_counter()
+            predictions = self.predict_batch(windows)
+            self.inference_secs += time.perf_counter() - started
+
+            for s, prediction in zip(batch_starts, predictions):
+                for label_index in np.nonzero(prediction > self.min_confidence)[0]:
+                    label = self.analyzer.labels[label_index]
+                    if self.allow_list and label not in self.allow_list:
+                        continue
+                    scientific_name, common_name = label.split("_")[:2]
+                    detections.append({
+                        'common_name': common_name,
+                        'scientific_name': scientific_name,
+                        'start_time': s / self.rate,
+                        'end_time': (s + self.window_samples) / self.rate,
+                        'confidence': float(prediction[label_index]),
+                        'label': label,
+                    })
+
+        ''' carry the audio from the next (not yet complete) window onwards into the next chunk '''
+        next_start = starts[-1] + self.hop_samples if starts else 0
+        self.carry = audio[next_start:]
+        self.carry_start_time = base_time + timedelta(seconds=next_start / self.rate)
+
+        logger.debug(f"Analyzed {len(starts)} windows, realtime factor {self.realtime_factor or 0:.1f}x")
+        return detections, base_time, audio
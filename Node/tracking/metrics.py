@@ -0,0 +1,185 @@
+import logging, os, queue, threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+''' name: (type, help, histogram buckets) '''
+METRICS = {
+    'birdnode_analysis_seconds': ('histogram', 'Seconds from the start of analyzing a chunk of audio until its detections are saved', (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)),
+    'birdnode_chunks_total': ('counter', 'Chunks of audio handled by the analyzer, by result (analyzed, skipped, error)', None),
+    'birdnode_analysis_backlog': ('gauge', 'Recordings waiting to be analyzed', None),
+    'birdnode_analysis_lag_seconds': ('gauge', 'Seconds the oldest waiting recording has been queued', None),
+    'birdnode_audio_dropped_seconds': ('gauge', 'Seconds of streamed audio dropped because analysis fell behind', None),
+    'birdnode_detections_total': ('counter', 'Detections saved, by species', None),
+    'birdnode_audio_bytes_written_total': ('counter', 'Bytes of audio kept on disk after analysis', None),
+    'birdnode_audio_bytes_deleted_total': ('counter', 'Bytes of audio deleted after analysis', None),
+    'birdnode_shipper_backlog': ('gauge', 'Batches of detections spooled until the server acknowledges them', None),
+    'birdnode_video_capture_fps': ('gauge', 'Frames per second grabbed from the camera', None),
+    'birdnode_video_publish_fps': ('gauge', 'Frames per second encoded and sent to viewers', None),
+    'birdnode_video_encode_seconds': ('histogram', 'Seconds to scale and JPEG encode one camera frame', (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)),
+    'birdnode_video_viewers': ('gauge', 'Viewers of the camera stream', None),
+    'birdnode_worker_up': ('gauge', 'Whether the worker process is alive', None),
+    'birdnode_worker_cpu_seconds_total': ('counter', 'CPU seconds (user + system) used by the worker process', None),
+    'birdnode_worker_rss_bytes': ('gauge', 'Resident memory of the worker process', None),
+}
+
+class MetricsClient:
+    """
+    Sends metric updates from a worker process to the node's MetricsRegistry over a queue.
+
+    Updates are dropped while not connected (e.g. benchmarks) or when the queue is full, so
+    recording a metric never blocks the hot path.
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.worker = None
+
+    def connect(self, metrics_queue, worker: str):
+        self.queue = metrics_queue
+        self.worker = worker
+
+    def _send(self, kind: str, name: str, value: float, labels: dict):
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait((kind, name, dict(labels, worker=self.worker), value))
+        except queue.Full:
+            pass
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self._send('inc', name, amount, labels)
+
+    def set(self, name: str, value: float, **labels):
+        self._send('set', name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        self._send('observe', name, value, labels)
+
+''' one client per process, workers connect it to the queue when they start '''
+metrics = MetricsClient()
+
+
+def read_process_usage(pid: int) -> tuple:
+    ''' (cpu seconds, rss bytes) of a process from /proc (linux) '''
+    with open(f"/proc/{pid}/stat", "r") as filein:
+        fields = filein.read().rsplit(")", 1)[1].split() # process name can contain spaces
+    cpu_secs = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK") # utime + stime
+    with open(f"/proc/{pid}/status", "r") as filein:
+        rss_kb = next(int(line.split()[1]) for line in filein if line.startswith("VmRSS:"))
+    return cpu_secs, rss_kb * 1024
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Metrics of the node's worker processes, fed by their MetricsClients over a queue and served
+    in the Prometheus text format. CPU and memory of each worker are read from /proc when scraped.
+
+    Args:
+        metrics_queue (multiprocessing.Queue): Queue the workers' MetricsClients send updates to.
+    """
+
+    def __init__(self, metrics_queue):
+        self.queue = metrics_queue
+        self.values = {} # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+        self.workers = {} # name -> multiprocessing.Process
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._drain_loop, daemon=True).start()
+
+    def register_worker(self, name: str, process):
+        self.workers[name] = process
+
+    def _drain_loop(self):
+        while True:
+            try:
+                kind, name, labels, value = self.queue.get()
+            except (EOFError, OSError):
+                return
+            if name not in METRICS:
+                continue
+            key = (name, tuple(sorted(labels.items())))
+            with self.lock:
+                if kind == 'inc':
+                    self.values[key] = self.values.get(key, 0) + value
+                elif kind == 'set':
+                    self.values[key] = value
+                elif kind == 'observe':
+                    buckets = METRICS[name][2]
+                    histogram = self.values.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                    for index, bound in enumerate(buckets):
+                        if value <= bound:
+                            histogram[0][index] += 1
+                    histogram[1] += value
+                    histogram[2] += 1
+
+    def _sample_workers(self):
+        ''' worker liveness, cpu and memory, the parent process is reported as worker "main" '''
+        processes = [("main", os.getpid(), True)] + [(name, process.pid, process.is_alive()) for name, process in self.workers.items()]
+        with self.lock:
+            for name, pid, alive in processes:
+                labels = (('worker', name),)
+                self.values[('birdnode_worker_up', labels)] = int(alive)
+                if not alive or pid is None:
+                    continue
+                try:
+                    cpu_secs, rss_bytes = read_process_usage(pid)
+                except (OSError, ValueError, IndexError, StopIteration):
+                    continue
+                self.values[('birdnode_worker_cpu_seconds_total', labels)] = cpu_secs
+                self.values[('birdnode_worker_rss_bytes', labels)] = rss_bytes
+
+    def render(self) -> str:
+        self._sample_workers()
+        lines = []
+        with self.lock:
+            for name, (metric_type, help_text, buckets) in METRICS.items():
+                series = sorted(((labels, value) for (key_name, labels), value in self.values.items() if key_name == name), key=lambda item: item[0])
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in series:
+                    if metric_type == 'histogram':
+                        bucket_counts, total, count = value
+                        for bound, bucket_count in zip(buckets, bucket_counts):
+                            lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {bucket_count}")
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                        lines.append(f"{name}_count{format_labels(labels)} {count}")
+                    else:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(registry: MetricsRegistry, port: int = 5001) -> ThreadingHTTPServer:
+    ''' serve registry at http://<node>:port/metrics from a background thread '''
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # scrapes every few seconds would flood the log
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving node metrics on port :{port}/metrics")
+    return server
@@ -0,0 +1,294 @@
+import logging, os, shutil, statistics, tempfile, threading, time
+import numpy as np
+import soundfile as sf
+import soxr
+
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from tracking.audiostream import AudioRingBuffer, StreamingCapture
+
+logger = logging.getLogger(__name__)
+
+def read_process_io() -> dict:
+    ''' bytes read and written by this process (linux /proc/self/io), empty if unavailable '''
+    try:
+        with open("/proc/self/io", "r") as filein:
+            return {key: int(value) for key, value in (line.split(":") for line in filein if ":" in line)}
+    except (OSError, ValueError):
+        return {}
+
+def to_capture_format(samples: np.ndarray, rate: int, channels: int, capture_rate: int) -> np.ndarray:
+    ''' int16 (frames, channels) audio converted to what arecord would capture with these settings '''
+    if samples.shape[1] != channels:
+        mono = samples.mean(axis=1)
+        samples = np.repeat(mono[:, None], channels, axis=1).astype(np.int16)
+    if rate != capture_rate:
+        samples = soxr.resample(samples, rate, capture_rate)
+    return samples
+
+
+class ReplayStats:
+    """
+    Timings of each chunk of replayed audio, from when it would have been captured (arecord
+    closing the file, or the last sample of the window streamed) until its detections are saved.
+
+    Chunks are keyed by recording file name in files capture mode and by window start time
+    when streaming.
+    """
+
+    def __init__(self):
+        self.chunks = {}
+        self.condition = threading.Condition()
+        self.started_at = None
+        self.io_start = {}
+        self.source_bytes = 0 # replay's own reads of the wav files, not counted as node I/O
+
+    def begin(self):
+        self.started_at = time.perf_counter()
+        self.io_start = read_process_io()
+
+    def released(self, key, audio_secs: float):
+        with self.condition:
+            self.chunks[key] = {'audio_secs': audio_secs, 'released': time.perf_counter()}
+
+    def started(self, key):
+        with self.condition:
+            if key in self.chunks:
+                self.chunks[key]['started'] = time.perf_counter()
+
+    def completed(self, key, detections: int = 0, skipped: bool = False):
+        with self.condition:
+            if key in self.chunks:
+                self.chunks[key].update(completed=time.perf_counter(), detections=detections, skipped=skipped)
+            self.condition.notify_all()
+
+    def completed_count(self) -> int:
+        return sum(1 for chunk in self.chunks.values() if 'completed' in chunk)
+
+    def wait_for_completed(self, count: int, stopped: threading.Event = None):
+        ''' block until count chunks are done (or stopped is set) '''
+        with self.condition:
+            while self.completed_count() < count and not (stopped and stopped.is_set()):
+                self.condition.wait(1)
+
+    def summary(self) -> dict:
+        io_end = read_process_io()
+        with self.condition:
+            done = [chunk for chunk in self.chunks.values() if 'completed' in chunk]
+        analyzed = [chunk for chunk in done if not chunk['skipped']]
+        latencies = sorted(chunk['completed'] - chunk['released'] for chunk in analyzed)
+        busy_secs = sum(chunk['completed'] - chunk.get('started', chunk['released']) for chunk in analyzed)
+        wall_secs = max((chunk['completed'] for chunk in done), default=self.started_at) - self.started_at
+        audio_secs = sum(chunk['audio_secs'] for chunk in analyzed)
+        detections = sum(chunk['detections'] for chunk in analyzed)
+        summary = {
+            'chunks': len(analyzed),
+            'skipped': len(done) - len(analyzed),
+            'audio_secs': round(audio_secs, 1),
+            'wall_secs': round(wall_secs, 1),
+            'mean_latency_secs': round(statistics.mean(latencies), 3) if latencies else None,
+            'p95_latency_secs': round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+            'max_latency_secs': round(latencies[-1], 3) if latencies else None,
+            'realtime_factor': round(audio_secs / busy_secs, 1) if busy_secs else None, # audio secs per second of analysis
+            'detections': detections,
+            'detections_per_sec': round(detections / wall_secs, 2) if wall_secs else None,
+        }
+        if self.io_start and io_end:
+            summary['read_mb'] = round(max(0, io_end['rchar'] - self.io_start['rchar'] - self.source_bytes) / 2**20, 1)
+            summary['written_mb'] = round((io_end['wchar'] - self.io_start['wchar']) / 2**20, 1)
+            summary['disk_written_mb'] = round((io_end['write_bytes'] - self.io_start['write_bytes']) / 2**20, 1)
+        return summary
+
+def print_replay_summary(summary: dict):
+    print("Replay results")
+    for key, value in summary.items():
+        print(f"  {key:<20}{value}")
+
+
+class ReplayRecordings:
+    """
+    Stands in for arecord in files capture mode: each wav of a directory is converted to the
+    capture format (channels, sample rate) up front, then copied into the recording directory
+    under the name arecord would give it, so the directory watcher, scheduler and analysis see
+    exactly what they would live.
+
+    Recordings are released as they would finish recording at speed times realtime, or with
+    speed 0 as soon as the previous one is done (pure analysis throughput, no queueing).
+
+    Args:
+        replay_directory (Path): Directory of wav files, replayed in name order.
+        recording_dir (Path): Directory the node watches for new recordings.
+        channels (int): Number of channels arecord would capture.
+        sample_rate (int): Sample rate arecord would capture at in Hz.
+        speed (float): Multiple of realtime to release recordings at, 0 for as fast as possible.
+    """
+
+    def __init__(self, replay_directory: Path, recording_dir: Path, channels: int = 2, sample_rate: int = 48000, speed: float = 1.0):
+        self.recording_dir = Path(recording_dir)
+        self.speed = speed
+        self.stats = ReplayStats()
+        self.stopped = threading.Event()
+        self.staging_directory = tempfile.TemporaryDirectory(prefix="replay-")
+
+        ''' conversion happens before the replay starts, so it isn't measured '''
+        self.staged = [] # (staged path, duration secs)
+        for wav_path in sorted(Path(replay_directory).glob("*.wav")):
+            try:
+                samples, rate = sf.read(str(wav_path), dtype="int16", always_2d=True)
+            except Exception as e:
+                logger.warning(f"Skipping {wav_path} in replay: {e}")
+                continue
+            samples = to_capture_format(samples, rate, channels, sample_rate)
+            staged_path = Path(self.staging_directory.name) / wav_path.name
+            sf.write(str(staged_path), samples, sample_rate, format="WAV", subtype="PCM_16")
+            self.staged.append((staged_path, len(samples) / sample_rate))
+        if not self.staged:
+            raise ValueError(f"No wav files found in {replay_directory}")
+        logger.info(f"Replaying {len(self.staged)} recordings ({sum(duration for _, duration in self.staged):.0f}s of audio) from {replay_directory} at " + (f"{speed}x realtime" if speed > 0 else "max speed"))
+
+    def start(self, on_finished=None):
+        ''' release recordings in a background thread, on_finished is called once all of them are analyzed '''
+        threading.Thread(target=self._run, args=(on_finished,), daemon=True).start()
+
+    def _run(self, on_finished):
+        self.stats.begin()
+        start_time = datetime.now()
+        started = time.perf_counter()
+        offset = 0.0
+        name_time = None
+        for index, (staged_path, duration) in enumerate(self.staged):
+            if self.speed > 0:
+                ''' arecord closes a file once all of its audio has been captured '''
+                if self.stopped.wait(max(0.0, started + (offset + duration) / self.speed - time.perf_counter())):
+                    break
+            else:
+                self.stats.wait_for_completed(index, self.stopped)
+                if self.stopped.is_set():
+                    break
+
+            ''' named like arecord's --use-strftime files, at least 1s apart so names don't collide '''
+            name_time = max(start_time + timedelta(seconds=offset), name_time + timedelta(seconds=1)) if name_time else start_time
+            name = name_time.strftime("%Y-%m-%d-birdnet-%H:%M:%S.wav")
+            self.stats.released(name, duration)
+            self.stats.source_bytes += os.path.getsize(staged_path)
+            shutil.copyfile(staged_path, self.recording_dir / name)
+            offset += duration
+
+        self.stats.wait_for_completed(len(self.staged), self.stopped)
+        self.staging_directory.cleanup()
+        if on_finished is not None:
+            on_finished()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class ReleasingRingBuffer(AudioRingBuffer):
+    """ ring buffer that reports each full window of audio to ReplayStats as it is written """
+
+    def __init__(self, capacity_samples: int, window_samples: int, on_window):
+        super().__init__(capacity_samples)
+        self.window_samples = window_samples
+        self.on_window = on_window
+        self.windows_released = 0
+
+    def write(self, samples: np.ndarray):
+        super().write(samples)
+        while self.write_pos >= (self.windows_released + 1) * self.window_samples:
+            self.on_window(self.windows_released)
+            self.windows_released += 1
+
+
+class WavReplayProcess:
+    """
+    Stands in for the arecord process of StreamingCapture: stdout.read() returns raw PCM in the
+    capture format, read from a directory of wav files one at a time and paced like live audio.
+    """
+
+    def __init__(self, wav_paths: list, capture_rate: int, channels: int, speed: float, ring_buffer: ReleasingRingBuffer, stats: ReplayStats):
+        self.wav_paths = list(wav_paths)
+        self.capture_rate = capture_rate
+        self.channels = channels
+        self.speed = speed
+        self.ring_buffer = ring_buffer
+        self.stats = stats
+        self.stdout = self
+        self.pending = b""
+        self.served_bytes = 0
+        self.started = None
+        self.stopped = threading.Event()
+
+    def _next_file(self) -> bool:
+        while self.wav_paths:
+            wav_path = self.wav_paths.pop(0)
+            try:
+                samples, rate = sf.read(str(wav_path), dtype="int16", always_2d=True)
+            except Exception as e:
+                logger.warning(f"Skipping {wav_path} in replay: {e}")
+                continue
+            self.stats.source_bytes += os.path.getsize(wav_path)
+            self.pending = to_capture_format(samples, rate, self.channels, self.capture_rate).tobytes()
+            return True
+        return False
+
+    def read(self, size: int) -> bytes:
+        if self.started is None:
+            self.started = time.perf_counter()
+        if self.stopped.is_set() or (not self.pending and not self._next_file()):
+            return b""
+
+        if self.speed > 0:
+            bytes_per_sec = 2 * self.channels * self.capture_rate
+            self.stopped.wait(max(0.0, self.started + (self.served_bytes + size) / bytes_per_sec / self.speed - time.perf_counter()))
+        else:
+            ''' as fast as the analyzer keeps up: hold back while a whole window is waiting to be analyzed '''
+            with self.ring_buffer.condition:
+                while self.ring_buffer.write_pos - self.ring_buffer.read_pos >= self.ring_buffer.window_samples and not self.stopped.is_set():
+                    self.ring_buffer.condition.wait(0.1)
+
+        data, self.pending = self.pending[:size], self.pending[size:]
+        self.served_bytes += len(data)
+        return data
+
+    def terminate(self):
+        self.stopped.set()
+
+    def wait(self):
+        return 0
+
+
+class ReplayCapture(StreamingCapture):
+    """
+    StreamingCapture fed from a directory of wav files instead of arecord. The files are played
+    back to back as one stream, through the same downmix, resampling and ring buffer as live audio.
+
+    Args:
+        replay_directory (Path): Directory of wav files, replayed in name order.
+        capture_rate (int): Sample rate arecord would capture at in Hz.
+        channels (int): Number of channels arecord would capture.
+        window_secs (float): Seconds of audio per analyzed window.
+        speed (float): Multiple of realtime to stream at, 0 for as fast as the analyzer keeps up.
+    """
+
+    def __init__(self, replay_directory: Path, capture_rate: int = 48000, channels: int = 2, window_secs: float = 15, speed: float = 1.0):
+        super().__init__("replay", capture_rate=capture_rate, channels=channels)
+        self.wav_paths = sorted(Path(replay_directory).glob("*.wav"))
+        if not self.wav_paths:
+            raise ValueError(f"No wav files found in {replay_directory}")
+        self.speed = speed
+        self.window_secs = window_secs
+        self.stats = ReplayStats()
+        window_samples = int(window_secs * self.rate)
+        self.ring_buffer = ReleasingRingBuffer(self.ring_buffer.capacity, window_samples, self._on_window)
+        logger.info(f"Replaying {len(self.wav_paths)} recordings from {replay_directory} at " + (f"{speed}x realtime" if speed > 0 else "max speed"))
+
+    def _on_window(self, index: int):
+        ''' keyed by the start time windows() gives the window '''
+        self.stats.released(self.start_time + timedelta(seconds=index * self.ring_buffer.window_samples / self.rate), self.window_secs)
+
+    def start(self):
+        self.process = WavReplayProcess(self.wav_paths, self.capture_rate, self.channels, self.speed, self.ring_buffer, self.stats)
+        self.start_time = datetime.now()
+        self.stats.begin()
+        threading.Thread(target=self._read_loop, daemon=True).start()
@@ -0,0 +1,143 @@
+import logging, os, shutil, threading, time
+
+from collections import deque
+from pathlib import Path
+
+from watchdog.observers import Observer
+from watchdog.events import PatternMatchingEventHandler
+
+logger = logging.getLogger(__name__)
+
+BACKLOG_POLICIES = ["none", "skip-alternate", "lite-model", "catch-up"]
+
+class AnalysisScheduler:
+    """
+    Queue between the recordings arecord writes and the analyzer, that measures and reacts to backlog.
+
+    When more than max_backlog recordings are waiting the node is behind, and the policy decides
+    what happens:
+        none: analyze everything in order, only log the lag.
+        skip-alternate: analyze every other queued recording until caught up.
+        lite-model: analyze with the lighter model until caught up.
+        catch-up: move the oldest waiting recordings to a catch-up directory, which is analyzed
+            (oldest first) whenever the live queue is empty. It survives restarts.
+
+    Args:
+        analyze (callable): analyze(path, lightweight) analyzes one recording.
+        skip (callable): skip(path) handles a recording that will not be analyzed.
+        policy (str): One of BACKLOG_POLICIES.
+        max_backlog (int): Number of waiting recordings above which the node is behind.
+        catchup_directory (Path): Directory for the catch-up policy's spilled recordings.
+        lag_log_interval (float): Minimum seconds between lag warnings.
+    """
+
+    def __init__(self, analyze, skip, policy: str = "none", max_backlog: int = 4, catchup_directory: Path = None, lag_log_interval: float = 60):
+        if policy not in BACKLOG_POLICIES:
+            raise ValueError(f"Unknown backlog policy: {policy}")
+        self.analyze = analyze
+        self.skip = skip
+        self.policy = policy
+        self.max_backlog = max_backlog
+        self.catchup_directory = Path(catchup_directory) if catchup_directory else None
+        self.lag_log_interval = lag_log_interval
+        self.queue = deque() # (path, time queued)
+        self.condition = threading.Condition()
+        self.skip_next = False
+        self.last_lag_log = 0
+        self.analyzed_count = 0
+        self.skipped_count = 0
+        self.spilled_count = 0
+        self.stopped = False
+
+        ''' recordings spilled before a restart are still waiting to be caught up on '''
+        self.catchup_queue = deque()
+        if self.policy == "catch-up" and self.catchup_directory:
+            os.makedirs(self.catchup_directory, exist_ok=True)
+            self.catchup_queue.extend(sorted(self.catchup_directory.glob("*.wav")))
+
+    def enqueue(self, path: Path):
+        with self.condition:
+            self.queue.append((Path(path), time.time()))
+            self.condition.notify()
+
+    def stats(self) -> dict:
+        ''' current backlog, lag is how long the oldest waiting recording has been queued '''
+        with self.condition:
+            lag = time.time() - self.queue[0][1] if self.queue else 0.0
+            return {
+                'backlog': len(self.queue),
+                'lag_secs': lag,
+                'catchup_backlog': len(self.catchup_queue),
+                'analyzed': self.analyzed_count,
+                'skipped': self.skipped_count,
+                'spilled': self.spilled_count,
+            }
+
+    def _spill(self):
+        ''' must be called with the condition held, moves the oldest waiting recordings to the catch-up directory '''
+        while len(self.queue) > self.max_backlog:
+            path, _ = self.queue.popleft()
+            destination = self.catchup_directory / path.name
+            try:
+                shutil.move(str(path), str(destination))
+            except OSError as e:
+                logger.error(f"Could not move {path} to catch-up directory: {e}")
+                continue
+            self.catchup_queue.append(destination)
+            self.spilled_count += 1
+
+    def next_task(self):
+        ''' block until there is a recording to analyze, returns (path, lightweight) or (None, None) to skip it '''
+        with self.condition:
+            while not self.queue and not self.catchup_queue and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                return None, None
+
+            behind = len(self.queue) > self.max_backlog
+            if behind and time.time() - self.last_lag_log >= self.lag_log_interval:
+                self.last_lag_log = time.time()
+                logger.warning(f"Audio analysis is behind: {len(self.queue)} recordings waiting, oldest queued {time.time() - self.queue[0][1]:.0f}s ago (policy={self.policy})")
+
+            if behind and self.policy == "catch-up" and self.catchup_directory:
+                self._spill()
+
+            if not self.queue:
+                ''' live queue is empty, so use the idle time to work through the catch-up queue '''
+                return self.catchup_queue.popleft(), False
+
+            path, _ = self.queue.popleft()
+            if behind and self.policy == "skip-alternate":
+                self.skip_next = not self.skip_next
+                if self.skip_next:
+                    self.skipped_count += 1
+                    self.skip(path)
+                    return None, None
+            else:
+                self.skip_next = False
+            return path, (behind and self.policy == "lite-model")
+
+    def stop(self):
+        ''' run returns once the recording being analyzed is done '''
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def run(self):
+        ''' analyze recordings as they are queued (doesn't return until stopped) '''
+        while not self.stopped:
+            path, lightweight = self.next_task()
+            if path is None:
+                continue
+            self.analyze(path, lightweight)
+            self.analyzed_count += 1
+
+
+def watch_recordings(recording_directory: Path, on_new_recording) -> Observer:
+    ''' call on_new_recording(path) for each wav arecord finishes writing in recording_directory '''
+    event_handler = PatternMatchingEventHandler(patterns=["*.wav"], ignore_directories=True, case_sensitive=True)
+    event_handler.on_closed = lambda event: on_new_recording(Path(event.src_path))
+    observer = Observer()
+    observer.schedule(event_handler, str(recording_directory), recursive=False)
+    observer.start()
+    return observer
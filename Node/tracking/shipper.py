@@ -0,0 +1,129 @@
+import gzip, json, logging, os, threading, time, uuid
+import requests
+
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class DetectionsShipper:
+    """
+    Pushes detections to the server's /api/ingest endpoint in gzipped batches.
+
+    Each batch is written to a local spool directory (fsynced) before it is sent, and only
+    removed once the server acknowledges it, so detections survive network outages and restarts
+    (at-least-once delivery). Every batch carries a unique batch id that the server remembers,
+    so a batch resent after a lost response is not inserted twice.
+
+    Args:
+        server_url (str): Base url of the server, e.g. http://192.168.1.10:8080
+        spool_directory (Path): Directory batches wait in until the server has them.
+        node_name (str): Name of the node.
+        token (str): Shared token the server expects (--ingest-token on the server), optional.
+        batch_size (int): Detections that trigger a batch.
+        flush_interval (float): Max seconds a detection waits before its (partial) batch is spooled.
+        max_retry_interval (float): Max seconds between retries while the server is unreachable.
+        timeout (float): Seconds to wait for the server to respond.
+    """
+
+    def __init__(self, server_url: str, spool_directory: Path, node_name: str, token: str = None, batch_size: int = 100, flush_interval: float = 10.0, max_retry_interval: float = 300.0, timeout: float = 10.0):
+        self.ingest_url = server_url.rstrip("/") + "/api/ingest"
+        self.spool_directory = Path(spool_directory)
+        self.node_name = node_name
+        self.headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retry_interval = max_retry_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.spooled = threading.Event()
+        self.pending = []
+        self.oldest_pending = None
+        self.sent_batches = 0
+        self.failed_attempts = 0
+        os.makedirs(self.spool_directory, exist_ok=True)
+
+        ''' remove temp files from a spool write that was interrupted, the batch was never committed '''
+        for tmp_path in self.spool_directory.glob("*.tmp"):
+            os.remove(tmp_path)
+
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def ship(self, rows: list):
+        ''' queue formatted detection rows to be pushed to the server '''
+        with self.lock:
+            self.pending.extend(rows)
+            if self.oldest_pending is None:
+                self.oldest_pending = time.time()
+            if len(self.pending) >= self.batch_size:
+                self._spool()
+
+    def _spool(self):
+        ''' must be called with the lock held, writes the pending rows to the spool as one batch '''
+        if not self.pending:
+            return
+        batch_id = uuid.uuid4().hex
+        data = gzip.compress(json.dumps({"batch_id": batch_id, "node_name": self.node_name, "detections": self.pending}).encode())
+        batch_path = self.spool_directory / Path(f"{time.time_ns()}-{batch_id}.json.gz") # name sorts oldest first
+        tmp_path = batch_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as fileout:
+            fileout.write(data)
+            fileout.flush()
+            os.fsync(fileout.fileno())
+        os.replace(tmp_path, batch_path)
+        logger.debug(f"Spooled batch {batch_id} with {len(self.pending)} detections")
+        self.pending = []
+        self.oldest_pending = None
+        self.spooled.set()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(min(1.0, self.flush_interval))
+            with self.lock:
+                if self.oldest_pending is not None and time.time() - self.oldest_pending >= self.flush_interval:
+                    self._spool()
+
+    def backlog(self) -> int:
+        ''' number of batches in the spool waiting to be sent '''
+        return len(list(self.spool_directory.glob("*.json.gz")))
+
+    def _send(self, batch_path: Path) -> bool:
+        with open(batch_path, "rb") as filein:
+            data = filein.read()
+        try:
+            response = requests.post(self.ingest_url, data=data, headers=self.headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Could not reach server to push detections: {e}")
+            return False
+        if response.status_code == 400:
+            ''' server can't parse it, resending won't help '''
+            logger.error(f"Server rejected detections batch {batch_path.name}, moving it aside: {response.text}")
+            os.replace(batch_path, batch_path.with_suffix(".rejected"))
+            return True
+        if not response.ok:
+            logger.warning(f"Server returned {response.status_code} while pushing detections: {response.text}")
+            return False
+        os.remove(batch_path)
+        self.sent_batches += 1
+        return True
+
+    def _send_loop(self):
+        ''' send spooled batches oldest first, backing off while the server is unreachable '''
+        retry_interval = 1.0
+        while True:
+            self.spooled.wait(self.flush_interval)
+            self.spooled.clear()
+            for batch_path in sorted(self.spool_directory.glob("*.json.gz")):
+                if not self._send(batch_path):
+                    self.failed_attempts += 1
+                    time.sleep(retry_interval)
+                    retry_interval = min(retry_interval * 2, self.max_retry_interval)
+                    break
+                retry_interval = 1.0
+
+    def close(self):
+        ''' spool anything pending, it is sent the next time the node starts if the server doesn't have it yet '''
+        with self.lock:
+            self._spool()
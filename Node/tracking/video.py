@@ -1,36 +1,118 @@
 import logging
+import threading
 import time
 import cv2
 from flask import Flask, Response
 
+from tracking.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
-def look_for_birds(camera_int: int, node_name: str):
-    logger.info(f"Starting Bird Video Stream: {str(camera_int)} to port :5000/" + node_name)
-    
-    app = Flask(__name__)
+class CameraStream:
+    """
+    Dedicated capture thread for the node camera that JPEG encodes each frame once and shares the
+    latest frame with every viewer.
+
+    Frames are scaled down to max_width and published at most max_fps times a second, frames in
+    between are only grabbed (not decoded) to keep the camera current. Nothing is decoded or
+    encoded while nobody is watching.
 
-    video_source = camera_int 
-    camera = cv2.VideoCapture(video_source)
+    Args:
+        camera_int (int): X of camera device where device name = /dev/videoX.
+        max_width (int): Width frames are scaled down to (0 keeps the camera resolution).
+        jpeg_quality (int): Quality of the JPEG frames sent to viewers (0-100).
+        max_fps (float): Max frames per second sent to viewers (0 for no limit).
+    """
 
-    def generate_frames():
+    def __init__(self, camera_int: int, max_width: int = 640, jpeg_quality: int = 80, max_fps: float = 10):
+        self.camera_int = camera_int
+        self.max_width = max_width
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+        self.min_frame_secs = 1 / max_fps if max_fps else 0
+        self.condition = threading.Condition()
+        self.frame_bytes = None
+        self.frame_id = 0
+        self.subscribers = 0
+        self.camera = None
+
+    def start(self):
+        self.camera = cv2.VideoCapture(self.camera_int)
+        if self.max_width:
+            ''' ask the camera for a smaller mode, so less has to be scaled down '''
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.max_width)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        last_publish = 0.0
+        grabbed, published, rate_start = 0, 0, time.time()
         while True:
-            # Capture frame-by-frame
-            success, frame = camera.read()
+            if not self.camera.grab():
+                logger.warning(f"Could not read from camera {self.camera_int}, retrying")
+                time.sleep(1)
+                continue
+            grabbed += 1
+
+            ''' frame rates are reported every 10s '''
+            now = time.time()
+            if now - rate_start >= 10:
+                metrics.set('birdnode_video_capture_fps', grabbed / (now - rate_start))
+                metrics.set('birdnode_video_publish_fps', published / (now - rate_start))
+                metrics.set('birdnode_video_viewers', self.subscribers)
+                grabbed, published, rate_start = 0, 0, now
+
+            ''' only decode, scale and encode frames that will be sent '''
+            if not self.subscribers or now - last_publish < self.min_frame_secs:
+                continue
+            success, frame = self.camera.retrieve()
             if not success:
-                break
-            else:
-                # Encode the frame as JPEG
-                _, buffer = cv2.imencode('.jpg', frame)
-                frame = buffer.tobytes()
+                continue
+            last_publish = now
+
+            encode_start = time.perf_counter()
+            if self.max_width and frame.shape[1] > self.max_width:
+                height = int(frame.shape[0] * self.max_width / frame.shape[1])
+                frame = cv2.resize(frame, (self.max_width, height), interpolation=cv2.INTER_AREA)
+            ret, buffer = cv2.imencode('.jpg', frame, self.encode_params)
+            if not ret:
+                continue
+            metrics.observe('birdnode_video_encode_seconds', time.perf_counter() - encode_start)
+            published += 1
+            with self.condition:
+                self.frame_bytes = buffer.tobytes()
+                self.frame_id += 1
+                self.condition.notify_all()
+
+    def subscribe(self):
+        ''' multipart jpeg generator for one viewer, a slow viewer skips frames instead of falling behind '''
+        with self.condition:
+            self.subscribers += 1
+        last_frame_id = 0
+        try:
+            while True:
+                with self.condition:
+                    if not self.condition.wait_for(lambda: self.frame_id > last_frame_id, timeout=5.0):
+                        continue
+                    last_frame_id, frame_bytes = self.frame_id, self.frame_bytes
                 # Yield the frame as part of an HTTP response
                 yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+def look_for_birds(camera_int: int, node_name: str, max_width: int = 640, jpeg_quality: int = 80, max_fps: float = 10, metrics_queue=None):
+    metrics.connect(metrics_queue, "video")
+    logger.info(f"Starting Bird Video Stream: {str(camera_int)} to port :5000/" + node_name)
+
+    app = Flask(__name__)
+
+    camera_stream = CameraStream(camera_int, max_width=max_width, jpeg_quality=jpeg_quality, max_fps=max_fps)
+    camera_stream.start()
 
     @app.route('/' + node_name)
     def video_feed():
         # Stream the video frames to the browser
-        return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        return Response(camera_stream.subscribe(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
     # run flask server with video stream on port 5000
-    app.run(host='0.0.0.0', port=5000)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
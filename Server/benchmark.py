@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Bird Identification Tool Server Data Layer Benchmarks
+- writes synthetic detections jsonl files (realistic species mix, dawn/dusk activity, several nodes and days)
+- times parsing, aggregation, chart options and the sqlite database at each size
+- appends results to a jsonl file and compares them with the previous run, so regressions between versions show up
+"""
+import argparse, json, logging, math, os, platform, random, resource, subprocess, tempfile, time, tracemalloc
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import webui #internal pacakage
+from webui.aggregates import DetectionAggregates #internal package
+
+logger = logging.getLogger(__name__)
+
+GENERA = ["American", "Northern", "Eastern", "Tufted", "Black-capped", "Downy", "Hairy", "Red-bellied", "White-breasted", "Song",
+          "Chipping", "House", "Carolina", "Blue", "Mourning", "Red-winged", "Common", "Cedar", "Dark-eyed", "Ruby-crowned"]
+BIRDS = ["Robin", "Cardinal", "Bluebird", "Titmouse", "Chickadee", "Woodpecker", "Nuthatch", "Sparrow", "Wren", "Jay",
+         "Dove", "Blackbird", "Grackle", "Waxwing", "Junco", "Kinglet", "Finch", "Crow", "Goldfinch", "Phoebe"]
+
+
+def generate_detections_file(file_path: Path, rows: int, species: int = 40, nodes: int = 3, days: int = 7, seed: int = 0) -> Path:
+    ''' write rows detections in time order, species follow a zipf like mix and activity peaks at dawn and dusk '''
+    rng = random.Random(seed)
+    names = [(f"{GENERA[i % len(GENERA)]} {BIRDS[(i // len(GENERA) + i) % len(BIRDS)]}", f"Genus species{i}") for i in range(species)]
+    species_weights = [1 / (rank + 1) for rank in range(species)]
+    node_names = [f"node-{n + 1}" for n in range(nodes)]
+    locations = [(round(42.0 + rng.random() / 100, 4), round(-74.2 - rng.random() / 100, 4)) for _ in range(nodes)]
+    hour_weights = [math.exp(-((hour - 6.5) ** 2) / 4) + 0.6 * math.exp(-((hour - 18.5) ** 2) / 4) + 0.05 for hour in range(24)]
+
+    start_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    offsets = sorted(
+        day * 86400 + hour * 3600 + rng.random() * 3600
+        for day, hour in zip((rng.randrange(days) for _ in range(rows)), rng.choices(range(24), weights=hour_weights, k=rows))
+    )
+    with open(file_path, "w") as fileout:
+        for offset in offsets:
+            start = start_day + timedelta(seconds=offset)
+            common_name, scientific_name = rng.choices(names, weights=species_weights)[0]
+            node = rng.randrange(nodes)
+            recording_start = start - timedelta(seconds=start.second % 15, microseconds=start.microsecond)
+            fileout.write(json.dumps({
+                "start_ts": start.strftime("%Y-%m-%dT%H:%M:%S"),
+                "end_ts": (start + timedelta(seconds=3)).strftime("%Y-%m-%dT%H:%M:%S"),
+                "confidence": round(min(0.99, 0.2 + rng.betavariate(2, 3)), 2),
+                "common_name": common_name,
+                "scientific_name": scientific_name,
+                "location": str(locations[node]),
+                "node_name": node_names[node],
+                "filename": f"audio_recordings/{recording_start.strftime('%Y-%m-%d-birdnet-%H:%M:%S')}.wav",
+                "lat": locations[node][0],
+                "lon": locations[node][1],
+                "start_epoch": round(start.timestamp(), 3),
+                "end_epoch": round(start.timestamp() + 3, 3),
+            }) + "\n")
+    return file_path
+
+
+def measure(step, repeat: int = 1, memory: bool = True) -> dict:
+    ''' best wall time of repeat runs, and peak python memory of one run (traced separately so it doesn't skew the time) '''
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        step()
+        timings.append(time.perf_counter() - started)
+    result = {'secs': round(min(timings), 6)}
+    if memory:
+        tracemalloc.start()
+        step()
+        result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+    return result
+
+
+def benchmark_size(file_path: Path, repeat: int, memory: bool) -> dict:
+    ''' time each data layer step on one detections file '''
+    results = {}
+    results['parse'] = measure(lambda: webui.generate_table_data_from_file(file_path), repeat, memory)
+    rows = webui.generate_table_data_from_file(file_path)
+    results['aggregate'] = measure(lambda: DetectionAggregates(rows), repeat, memory)
+    aggregates = DetectionAggregates(rows)
+    results['pie_options'] = measure(lambda: webui.pie_chart_options("species-distro", aggregates), repeat, memory)
+    results['bar_options'] = measure(lambda: webui.bar_chart_options("species-confidence", aggregates), repeat, memory)
+    results['hourly_options'] = measure(lambda: webui.bar_chart_options("hourly-detections", aggregates), repeat, memory)
+    results['line_options'] = measure(lambda: webui.line_chart_options(aggregates), repeat, memory)
+
+    ''' main page, the store loads today's file from scratch and aggregates it '''
+    with tempfile.TemporaryDirectory() as store_directory:
+        store = webui.DetectionsStore(Path(store_directory))
+        os.symlink(file_path.resolve(), store.detections_file_for(datetime.now().strftime("%Y-%m-%d")))
+        def load_store():
+            store.date_str = None # forces a reload from the start of the file
+            store.refresh()
+            store.get_aggregates()
+        results['store_load'] = measure(load_store, repeat, memory)
+
+    ''' /analysis charts of past days, building a closed day's rollup and merging it back from its file '''
+    with tempfile.TemporaryDirectory() as rollup_directory:
+        rollup_store = webui.RollupStore(Path(rollup_directory), detections_store=None) # today is never queried
+        date_str = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        os.symlink(file_path.resolve(), rollup_store.detections_file_for(date_str))
+        results['rollup_build'] = measure(lambda: rollup_store.build_day(date_str), repeat, memory)
+        def query_rollup():
+            rollup_store.cache = {} # read the rollup file each time, like the first view after a restart
+            rollup_store.query(date_str, date_str)
+        results['rollup_query'] = measure(query_rollup, repeat, memory)
+
+    ''' sqlite ingest (fresh database each run) and the /analysis table queries '''
+    with tempfile.TemporaryDirectory() as database_directory:
+        def ingest():
+            database_path = Path(database_directory) / f"{time.time_ns()}.db"
+            database = webui.DetectionsDatabase(database_path, file_path.parent)
+            database.ingest_file(file_path)
+            database.close()
+        results['db_ingest'] = measure(ingest, 1, False)
+
+        database = webui.DetectionsDatabase(Path(database_directory) / "query.db", file_path.parent)
+        database.ingest_file(file_path)
+        results['db_count'] = measure(lambda: database.count_detections(), repeat, False)
+        results['db_page'] = measure(lambda: database.query_page(sort_by="confidence", descending=True, offset=0, limit=50), repeat, False)
+        database.close()
+    return results
+
+
+def git_label() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results(results_file: Path, label: str) -> dict:
+    ''' most recent result of another label for each (rows, step) '''
+    previous = {}
+    if not results_file.exists():
+        return previous
+    with open(results_file, "r") as filein:
+        for line in filein:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get('label') != label:
+                previous[(result['rows'], result['step'])] = result
+    return previous
+
+
+def main(sizes: list, species: int, nodes: int, days: int, data_directory: Path, results_file: Path, label: str, repeat: int, memory: bool):
+    os.makedirs(data_directory, exist_ok=True)
+    previous = previous_results(results_file, label)
+    run_info = {'label': label, 'run_ts': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"), 'python': platform.python_version(), 'machine': platform.machine()}
+
+    print(f"{'rows':>9} {'step':<16}{'secs':>11}{'peak MB':>9}{'previous':>11}{'change':>9}")
+    with open(results_file, "a") as fileout:
+        for rows in sizes:
+            file_path = data_directory / f"detections-synthetic-{rows}-{species}-{nodes}-{days}.jsonl"
+            if not file_path.exists():
+                logger.info(f"Generating {rows} synthetic detections in {file_path}")
+                generate_detections_file(file_path, rows, species, nodes, days)
+
+            for step, result in benchmark_size(file_path, repeat, memory).items():
+                record = dict(run_info, rows=rows, step=step, **result)
+                fileout.write(json.dumps(record) + "\n")
+
+                before = previous.get((rows, step))
+                change = f"{(result['secs'] / before['secs'] - 1) * 100:+.0f}%" if before and before['secs'] else ""
+                print(f"{rows:>9} {step:<16}{result['secs']:>11.6f}{str(result.get('peak_mb', '')):>9}{format(before['secs'], '.6f') if before else '':>11}{change:>9}")
+
+    print(f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB, results appended to {results_file} as '{label}'")
+
+
+def parse_args():
+    '''Parse command line arguments.'''
+    parser = argparse.ArgumentParser()
+
+    input_group = parser.add_argument_group("Input")
+    input_group.add_argument("--sizes",type=int,nargs="*",required=False,default=[1000, 100000, 1000000],help="Number of detections rows to benchmark at, default is 1000 100000 1000000")
+    input_group.add_argument("--species",type=int,required=False,default=40,help="Number of species in the synthetic detections, default is 40")
+    input_group.add_argument("--nodes",type=int,required=False,default=3,help="Number of nodes in the synthetic detections, default is 3")
+    input_group.add_argument("--days",type=int,required=False,default=7,help="Number of days the synthetic detections span, default is 7")
+    input_group.add_argument("--repeat",type=int,required=False,default=3,help="Runs of each step, the fastest is reported, default is 3")
+    input_group.add_argument("--skip-memory",action="store_true",help="Don't trace peak memory of each step (tracing runs each step once more)")
+
+    output_group = parser.add_argument_group("Output")
+    output_group.add_argument("--data-directory",type=Path,required=False,default=Path("./benchmark_data/"),help="Path to directory the synthetic detections files are written to (reused between runs)")
+    output_group.add_argument("--results-file",type=Path,required=False,default=Path("./benchmark_results.jsonl"),help="Path to jsonl file results are appended to")
+    output_group.add_argument("--label",type=str,required=False,help="Label of this run in the results file, default is the git commit")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main(args.sizes, args.species, args.nodes, args.days, args.data_directory, args.results_file, args.label or git_label(), args.repeat, not args.skip_memory)
@@ -16,42 +16,84 @@ import webui #internal pacakage
 logger = logging.getLogger(__name__)
 
 
-def main(detections_directory: Path, directory_watcher: Path, video_streams, authentication: bool, analyze_video: bool, model_path: Path, skip_frames: int):
+def main(detections_directory: Path, database_path: Path, ingest_token: str, directory_watcher: Path, video_streams, authentication: bool, analyze_video: bool, model_path: Path, skip_frames: int, inference_fps: float, cpu_budget: float, motion_area: float, yolo_backend: str, imgsz: int, onnx_dynamic: bool, calibration_images: Path, profiling: bool, metrics_token: str, api_token: str,
+         recordings_directory: Path, clips_directory: Path, clips_cache_mb: float, clip_padding: float, rollups_directory: Path):
     ''' START '''
     date_today_str = datetime.now().strftime("%Y-%m-%d")
     logger.info("Starting Bird Server: " + str(date_today_str))
+
+    ''' /api/ingest isn't behind the login, so with authentication on nodes have to send a token '''
+    if authentication and not ingest_token:
+        raise ValueError("--authentication needs an --ingest-token, otherwise anyone on the network can push detections to /api/ingest")
+    if not ingest_token:
+        logger.warning("No --ingest-token set, /api/ingest accepts detections from anyone who can reach the server")
     
-    ''' Load detections data '''
-    detections_file = detections_directory / Path("detections-"+ datetime.now().strftime("%Y-%m-%d") + ".jsonl")
-    detections_data = webui.generate_table_data_from_file(detections_file)
+    ''' Load detections data, store tails today's file so new detections show up without a reload '''
+    detections_store = webui.DetectionsStore(detections_directory)
+
+    ''' Detections database covering every day, catch up on files then keep today's file ingested as it is tailed '''
+    detections_db = webui.DetectionsDatabase(database_path, detections_directory)
+    detections_db.ingest_directory()
+    detections_store.add_listener(lambda file_path, new_rows: detections_db.ingest_file(file_path))
+    detections_store.start_polling()
+
+    ''' Daily rollups, multi-day charts merge one small summary per day instead of reading every detection '''
+    rollup_store = webui.RollupStore(detections_directory, detections_store, rollup_directory=rollups_directory)
+    rollup_store.start()
+
+    ''' Storage usage monitor for the dashboard (If directory watcher provided) '''
+    storage_monitor = None
+    if directory_watcher:
+        storage_monitor = webui.StorageMonitor(directory_watcher)
+        storage_monitor.start()
 
     ''' Start Video Analyzer (If Enabeled)'''
     if analyze_video:
         port = 8001
-        logger.info(f"Starting YOLOv8 stream server on port {port}, with model {model_path}, and skip frames = {skip_frames}")
+        logger.info(f"Starting YOLOv8 stream server on port {port}, with model {model_path} ({yolo_backend}), and skip frames = {skip_frames or 'adaptive'}")
         video_streams = webui.start_yolo_stream_server(
             stream_urls=video_streams,
             port=port,
             model_path=model_path,
-            skip_frames=skip_frames
+            skip_frames=skip_frames,
+            inference_fps=inference_fps,
+            cpu_budget=cpu_budget,
+            motion_area=motion_area,
+            backend=yolo_backend,
+            imgsz=imgsz,
+            onnx_dynamic=onnx_dynamic,
+            calibration_directory=calibration_images
         )       
 
 
     ''' Authentication (WIP) with Login Route'''
     if authentication:
-        webui.initAuthentication()
+        webui.initAuthentication(metrics_token=metrics_token, api_token=api_token)
+
+    ''' Page timings, request timings and websocket traffic, served at /metrics '''
+    page_metrics = webui.PageMetrics(page_routes=['/', '/analysis', '/video', '/readme', '/login'])
+    webui.initPageMetrics(page_metrics)
+    webui.generateRouteMetrics(page_metrics=page_metrics)
+    if profiling:
+        logger.info("Sampling profiler enabled at /debug/profile")
+        webui.generateRouteProfiler()
 
     ''' Generate Main Route '''
     webui.generateRouteMain(
         authentication=authentication,
-        detections_data=detections_data,
-        directory_watcher=directory_watcher
+        detections_store=detections_store,
+        detections_db=detections_db,
+        storage_monitor=storage_monitor,
+        page_metrics=page_metrics
         )
     
     ''' Generate Analysis Route '''
     webui.generateRouteAnalysis(
         authentication=authentication,
-        detections_data=detections_data
+        detections_store=detections_store,
+        detections_db=detections_db,
+        rollup_store=rollup_store,
+        page_metrics=page_metrics
         )
     
     ''' Generate Video Route '''
@@ -60,13 +102,36 @@ def main(detections_directory: Path, directory_watcher: Path, video_streams, aut
         video_streams=video_streams
         )
     
+    ''' Generate Ingest Route, nodes push batches of detections here '''
+    webui.generateRouteIngest(
+        detections_db=detections_db,
+        detections_store=detections_store,
+        ingest_token=ingest_token
+        )
+
+    ''' Generate JSON Query API, responses are cached until new detections arrive '''
+    webui.generateRouteQueryApi(
+        detections_db=detections_db,
+        detections_store=detections_store,
+        rollup_store=rollup_store,
+        query_cache=webui.QueryCache(),
+        page_metrics=page_metrics
+        )
+
+    ''' Generate Clips Route, detections are played from short clips cut from the recordings '''
+    clip_store = webui.ClipStore(clips_directory, recordings_directory=recordings_directory, max_cache_bytes=int(clips_cache_mb * 1024 * 1024), padding=clip_padding)
+    webui.generateRouteClips(
+        detections_db=detections_db,
+        clip_store=clip_store
+        )
+
     ''' Generate Readme Route '''
     webui.generateReadmeRoute(
         authentication=authentication
         )        
          
     ''' RUN ''' 
-    ui.run(uvicorn_reload_includes='*.py, *.jsonl', storage_secret='THIS_NEEDS_TO_BE_CHANGED', show=False, favicon='🐦')
+    ui.run(uvicorn_reload_includes='*.py', storage_secret='THIS_NEEDS_TO_BE_CHANGED', show=False, favicon='🐦')
     
             
 def set_up_logging(packages, log_level, log_file):
@@ -89,12 +154,30 @@ def parse_args():
     # Command line arguments for input.
     input_group = parser.add_argument_group("Input")
     input_group.add_argument("--detections-directory",type=Path,required=False,default=Path("./detections/"),help="Path to directory where detections from node analyzers are saved")
+    input_group.add_argument("--database-path",type=Path,required=False,default=Path("./detections.db"),help="Path to sqlite database that detections are ingested into for multi-day queries")
+    input_group.add_argument("--rollups-directory",type=Path,required=False,help="Path to directory daily rollups are written to, default is <detections-directory>/rollups (set it when the detections directory is a read-only mount, rollups are only kept in memory if it can't be written)")
+    input_group.add_argument("--ingest-token",type=str,required=False,help="Shared token nodes must send to push detections to /api/ingest (required with --authentication, omit to accept any node)")
+    input_group.add_argument("--recordings-directory",type=Path,required=False,help="Path to directory the nodes' recordings are synced or mounted into (optionally a subdirectory per node name), detection clips are only cut from recordings in it")
+    input_group.add_argument("--clips-directory",type=Path,required=False,default=Path("./clips/"),help="Path to directory where clips of detections cut from the recordings are cached")
+    input_group.add_argument("--clips-cache-mb",type=float,required=False,default=200,help="size in MB the clips cache is kept under, the least recently played clips are removed first, default is 200")
+    input_group.add_argument("--clip-padding",type=float,required=False,default=1.0,help="seconds of audio kept before and after each detection in its clip, default is 1.0")
     input_group.add_argument("--directory-watcher",type=Path,required=False,help="Path to directory that the size in GB will be reported to the dashboard")
     input_group.add_argument("--video-streams",type=str,nargs="*",required=False,help="List of live stream urls to display on /video endpoint") # 1 or more stream urls with nargs="*"
     input_group.add_argument("--authentication",action="store_true", help="Enable authentication (omit to keep it False)")
+    input_group.add_argument("--metrics-token",type=str,required=False,help="With --authentication, token prometheus sends as a bearer token to scrape /metrics without logging in (omit to keep /metrics behind the login)")
+    input_group.add_argument("--api-token",type=str,required=False,help="With --authentication, token scripts and displays send as a bearer token to read /api/detections, /api/aggregates and /api/clips without logging in")
+    input_group.add_argument("--profiling",action="store_true", help="Enable the on demand sampling profiler at /debug/profile?seconds=10 (omit to keep it off)")
     input_group.add_argument("--analyze-video",action="store_true", help=" Enable yolo processing on video streams, draws boxes around birds (omit to display raw video)")
     input_group.add_argument("--model-path",type=Path,required=False,default="yolov8n.pt",help="Path to .pt model file that the video analyzer will use, default is yolov8n.pt")
-    input_group.add_argument("--skip-frames",type=int,required=False,default=0,help="number of frames video analyer will skip, default is 0")
+    input_group.add_argument("--yolo-backend",type=str,choices=["pytorch", "onnx", "onnx-int8"],default="pytorch",required=False,help="how the yolo model runs, onnx backends export the .pt model once (cached next to it) and run it with onnxruntime on the cpu, default is pytorch")
+    input_group.add_argument("--imgsz",type=int,required=False,default=640,help="input size video frames are resized to for yolo (and the size onnx models are exported at), default is 640")
+    input_group.add_argument("--onnx-dynamic",action="store_true", help="export onnx models with dynamic batch and image size instead of a fixed input shape (omit to keep the faster fixed shape)")
+    input_group.add_argument("--calibration-images",type=Path,required=False,help="folder of images onnx-int8 calibrates activations on (static QDQ quantization), omit for weight only quantization")
+    input_group.add_argument("--benchmark-images",type=Path,required=False,help="folder of images to benchmark latency and accuracy of the onnx backends against the .pt model, prints the results and exits")
+    input_group.add_argument("--skip-frames",type=int,required=False,default=0,help="video analyzer infers every nth frame, default is 0 (adapts to the measured load, see /stats on the video analyzer port)")
+    input_group.add_argument("--inference-fps",type=float,required=False,default=0,help="max yolo inferences per second for each video stream, frames from all streams are batched together, default is 0 (no limit)")
+    input_group.add_argument("--cpu-budget",type=float,required=False,default=0.5,help="fraction of time yolo inference may keep the server busy when --skip-frames is 0, default is 0.5")
+    input_group.add_argument("--motion-area",type=float,required=False,default=0.002,help="fraction of a video frame that has to change for yolo to run on it, static frames keep their last boxes, 0 turns motion gating off, default is 0.002")
 
     # Command line arguments for logging configuration.
     logging_group = parser.add_argument_group('Logging')
@@ -131,8 +214,17 @@ if __name__ in {"__main__", "__mp_main__"}: #to allow server to run within mp
             log_file=Path(args.log_file_path / Path(f'{datetime.today().year}-{str(datetime.today().month).zfill(2)}-server.log'))
         )
         
+        ''' benchmark yolo backends instead of starting the server '''
+        if args.benchmark_images:
+            results = webui.benchmark_backends(args.model_path, args.benchmark_images, webui.YOLO_BACKENDS, args.imgsz, args.onnx_dynamic, args.calibration_images)
+            print(f"{'backend':<12}{'mean ms':>10}{'p95 ms':>10}{'recall':>10}{'precision':>11}")
+            for backend, result in results.items():
+                print(f"{backend:<12}{result['mean_ms']:>10}{result['p95_ms']:>10}{str(result['recall']):>10}{str(result['precision']):>11}")
+            sys.exit(0)
+
         ''' run main '''
-        main(args.detections_directory, args.directory_watcher, args.video_streams, args.authentication, args.analyze_video, args.model_path, args.skip_frames)
+        main(args.detections_directory, args.database_path, args.ingest_token, args.directory_watcher, args.video_streams, args.authentication, args.analyze_video, args.model_path, args.skip_frames, args.inference_fps, args.cpu_budget, args.motion_area, args.yolo_backend, args.imgsz, args.onnx_dynamic, args.calibration_images, args.profiling, args.metrics_token, args.api_token,
+             args.recordings_directory, args.clips_directory, args.clips_cache_mb, args.clip_padding, args.rollups_directory)
     except Exception as e:
         logger.error(f'Unknown exception of type: {type(e)} - {e}')
         raise e
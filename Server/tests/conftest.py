@@ -0,0 +1,13 @@
+import sys
+import pytest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1])) # the server runs from Server/, so webui is importable the same way
+
+@pytest.fixture(scope="module")
+def yolo_model_path(tmp_path_factory):
+    ''' untrained yolov8n built from its yaml, so nothing is downloaded '''
+    YOLO = pytest.importorskip("ultralytics").YOLO
+    path = tmp_path_factory.mktemp("models") / "yolov8n-test.pt"
+    YOLO("yolov8n.yaml").save(str(path))
+    return path
@@ -0,0 +1,43 @@
+import json
+from datetime import datetime
+
+from webui import detectionstore
+from webui.detectionstore import DetectionsStore
+
+def detection(start_ts: str, common_name: str = "American Robin") -> dict:
+    return {"start_ts": start_ts, "end_ts": start_ts, "common_name": common_name, "scientific_name": "Turdus migratorius",
+            "confidence": 0.9, "location": [42.0, -74.2], "node_name": "node1", "filename": "recording.wav"}
+
+def append(store: DetectionsStore, date_str: str, rows: list):
+    with open(store.detections_file_for(date_str), "a") as fileout:
+        fileout.write("".join(json.dumps(row) + "\n" for row in rows))
+
+class Clock(datetime):
+    ''' datetime whose now() is set by the test '''
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+def test_rollover_reads_rest_of_previous_day(tmp_path, monkeypatch):
+    monkeypatch.setattr(detectionstore, "datetime", Clock)
+    store = DetectionsStore(tmp_path)
+    received = []
+    store.add_listener(lambda file_path, rows: received.append((file_path.name, [row["start_ts"] for row in rows])))
+
+    Clock.current = datetime(2025, 5, 1, 23, 58)
+    append(store, "2025-05-01", [detection("2025-05-01T23:57:00")])
+    assert len(store.refresh()) == 1
+
+    append(store, "2025-05-01", [detection("2025-05-01T23:59:30")]) # after the last refresh of the day
+    append(store, "2025-05-02", [detection("2025-05-02T00:00:10")])
+    Clock.current = datetime(2025, 5, 2, 0, 0, 20)
+    store.refresh()
+
+    assert received == [
+        ("detections-2025-05-01.jsonl", ["2025-05-01T23:57:00"]),
+        ("detections-2025-05-01.jsonl", ["2025-05-01T23:59:30"]),
+        ("detections-2025-05-02.jsonl", ["2025-05-02T00:00:10"]),
+    ]
+    assert [row["start_ts"] for row in store.get_rows()] == ["2025-05-02T00:00:10"]
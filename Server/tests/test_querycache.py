@@ -0,0 +1,16 @@
+from webui.querycache import QueryCache, etag_matches
+
+def test_etag_matches_whole_tags_only():
+    assert etag_matches('"abc-1"', '"abc-1"')
+    assert etag_matches('"zzz", W/"abc-1" , "yyy"', '"abc-1"')
+    assert etag_matches('*', '"abc-1"')
+    assert not etag_matches('"abc-12"', '"abc-1"')
+    assert not etag_matches('"xabc-1"', '"abc-1"')
+    assert not etag_matches('', '"abc-1"')
+    assert not etag_matches(None, '"abc-1"')
+
+def test_etag_changes_with_data_version():
+    query_cache = QueryCache()
+    etag = query_cache.etag_for("detections?from=2025-05-01", "1-5")
+    assert etag_matches(etag, query_cache.etag_for("detections?from=2025-05-01", "1-5"))
+    assert not etag_matches(etag, query_cache.etag_for("detections?from=2025-05-01", "1-6"))
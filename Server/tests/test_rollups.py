@@ -0,0 +1,15 @@
+import json
+
+from webui.rollups import RollupStore
+
+def test_rollups_kept_in_memory_when_directory_not_writable(tmp_path):
+    (tmp_path / "readonly").write_text("") # a file, so the rollups directory can't be created under it
+    with open(tmp_path / "detections-2025-05-01.jsonl", "w") as fileout:
+        for start_ts in ("2025-05-01T06:00:00", "2025-05-01T06:05:00"):
+            fileout.write(json.dumps({"start_ts": start_ts, "end_ts": start_ts, "common_name": "American Robin", "confidence": 0.9, "node_name": "node1", "filename": "recording.wav"}) + "\n")
+
+    rollup_store = RollupStore(tmp_path, detections_store=None, rollup_directory=tmp_path / "readonly" / "rollups")
+
+    assert rollup_store.rollup_directory is None
+    assert rollup_store.load_day("2025-05-01")['nodes']['node1']['total_count'] == 2
+    assert rollup_store.query("2025-05-01", "2025-05-01").total_count == 2
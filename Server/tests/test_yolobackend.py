@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("ultralytics")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from webui.yolobackend import FixedBatchModel, export_onnx, load_yolo_model
+
+IMGSZ = 64
+
+def test_fixed_batch_model_forwards_attributes(yolo_model_path):
+    model = load_yolo_model(yolo_model_path, backend="onnx", imgsz=IMGSZ, batch=2, warmup=False)
+    assert isinstance(model, FixedBatchModel)
+    assert model.names == model.model.names
+
+def test_export_uses_cache_without_source_model(yolo_model_path, tmp_path):
+    source_path = tmp_path / yolo_model_path.name
+    source_path.write_bytes(yolo_model_path.read_bytes())
+    onnx_path = export_onnx(source_path, IMGSZ)
+    source_path.unlink()
+    assert export_onnx(source_path, IMGSZ) == onnx_path
+
+    onnx_path.unlink()
+    with pytest.raises(FileNotFoundError, match="no cached ONNX export"):
+        export_onnx(source_path, IMGSZ)
@@ -2,5 +2,13 @@ from webui.routes import *
 from webui.datacharts import *
 from webui.auth import *
 from webui.videoyolo import *
+from webui.detectionstore import *
+from webui.detectionsdb import *
+from webui.storagemonitor import *
+from webui.yolobackend import *
+from webui.pagemetrics import *
+from webui.rollups import *
+from webui.querycache import *
+from webui.clips import *
 
 __all__ = []
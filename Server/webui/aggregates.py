@@ -0,0 +1,146 @@
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+class DetectionAggregates:
+    """
+    Single pass aggregation of detection rows shared by the dashboard cards and chart builders.
+
+    Keeps per-species count, confidence sum/min/max and first/last seen, per-hour histograms
+    (overall and per species), and detections per timestamp for the cumulative detections series
+    (sorted when it is read, rows pushed by nodes don't arrive in time order). Rows can be added
+    incrementally, so a store that tails a file only pays for the newly appended rows, and
+    daily rollups (see to_rollup) can be merged instead of rows for multi-day views.
+
+    Args:
+        rows (list): Optional detection rows (dicts with the jsonl fields) to aggregate.
+    """
+
+    def __init__(self, rows: list = None):
+        self.total_count = 0
+        self.confidence_sum = 0.0
+        self.species = {} # common_name -> {'count', 'confidence_sum', 'confidence_min', 'confidence_max', 'first_seen', 'last_seen'}
+        self.hourly = [0] * 24
+        self.species_hourly = {} # common_name -> list of 24 hourly counts
+        self.time_counts = {} # epoch ms -> detections at that time
+        if rows:
+            self.add_rows(rows)
+
+    def add(self, row: dict):
+        name = row['common_name']
+        confidence = float(row['confidence'])
+        start_ts = str(row['start_ts'])
+        hour = int(start_ts[11:13]) # YYYY-MM-DDTHH:MM:SS
+
+        self.total_count += 1
+        self.confidence_sum += confidence
+
+        stats = self.species.get(name)
+        if stats is None:
+            self.species[name] = {'count': 1, 'confidence_sum': confidence, 'confidence_min': confidence, 'confidence_max': confidence, 'first_seen': start_ts, 'last_seen': start_ts}
+            self.species_hourly[name] = [0] * 24
+        else:
+            stats['count'] += 1
+            stats['confidence_sum'] += confidence
+            if confidence < stats['confidence_min']:
+                stats['confidence_min'] = confidence
+            if confidence > stats['confidence_max']:
+                stats['confidence_max'] = confidence
+            if start_ts < stats['first_seen']:
+                stats['first_seen'] = start_ts
+            if start_ts > stats['last_seen']:
+                stats['last_seen'] = start_ts
+
+        self.hourly[hour] += 1
+        self.species_hourly[name][hour] += 1
+        epoch_ms = int(datetime.fromisoformat(start_ts).timestamp() * 1000)
+        self.time_counts[epoch_ms] = self.time_counts.get(epoch_ms, 0) + 1
+
+    def add_rows(self, rows: list):
+        for row in rows:
+            self.add(row)
+
+    def to_rollup(self) -> dict:
+        ''' compact json-able summary of one day (no per detection series), merged back with add_rollups '''
+        return {
+            'total_count': self.total_count,
+            'confidence_sum': self.confidence_sum,
+            'hourly': list(self.hourly),
+            'species': {name: dict(stats, hourly=list(self.species_hourly[name])) for name, stats in self.species.items()},
+        }
+
+    def add_rollups(self, date_str: str, rollups: list, species: str = None):
+        '''
+        merge one day's rollups (e.g. one per node), optionally only for one species. the cumulative
+        series gets a point at the end of each hour with detections
+        '''
+        day_hourly = [0] * 24
+        for rollup in rollups:
+            for name, stats in rollup['species'].items():
+                if species and name != species:
+                    continue
+                merged = self.species.get(name)
+                if merged is None:
+                    self.species[name] = {key: value for key, value in stats.items() if key != 'hourly'}
+                    self.species_hourly[name] = [0] * 24
+                else:
+                    merged['count'] += stats['count']
+                    merged['confidence_sum'] += stats['confidence_sum']
+                    merged['confidence_min'] = min(merged['confidence_min'], stats['confidence_min'])
+                    merged['confidence_max'] = max(merged['confidence_max'], stats['confidence_max'])
+                    merged['first_seen'] = min(merged['first_seen'], stats['first_seen'])
+                    merged['last_seen'] = max(merged['last_seen'], stats['last_seen'])
+                self.total_count += stats['count']
+                self.confidence_sum += stats['confidence_sum']
+                for hour, count in enumerate(stats['hourly']):
+                    self.species_hourly[name][hour] += count
+                    day_hourly[hour] += count
+
+        day_start = datetime.strptime(date_str, "%Y-%m-%d")
+        for hour, count in enumerate(day_hourly):
+            if count:
+                self.hourly[hour] += count
+                epoch_ms = int((day_start + timedelta(hours=hour + 1)).timestamp() * 1000)
+                self.time_counts[epoch_ms] = self.time_counts.get(epoch_ms, 0) + count
+
+    def snapshot(self):
+        ''' copy that is safe to read while this instance keeps being updated from another thread '''
+        snapshot = DetectionAggregates()
+        snapshot.total_count = self.total_count
+        snapshot.confidence_sum = self.confidence_sum
+        snapshot.species = {name: dict(stats) for name, stats in self.species.items()}
+        snapshot.hourly = list(self.hourly)
+        snapshot.species_hourly = {name: list(counts) for name, counts in self.species_hourly.items()}
+        snapshot.time_counts = dict(self.time_counts)
+        return snapshot
+
+    def mean_confidence(self) -> float:
+        ''' average confidence over all detections, None if there are no detections '''
+        if not self.total_count:
+            return None
+        return self.confidence_sum / self.total_count
+
+    def cumulative_series(self) -> list:
+        ''' [[epoch ms, total detections so far]] in time order '''
+        series = []
+        running_total = 0
+        for epoch_ms in sorted(self.time_counts):
+            running_total += self.time_counts[epoch_ms]
+            series.append([epoch_ms, running_total])
+        return series
+
+    def species_counts(self) -> list:
+        ''' [{'name', 'y'}] detection count per species, in order first seen '''
+        return [{'name': name, 'y': stats['count']} for name, stats in self.species.items()]
+
+    def species_mean_confidence(self) -> list:
+        ''' [{'name', 'y'}] average confidence per species rounded to 2 places, in order first seen '''
+        return [{'name': name, 'y': round(stats['confidence_sum'] / stats['count'], 2)} for name, stats in self.species.items()]
+
+
+def as_aggregates(input_data) -> DetectionAggregates:
+    ''' chart builders accept either aggregates or a list of detection rows '''
+    if isinstance(input_data, DetectionAggregates):
+        return input_data
+    return DetectionAggregates(input_data)
@@ -1,12 +1,17 @@
+import hmac
 from fastapi import Request
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from nicegui import app
 
 from webui import routes #internal package
 
-def initAuthentication():
-    unrestricted_page_routes = {'/login'}
+def bearer_token_matches(request: Request, token: str) -> bool:
+    ''' whether the request sends "Authorization: Bearer <token>" (compared in constant time) '''
+    return bool(token) and hmac.compare_digest(request.headers.get('authorization', ''), f"Bearer {token}")
+
+def initAuthentication(metrics_token: str = None, api_token: str = None):
+    unrestricted_page_routes = {'/login', '/api/ingest'} # ingest is protected by --ingest-token instead
 
     class AuthMiddleware(BaseHTTPMiddleware):
         """
@@ -15,6 +20,13 @@ def initAuthentication():
         """
         async def dispatch(self, request: Request, call_next):
             if not app.storage.user.get('authenticated', False):
+                if request.url.path == '/metrics' and bearer_token_matches(request, metrics_token):
+                    return await call_next(request) # prometheus scrapes with --metrics-token instead of a login
+                if request.url.path.startswith('/api/') and request.url.path not in unrestricted_page_routes:
+                    ''' scripts and displays read the json api with --api-token, they get a 401 instead of the login page '''
+                    if request.method == 'GET' and bearer_token_matches(request, api_token):
+                        return await call_next(request)
+                    return JSONResponse({'error': 'unauthorized'}, status_code=401, headers={'WWW-Authenticate': 'Bearer'})
                 if not request.url.path.startswith('/_nicegui') and request.url.path not in unrestricted_page_routes:
                     app.storage.user['referrer_path'] = request.url.path  # remember where the user wanted to go
                     return RedirectResponse('/login')
@@ -0,0 +1,143 @@
+import hashlib, logging, os, threading
+from collections import OrderedDict
+from pathlib import Path
+from datetime import datetime
+
+try:
+    import soundfile as sf
+except ImportError: # clips can't be cut, whole recordings are served instead
+    sf = None
+
+logger = logging.getLogger(__name__)
+
+RECORDING_SUFFIXES = {".wav", ".flac", ".opus", ".ogg"}
+
+OPUS_SAMPLE_RATES = [8000, 12000, 16000, 24000, 48000]
+
+MEDIA_TYPES = {".wav": "audio/wav", ".flac": "audio/flac", ".opus": "audio/ogg", ".ogg": "audio/ogg"}
+
+class ClipStore:
+    """
+    Short compressed clips of detections cut from the nodes' recordings, cached on disk.
+
+    A clip is the detection's start_ts to end_ts plus padding on each side, downmixed to mono and
+    encoded as opus (flac when the sample rate isn't one opus supports), so playing a detection
+    sends tens of KB instead of the whole recording. Clips are cut once and the cache is kept under
+    max_cache_bytes by evicting the least recently played. Without soundfile the whole recording
+    is served instead.
+
+    Recordings are only looked up by their file name under recordings_directory/<node_name>/ and
+    recordings_directory/, never at the path in the detection (nodes send it, so it can't be
+    trusted), and nothing outside recordings_directory is served.
+
+    Args:
+        clips_directory (Path): Directory clips are cached in (created if it doesn't exist).
+        recordings_directory (Path): Directory the nodes' recordings are synced or mounted into, without it no clips are served.
+        max_cache_bytes (int): Size the clips cache is kept under.
+        padding (float): Seconds of audio kept before the start and after the end of a detection.
+    """
+
+    def __init__(self, clips_directory: Path, recordings_directory: Path = None, max_cache_bytes: int = 200 * 1024 * 1024, padding: float = 1.0):
+        self.clips_directory = Path(clips_directory)
+        self.recordings_directory = Path(recordings_directory) if recordings_directory else None
+        self.max_cache_bytes = max_cache_bytes
+        self.padding = padding
+        self.lock = threading.Lock()
+        os.makedirs(self.clips_directory, exist_ok=True)
+
+        ''' least recently played first, the order survives restarts through the files' mtimes '''
+        self.clips = OrderedDict() # path -> size in bytes
+        self.total_bytes = 0
+        for path in sorted(self.clips_directory.glob("clip-*"), key=lambda path: path.stat().st_mtime):
+            if path.suffix == ".tmp":
+                os.remove(path) # left by a cut that didn't finish
+                continue
+            self.clips[path] = path.stat().st_size
+            self.total_bytes += self.clips[path]
+        if sf is None:
+            logger.warning("soundfile is not installed, whole recordings are served instead of detection clips")
+
+    def find_recording(self, row: dict) -> Path:
+        ''' local path of the recording a detection was made in, or None '''
+        if self.recordings_directory is None or not row.get('filename'):
+            return None
+        file_name = Path(str(row['filename'])).name
+        if Path(file_name).suffix.lower() not in RECORDING_SUFFIXES:
+            return None
+        root = self.recordings_directory.resolve()
+        candidates = [root / file_name]
+        if row.get('node_name'):
+            candidates.insert(0, root / Path(str(row['node_name'])).name / file_name)
+        for path in candidates:
+            path = path.resolve() # symlinks can't lead out of the recordings directory either
+            if path.is_relative_to(root) and path.is_file():
+                return path
+        return None
+
+    def clip_for(self, row: dict):
+        ''' (path, media type) of a playable clip of a detection (cut now if it isn't cached), or None if its recording isn't found '''
+        recording_path = self.find_recording(row)
+        if recording_path is None:
+            return None
+        if sf is None:
+            return recording_path, MEDIA_TYPES[recording_path.suffix.lower()]
+
+        key = f"{recording_path.resolve()}|{row['start_ts']}|{row.get('end_ts')}|{self.padding}"
+        clip_base = self.clips_directory / f"clip-{hashlib.sha1(key.encode()).hexdigest()[:20]}"
+        for suffix in (".opus", ".flac"):
+            clip_path = clip_base.with_suffix(suffix)
+            with self.lock:
+                if clip_path in self.clips:
+                    self.clips.move_to_end(clip_path)
+                    try:
+                        os.utime(clip_path)
+                    except OSError:
+                        pass
+                    return clip_path, MEDIA_TYPES[suffix]
+
+        clip_path = self.cut_clip(recording_path, row, clip_base)
+        self.add_to_cache(clip_path)
+        return clip_path, MEDIA_TYPES[clip_path.suffix]
+
+    def cut_clip(self, recording_path: Path, row: dict, clip_base: Path) -> Path:
+        ''' encode the detection's segment of the recording (the whole recording if its start time isn't in its name) '''
+        with sf.SoundFile(str(recording_path)) as recording:
+            rate = recording.samplerate
+            try:
+                recording_start = datetime.strptime(recording_path.stem, "%Y-%m-%d-birdnet-%H:%M:%S")
+                start_secs = (datetime.fromisoformat(row['start_ts']) - recording_start).total_seconds()
+                end_secs = (datetime.fromisoformat(row.get('end_ts') or row['start_ts']) - recording_start).total_seconds()
+            except ValueError:
+                start_secs, end_secs = 0, recording.frames / rate
+            first_frame = max(int((start_secs - self.padding) * rate), 0)
+            last_frame = min(int((end_secs + self.padding) * rate), recording.frames)
+            if last_frame <= first_frame:
+                logger.warning(f"Detection at {row['start_ts']} is outside of {recording_path}, clipping the whole recording")
+                first_frame, last_frame = 0, recording.frames
+            recording.seek(first_frame)
+            samples = recording.read(last_frame - first_frame, dtype="int16", always_2d=True)
+
+        samples = samples.mean(axis=1).astype("int16") # mono halves a stereo clip
+        if rate in OPUS_SAMPLE_RATES:
+            clip_path, file_format, subtype = clip_base.with_suffix(".opus"), "OGG", "OPUS"
+        else:
+            clip_path, file_format, subtype = clip_base.with_suffix(".flac"), "FLAC", "PCM_16"
+        tmp_path = clip_path.with_name(f"{clip_path.name}.{threading.get_ident()}.tmp")
+        sf.write(str(tmp_path), samples, rate, format=file_format, subtype=subtype)
+        os.replace(tmp_path, clip_path)
+        logger.debug(f"Cut {len(samples) / rate:.1f}s clip {clip_path} from {recording_path}")
+        return clip_path
+
+    def add_to_cache(self, clip_path: Path):
+        ''' add a new clip and evict the least recently played until the cache fits '''
+        with self.lock:
+            self.total_bytes -= self.clips.pop(clip_path, 0)
+            self.clips[clip_path] = clip_path.stat().st_size
+            self.total_bytes += self.clips[clip_path]
+            while self.total_bytes > self.max_cache_bytes and len(self.clips) > 1:
+                evicted_path, size = self.clips.popitem(last=False)
+                self.total_bytes -= size
+                try:
+                    os.remove(evicted_path)
+                except OSError as e:
+                    logger.warning(f"Could not remove evicted clip {evicted_path}: {e}")
@@ -1,8 +1,9 @@
 import json, logging
-from datetime import datetime
 from pathlib import Path
 from nicegui import ui
 
+from webui.aggregates import as_aggregates #internal package
+
 logger = logging.getLogger(__name__)
 
 def generate_table_data_from_file(file_path: Path):
@@ -10,82 +11,47 @@ def generate_table_data_from_file(file_path: Path):
     try:
         with open(file_path, "r") as filein:
             for line in filein:
-                data = json.loads(line.strip("\n"))
-                rows.append(data)
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # torn line (e.g. power cut mid write), skip it instead of dropping the whole file
+                    logger.warning(f"Skipping malformed line in {file_path}")
     except Exception as e:
         logger.error("Exception while generating table: " + str(e))            
     
     return rows
 
-def generate_pie_chart_object(pie_type: str, input_data):
-    ''' create data, then series, then chart '''
+def pie_chart_options(pie_type: str, input_data) -> dict:
+    ''' create data, then series, then highcharts options (input_data is a list of detections or DetectionAggregates) '''
     if pie_type=="species-distro":
         ''' create data '''
-        bird_counts = [] #each item will be name, count json objects
-        bird_names = [] # keep track of all bird names so far 
-        for entry in input_data:
-            if entry['common_name'] not in bird_names:
-                ''' new bird, so add object with 1 count to bird counts '''
-                bird_counts.append({'name': entry['common_name'], 'y': 1 })
-                bird_names.append(entry['common_name'])
-            else:
-                for n in bird_counts:
-                    if n['name'] == entry['common_name']:
-                        old_y = n['y'] # get y
-                        bird_counts.remove(n)#remove old from list
-                        bird_counts.append({'name': entry['common_name'], 'y': old_y + 1 }) # add new to list
-                    
-        data = bird_counts
+        data = as_aggregates(input_data).species_counts()
              
         ''' create series using data '''
         series = [{ 'name': 'Count',  'data': data}]
         
-        '''create chart using series '''
-        chart = ui.highchart({
+        '''create chart options using series '''
+        return {
             'title': {'text': 'Distribution of Birds by Species'},
             'chart': {'type': 'pie'},
             #'tooltip': {'valueSuffix': '%'},
             'series': series,
             'credits': False,
-            })
-        
-        return chart
-        
-def generate_bar_chart_object(bar_type: str, input_data):
-    ''' create data, then series, then chart '''
+            }
+
+def bar_chart_options(bar_type: str, input_data) -> dict:
+    ''' create data, then series, then highcharts options (input_data is a list of detections or DetectionAggregates) '''
     if bar_type=="species-confidence":
         ''' create data '''
-        bird_counts = [] #each item will be name, count json objects
-        bird_confidence_total = [] #each item will be the confidence of each detection
-        bird_names = [] # keep track of all bird names so far 
-        for entry in input_data:
-            if entry['common_name'] not in bird_names:
-                ''' new bird, so add object with 1 count to bird counts '''
-                bird_counts.append({'name': entry['common_name'], 'y': 1 })
-                bird_names.append(entry['common_name'])
-                bird_confidence_total.append({'name': entry['common_name'], 'y': entry['confidence'] })
-            else:
-                for n in bird_counts:
-                    if n['name'] == entry['common_name']:
-                        old_y = n['y'] # get y
-                        bird_counts.remove(n)#remove old from list
-                        bird_counts.append({'name': entry['common_name'], 'y': old_y + 1 }) # add new to list
-                for n in bird_confidence_total:
-                    if n['name'] == entry['common_name']:    
-                        old_conf = n['y']
-                        bird_confidence_total.remove(n)
-                        bird_confidence_total.append({'name': entry['common_name'], 'y': entry['confidence'] + old_conf})
-        avg_confidence = []
-        for a,b in zip(bird_confidence_total, bird_counts):
-            avg_confidence.append({'name': a['name'], 'y': round(a['y'] / b['y'],2) })
-        
-        data = avg_confidence
+        data = as_aggregates(input_data).species_mean_confidence()
             
         ''' create series using data '''
         series = [{ 'name': 'Avg Confidence',  'data': data}]
         
-        '''create chart using series '''
-        chart = ui.highchart({
+        '''create chart options using series '''
+        return {
             'title': {'text': 'Average Model Confidence by Species'},
             'chart': {'type': 'column'},
             'xAxis': {'type': 'category', 'labels': { 'autoRotation': [-45, -90]}},
@@ -94,32 +60,46 @@ def generate_bar_chart_object(bar_type: str, input_data):
             'plotOptions': {'column': {'colorByPoint': True}},
             'series': series,
             'credits': False,
-            })
-        
-        return chart
-        
-def generate_line_chart_object(input_data):
-    ''' create data, then series, then chart '''
-    bird_counts = [] 
-    total_birds = 0
-    for entry in input_data:
-        num = str(entry['start_ts']) 
-        total_birds = total_birds + 1
-        bird_counts.append([num,total_birds])
-                    
-    ''' create series using data '''
-    series_data = [[int(datetime.fromisoformat(timestamp).timestamp() * 1000), value] for timestamp, value in bird_counts]
+            }
+    elif bar_type=="hourly-detections":
+        ''' create data, one stacked series per species '''
+        aggregates = as_aggregates(input_data)
+        series = [{'name': name, 'data': counts} for name, counts in aggregates.species_hourly.items()]
+
+        '''create chart options using series '''
+        return {
+            'title': {'text': 'Detections by Hour of Day'},
+            'chart': {'type': 'column'},
+            'xAxis': {'categories': [f"{hour:02d}:00" for hour in range(24)]},
+            'yAxis': {'title': {'text': 'Detections'} },
+            'plotOptions': {'column': {'stacking': 'normal'}},
+            'series': series,
+            'credits': False,
+            }
+
+def line_chart_options(input_data) -> dict:
+    ''' create data, then highcharts options (input_data is a list of detections or DetectionAggregates) '''
+    series_data = as_aggregates(input_data).cumulative_series()
     
-    ''' create chart '''
-    chart = ui.highchart(
-        {
+    return {
         'chart': {'type': 'line'},
         'title': {'text': 'Total Detections Over Time'},
         'xAxis': {'type': 'datetime', 'title': {'text': 'Timestamp'}},
         'yAxis': {'title': {'text': 'Detections'}},
         'credits': False,
         'series': [{'name': 'Total Detections','data': series_data}]
-        },
-    )
+        }
 
-    return chart
\ No newline at end of file
+''' chart elements, options are built separately so they can be benchmarked without a page '''
+def generate_pie_chart_object(pie_type: str, input_data):
+    options = pie_chart_options(pie_type, input_data)
+    if options is not None:
+        return ui.highchart(options)
+
+def generate_bar_chart_object(bar_type: str, input_data):
+    options = bar_chart_options(bar_type, input_data)
+    if options is not None:
+        return ui.highchart(options)
+
+def generate_line_chart_object(input_data):
+    return ui.highchart(line_chart_options(input_data))
@@ -0,0 +1,248 @@
+import json, logging, os, sqlite3, threading, time
+from pathlib import Path
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DETECTION_FIELDS = ["start_ts", "end_ts", "common_name", "scientific_name", "confidence", "location", "node_name", "filename"]
+
+DETECTION_KEY_FIELDS = ["start_ts", "end_ts", "common_name", "node_name", "filename"] # columns of idx_detections_unique
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    start_ts TEXT NOT NULL,
+    end_ts TEXT,
+    common_name TEXT,
+    scientific_name TEXT,
+    confidence REAL,
+    location TEXT,
+    node_name TEXT,
+    filename TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_detections_unique ON detections (start_ts, end_ts, common_name, node_name, filename);
+CREATE INDEX IF NOT EXISTS idx_detections_start_ts ON detections (start_ts);
+CREATE INDEX IF NOT EXISTS idx_detections_common_name ON detections (common_name, start_ts);
+CREATE INDEX IF NOT EXISTS idx_detections_node_name ON detections (node_name, start_ts);
+CREATE TABLE IF NOT EXISTS ingested_files (
+    file_path TEXT PRIMARY KEY,
+    inode INTEGER,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingested_batches (
+    batch_id TEXT PRIMARY KEY,
+    node_name TEXT,
+    received_ts TEXT,
+    row_count INTEGER
+);
+'''
+
+INSERT_DETECTION = f"INSERT OR IGNORE INTO detections ({', '.join(DETECTION_FIELDS)}) VALUES ({', '.join('?' * len(DETECTION_FIELDS))})"
+
+def detection_values(data: dict) -> tuple:
+    ''' values of a detection in DETECTION_FIELDS order, for inserting '''
+    return tuple(str(data.get(field)) if field == "location" else data.get(field) for field in DETECTION_FIELDS)
+
+def detection_key(data: dict) -> tuple:
+    ''' identity of a detection, the same row written twice (pushed to /api/ingest and synced into the directory) has the same key '''
+    return tuple(data.get(field) for field in DETECTION_KEY_FIELDS)
+
+class DetectionsDatabase:
+    """
+    SQLite backed store of detections from every daily jsonl file, indexed for time range,
+    species and node queries.
+
+    Ingest is idempotent, each file's byte offset is remembered so only newly appended lines
+    are parsed, and a unique index drops any row that has already been inserted. Batches pushed
+    by nodes are remembered by batch id, so a retried batch is ignored. The data version changes
+    whenever new rows are inserted, so query results can be cached until it does.
+
+    Args:
+        database_path (Path): Path to the sqlite database file (created if it doesn't exist).
+        detections_directory (Path): Directory containing detections-YYYY-MM-DD.jsonl files.
+    """
+
+    def __init__(self, database_path: Path, detections_directory: Path):
+        self.database_path = Path(database_path)
+        self.detections_directory = Path(detections_directory)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.database_path), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.started_ns = time.time_ns() # part of the data version, so versions from before a restart never match
+        self.changes = 0
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+
+    def ingest_directory(self) -> int:
+        ''' ingest every detections file in the detections directory, returns number of new rows '''
+        inserted = 0
+        for file_path in sorted(self.detections_directory.glob("detections-*.jsonl")):
+            inserted += self.ingest_file(file_path)
+        logger.info(f"Ingested {inserted} new detections from {self.detections_directory}")
+        return inserted
+
+    def ingest_file(self, file_path: Path) -> int:
+        ''' ingest lines appended to file_path since the last ingest, returns number of new rows '''
+        key = str(Path(file_path).resolve())
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return 0
+
+        with self.lock:
+            found = self.conn.execute("SELECT inode, offset FROM ingested_files WHERE file_path = ?", (key,)).fetchone()
+            offset = 0
+            if found is not None and found["inode"] == stat.st_ino and found["offset"] <= stat.st_size:
+                offset = found["offset"]
+            if offset == stat.st_size:
+                return 0
+
+            with open(file_path, "rb") as filein:
+                filein.seek(offset)
+                chunk = filein.read(stat.st_size - offset)
+
+            ''' only consume complete lines, a partial last line is picked up on the next ingest '''
+            end = chunk.rfind(b"\n")
+            if end == -1:
+                return 0
+
+            rows = []
+            for line in chunk[:end].split(b"\n"):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError as e:
+                    logger.error(f"Skipping malformed detection line in {file_path}: {e}")
+                    continue
+                rows.append(detection_values(data))
+
+            before = self.conn.total_changes
+            self.conn.executemany(INSERT_DETECTION, rows)
+            inserted = self.conn.total_changes - before
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ingested_files (file_path, inode, offset) VALUES (?, ?, ?)",
+                (key, stat.st_ino, offset + end + 1),
+            )
+            self.conn.commit()
+            if inserted:
+                self.changes += 1
+        return inserted
+
+    def ingest_batch(self, batch_id: str, node_name: str, rows: list) -> list:
+        '''
+        insert a batch of detections pushed by a node in one transaction, returns the rows that were new.
+        a batch_id that was already ingested (node retried after a lost response) returns None
+        '''
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM ingested_batches WHERE batch_id = ?", (batch_id,)).fetchone() is not None:
+                return None
+            new_rows = []
+            for data in rows:
+                if self.conn.execute(INSERT_DETECTION, detection_values(data)).rowcount:
+                    new_rows.append(data)
+            self.conn.execute(
+                "INSERT INTO ingested_batches (batch_id, node_name, received_ts, row_count) VALUES (?, ?, ?, ?)",
+                (batch_id, node_name, datetime.now().strftime("%Y-%m-%dT%H:%M:%S"), len(rows)),
+            )
+            self.conn.commit()
+            if new_rows:
+                self.changes += 1
+        return new_rows
+
+    def data_version(self) -> str:
+        ''' changes whenever rows are inserted '''
+        return f"{self.started_ns:x}-{self.changes}"
+
+    def build_filters(self, start: datetime = None, end: datetime = None, species: str = None, node_name: str = None, min_confidence: float = None):
+        ''' build a WHERE clause and params, start is inclusive and end is exclusive '''
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("start_ts >= ?")
+            params.append(start.strftime("%Y-%m-%dT%H:%M:%S"))
+        if end is not None:
+            clauses.append("start_ts < ?")
+            params.append(end.strftime("%Y-%m-%dT%H:%M:%S"))
+        if species:
+            clauses.append("common_name = ?")
+            params.append(species)
+        if node_name:
+            clauses.append("node_name = ?")
+            params.append(node_name)
+        if min_confidence is not None:
+            clauses.append("confidence >= ?")
+            params.append(min_confidence)
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        return where, params
+
+    def query_detections(self, start: datetime = None, end: datetime = None, species: str = None, node_name: str = None, min_confidence: float = None) -> list:
+        ''' detections (as dicts with the jsonl fields) in time order '''
+        where, params = self.build_filters(start, end, species, node_name, min_confidence)
+        with self.lock:
+            cursor = self.conn.execute(f"SELECT {', '.join(DETECTION_FIELDS)} FROM detections{where} ORDER BY start_ts", params)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def count_detections(self, start: datetime = None, end: datetime = None, species: str = None, node_name: str = None, min_confidence: float = None) -> int:
+        where, params = self.build_filters(start, end, species, node_name, min_confidence)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM detections{where}", params).fetchone()[0]
+
+    def query_page(self, start: datetime = None, end: datetime = None, species: str = None, node_name: str = None, min_confidence: float = None,
+                   sort_by: str = "start_ts", descending: bool = True, offset: int = 0, limit: int = 10) -> list:
+        ''' one sorted page of detections (with row id), sorting and paging run in sqlite so only the page is loaded '''
+        if sort_by not in DETECTION_FIELDS:
+            sort_by = "start_ts"
+        order = "DESC" if descending else "ASC"
+        where, params = self.build_filters(start, end, species, node_name, min_confidence)
+        with self.lock:
+            cursor = self.conn.execute(
+                f"SELECT id, {', '.join(DETECTION_FIELDS)} FROM detections{where} ORDER BY {sort_by} {order}, id {order} LIMIT ? OFFSET ?",
+                params + [int(limit), int(offset)],
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
+    def query_cursor(self, start: datetime = None, end: datetime = None, species: str = None, node_name: str = None, min_confidence: float = None,
+                     after: tuple = None, limit: int = 100) -> list:
+        '''
+        newest first page of detections (with row id) after a cursor, the (start_ts, id) of the last row of
+        the previous page. unlike offsets, pages don't shift when new detections arrive and deep pages stay fast
+        '''
+        where, params = self.build_filters(start, end, species, node_name, min_confidence)
+        if after is not None:
+            where += (" AND " if where else " WHERE ") + "(start_ts < ? OR (start_ts = ? AND id < ?))"
+            params += [after[0], after[0], int(after[1])]
+        with self.lock:
+            cursor = self.conn.execute(
+                f"SELECT id, {', '.join(DETECTION_FIELDS)} FROM detections{where} ORDER BY start_ts DESC, id DESC LIMIT ?",
+                params + [int(limit)],
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_detection(self, detection_id: int) -> dict:
+        ''' one detection (with row id) by id, or None '''
+        with self.lock:
+            row = self.conn.execute(f"SELECT id, {', '.join(DETECTION_FIELDS)} FROM detections WHERE id = ?", (int(detection_id),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def detection_id(self, data: dict) -> int:
+        ''' row id of a detection read from a jsonl file (looked up by the unique index), or None if it isn't ingested yet '''
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id FROM detections WHERE start_ts = ? AND end_ts IS ? AND common_name IS ? AND node_name IS ? AND filename IS ?",
+                (data.get("start_ts"), data.get("end_ts"), data.get("common_name"), data.get("node_name"), data.get("filename")),
+            ).fetchone()
+        return row["id"] if row is not None else None
+
+    def species_names(self, start: datetime = None, end: datetime = None) -> list:
+        ''' distinct species detected in the time range, sorted by name '''
+        where, params = self.build_filters(start, end)
+        with self.lock:
+            cursor = self.conn.execute(f"SELECT DISTINCT common_name FROM detections{where} ORDER BY common_name", params)
+            return [row["common_name"] for row in cursor.fetchall()]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,165 @@
+import json, logging, os, threading, time
+from pathlib import Path
+from datetime import datetime
+
+from webui.aggregates import DetectionAggregates #internal package
+from webui.detectionsdb import detection_key #internal package
+
+logger = logging.getLogger(__name__)
+
+class DetectionsStore:
+    """
+    In-process store of today's detections that tails the daily detections jsonl file.
+
+    Only bytes appended since the last refresh are read and parsed, a trailing partial line
+    (node still writing) is left for the next refresh, and the store rolls over to the new
+    day's file at midnight. A row already in the file (same key as the database's unique
+    index) is skipped, so a node that both pushes to /api/ingest and writes into the shared
+    detections directory isn't counted twice.
+
+    Args:
+        detections_directory (Path): Directory containing detections-YYYY-MM-DD.jsonl files.
+    """
+
+    def __init__(self, detections_directory: Path):
+        self.detections_directory = Path(detections_directory)
+        self.date_str = None
+        self.file_path = None
+        self.offset = 0
+        self.inode = None
+        self.rows = []
+        self.seen_keys = set()
+        self.aggregates = DetectionAggregates()
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.append_lock = threading.Lock()
+        self.poll_thread = None
+
+    def add_listener(self, callback):
+        ''' callback(file_path, new_rows) is called after each refresh that read new rows '''
+        self.listeners.append(callback)
+
+    def detections_file_for(self, date_str: str) -> Path:
+        return self.detections_directory / Path("detections-" + date_str + ".jsonl")
+
+    def refresh(self) -> list:
+        ''' read newly appended lines, returns list of new rows '''
+        updates = [] # (file_path, new rows) for the listeners
+        with self.lock:
+            date_today_str = datetime.now().strftime("%Y-%m-%d")
+            if date_today_str != self.date_str:
+                ''' new day (or first refresh), so start tailing the new file from the beginning '''
+                if self.date_str is not None:
+                    ''' finish the previous day's file first, rows written just before midnight would never reach the listeners '''
+                    tail_rows = self._read_appended()
+                    if tail_rows:
+                        updates.append((self.file_path, tail_rows))
+                    logger.info(f"Rolling over detections store from {self.date_str} to {date_today_str} ({len(tail_rows)} rows read from the previous day)")
+                self.date_str = date_today_str
+                self.file_path = self.detections_file_for(date_today_str)
+                self.offset = 0
+                self.inode = None
+                self.rows = []
+                self.seen_keys = set()
+                self.aggregates = DetectionAggregates()
+
+            new_rows = self._read_appended()
+            self.rows.extend(new_rows)
+            self.aggregates.add_rows(new_rows) # only the new rows are aggregated
+            if new_rows:
+                updates.append((self.file_path, new_rows))
+
+        for file_path, rows in updates:
+            for callback in self.listeners:
+                try:
+                    callback(file_path, rows)
+                except Exception as e:
+                    logger.error(f"Exception in detections store listener: {e}")
+        return new_rows
+
+    def _read_appended(self) -> list:
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return []
+
+        ''' file replaced or truncated, so re-read it from the start '''
+        if (self.inode is not None and stat.st_ino != self.inode) or stat.st_size < self.offset:
+            logger.warning(f"Detections file {self.file_path} was replaced or truncated, reloading")
+            self.offset = 0
+            self.rows = []
+            self.seen_keys = set()
+            self.aggregates = DetectionAggregates()
+        self.inode = stat.st_ino
+
+        if stat.st_size == self.offset:
+            return []
+
+        with open(self.file_path, "rb") as filein:
+            filein.seek(self.offset)
+            chunk = filein.read(stat.st_size - self.offset)
+
+        ''' only consume complete lines, a partial last line is picked up on the next refresh '''
+        end = chunk.rfind(b"\n")
+        if end == -1:
+            return []
+        self.offset += end + 1
+
+        new_rows = []
+        duplicates = 0
+        for line in chunk[:end].split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                key = detection_key(row)
+                if key in self.seen_keys:
+                    duplicates += 1
+                    continue
+            except (ValueError, AttributeError, TypeError) as e:
+                logger.error(f"Skipping malformed detection line in {self.file_path}: {e}")
+                continue
+            self.seen_keys.add(key)
+            new_rows.append(row)
+        if duplicates:
+            logger.debug(f"Skipped {duplicates} duplicate detections in {self.file_path}")
+        return new_rows
+
+    def append_rows(self, rows: list):
+        ''' append detections received from a node to the daily file(s), they are picked up by the next refresh '''
+        lines_by_date = {}
+        for row in rows:
+            lines_by_date.setdefault(str(row.get("start_ts", ""))[:10], []).append(json.dumps(row) + "\n")
+        with self.append_lock:
+            for date_str, lines in lines_by_date.items():
+                with open(self.detections_file_for(date_str), "ab") as fileout:
+                    fileout.write("".join(lines).encode()) # one write, so a reader never sees half a batch
+
+    def get_rows(self) -> list:
+        ''' copy of today's detections (refreshes first), safe to iterate while the polling thread appends or rolls over '''
+        self.refresh()
+        with self.lock:
+            return list(self.rows)
+
+    def get_aggregates(self) -> DetectionAggregates:
+        ''' snapshot of the incrementally maintained aggregates of today's detections (refreshes first) '''
+        self.refresh()
+        with self.lock:
+            return self.aggregates.snapshot()
+
+    def start_polling(self, interval: float = 5.0):
+        ''' refresh in a background thread so listeners see new detections without a page load '''
+        if self.poll_thread is not None:
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Exception while refreshing detections store: {e}")
+
+        self.refresh()
+        self.poll_thread = threading.Thread(target=poll, daemon=True)
+        self.poll_thread.start()
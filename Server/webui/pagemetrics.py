@@ -0,0 +1,168 @@
+import functools, logging, sys, threading, time
+from collections import Counter
+from contextlib import contextmanager
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from nicegui import app, core
+
+logger = logging.getLogger(__name__)
+
+''' name: (type, help, histogram buckets) '''
+SERVER_METRICS = {
+    'birdserver_page_render_seconds': ('histogram', 'Seconds to build a page (python side, before the response is sent)', (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'birdserver_page_phase_seconds': ('histogram', 'Seconds spent in each phase of building a page (load, aggregate, widgets)', (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'birdserver_http_request_seconds': ('histogram', 'Seconds to answer an http request, by route', (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'birdserver_http_response_bytes': ('histogram', 'Bytes of http response bodies, by route (page responses carry the initial elements)', (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6)),
+    'birdserver_websocket_sent_bytes_total': ('counter', 'Bytes sent to clients over the websocket (element updates after the page loaded)', None),
+    'birdserver_api_responses_total': ('counter', 'Responses of the json query api, by route and result (not_modified, cached, computed)', None),
+    'birdserver_clients': ('gauge', 'Connected clients, by page', None),
+}
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+class PageMetrics:
+    """
+    Timings of the NiceGUI pages and how much they send to clients, rendered in the Prometheus
+    text format for /metrics.
+
+    Pages are timed as a whole with timed_page and in phases with phase, every http request is
+    timed by route in a middleware, and websocket traffic is counted as it is sent.
+
+    Args:
+        page_routes (list): Routes of the NiceGUI pages, connected clients are counted for each.
+    """
+
+    def __init__(self, page_routes: list = None):
+        self.page_routes = list(page_routes or [])
+        self.values = {} # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = SERVER_METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.values.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def phase(self, route: str, phase: str):
+        ''' time one phase of building a page, e.g. with page_metrics.phase('/', 'load'): '''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('birdserver_page_phase_seconds', time.perf_counter() - started, route=route, phase=phase)
+
+    def timed_page(self, route: str):
+        ''' decorator for a page function (under @ui.page), records how long building the page took '''
+        if route not in self.page_routes:
+            self.page_routes.append(route)
+        def decorator(page_function):
+            @functools.wraps(page_function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return page_function(*args, **kwargs)
+                finally:
+                    self.observe('birdserver_page_render_seconds', time.perf_counter() - started, route=route)
+            return wrapper
+        return decorator
+
+    def route_label(self, path: str) -> str:
+        ''' keeps the route label to known routes, so static files and typos don't grow the metrics '''
+        if path in self.page_routes or path.startswith('/api/') or path == '/metrics':
+            return path
+        if path.startswith('/_nicegui'):
+            return '/_nicegui'
+        return 'other'
+
+    def render(self) -> str:
+        ''' connected clients are counted when scraped '''
+        for route in self.page_routes:
+            connected = sum(1 for client in app.clients(route) if client.has_socket_connection)
+            with self.lock:
+                self.values[('birdserver_clients', (('route', route),))] = connected
+
+        lines = []
+        with self.lock:
+            for name, (metric_type, help_text, buckets) in SERVER_METRICS.items():
+                series = sorted(((labels, value) for (key_name, labels), value in self.values.items() if key_name == name), key=lambda item: item[0])
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in series:
+                    if metric_type == 'histogram':
+                        bucket_counts, total, count = value
+                        for bound, bucket_count in zip(buckets, bucket_counts):
+                            lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {bucket_count}")
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                        lines.append(f"{name}_count{format_labels(labels)} {count}")
+                    else:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def initPageMetrics(page_metrics: PageMetrics):
+    ''' time every http request and count websocket bytes sent to clients '''
+
+    class TimingMiddleware(BaseHTTPMiddleware):
+        """ Records the duration and response size of every request by route """
+        async def dispatch(self, request: Request, call_next):
+            started = time.perf_counter()
+            response = await call_next(request)
+            route = page_metrics.route_label(request.url.path)
+            page_metrics.observe('birdserver_http_request_seconds', time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+            content_length = response.headers.get('content-length')
+            if content_length:
+                page_metrics.observe('birdserver_http_response_bytes', int(content_length), route=route)
+            return response
+
+    app.add_middleware(TimingMiddleware)
+
+    ''' every socket.io packet to a client goes through engine.io's send, so count the encoded packets there '''
+    send = core.sio.eio.send
+    async def counting_send(sid, data):
+        page_metrics.inc('birdserver_websocket_sent_bytes_total', len(data))
+        return await send(sid, data)
+    core.sio.eio.send = counting_send
+
+
+''' Sampling profiler '''
+def sample_stacks(seconds: float, interval: float = 0.005) -> Counter:
+    '''
+    sample the stack of every other thread each interval for seconds, returns counts of collapsed
+    stacks ("thread;file:function:line;..."), the format flamegraph.pl and speedscope read
+    '''
+    sampler_id = threading.get_ident()
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(f"{frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            stacks[";".join([thread_names.get(thread_id, str(thread_id))] + frames[::-1])] += 1
+        time.sleep(interval)
+    return stacks
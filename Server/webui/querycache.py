@@ -0,0 +1,51 @@
+import hashlib, logging, threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    ''' whether an If-None-Match header (a comma separated list of etags, weak W/ ones included, or *) names etag '''
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags:
+        return True
+    opaque = etag.removeprefix("W/").strip('"')
+    return any(tag.removeprefix("W/").strip('"') == opaque for tag in tags if tag)
+
+class QueryCache:
+    """
+    Encoded responses of the json query api, keyed on the query and the version of the data it
+    was computed from.
+
+    A response stays valid until the data version changes, so repeated polls are answered from
+    memory, and the etag is derived from the version and query alone, so a client whose copy is
+    current gets a 304 without anything being recomputed (even after its entry was evicted).
+
+    Args:
+        max_entries (int): Responses kept, the least recently used are evicted first.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (data version, body bytes)
+        self.lock = threading.Lock()
+
+    def etag_for(self, key: str, version: str) -> str:
+        return '"' + hashlib.sha1(f"{version}|{key}".encode()).hexdigest()[:20] + '"'
+
+    def get(self, key: str, version: str) -> bytes:
+        ''' cached body for key if it was computed from this data version, else None '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, version: str, body: bytes):
+        with self.lock:
+            self.entries[key] = (version, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
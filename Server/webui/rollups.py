@@ -0,0 +1,169 @@
+import json, logging, os, threading, time
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from webui.aggregates import DetectionAggregates #internal package
+from webui.detectionsdb import detection_key #internal package
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_VERSION = 1
+
+class RollupStore:
+    """
+    Daily rollups of the detections files: one small json summary per day with an entry per node
+    (per species counts, confidence sums/min/max, first/last seen and hourly histograms).
+
+    Each closed day is summarized once into rollup-YYYY-MM-DD.json, and rebuilt if its
+    detections file has grown since (a node pushed late detections). Today's rollup is kept up to
+    date by the detections store, which only aggregates the rows appended since its last refresh.
+    Multi-day views merge the rollups, so 90 days of charts read 90 small files instead of every
+    detection. If the rollups directory can't be written (e.g. it is inside a read-only mount of
+    the nodes' detections), rollups are only kept in memory and rebuilt after a restart.
+
+    Args:
+        detections_directory (Path): Directory containing detections-YYYY-MM-DD.jsonl files.
+        detections_store (DetectionsStore): Store tailing today's file, today's rollup comes from its aggregates.
+        rollup_directory (Path): Directory rollups are written to, defaults to <detections_directory>/rollups.
+    """
+
+    def __init__(self, detections_directory: Path, detections_store, rollup_directory: Path = None):
+        self.detections_directory = Path(detections_directory)
+        self.detections_store = detections_store
+        self.rollup_directory = Path(rollup_directory) if rollup_directory else self.detections_directory / "rollups"
+        try:
+            os.makedirs(self.rollup_directory, exist_ok=True)
+            if not os.access(self.rollup_directory, os.W_OK):
+                raise PermissionError("not writable")
+        except OSError as e:
+            logger.warning(f"Can't write rollups to {self.rollup_directory} ({e}), keeping them in memory only (see --rollups-directory)")
+            self.rollup_directory = None
+        self.cache = {} # date_str -> rollup of a closed day
+        self.lock = threading.Lock()
+        self.poll_thread = None
+
+    def detections_file_for(self, date_str: str) -> Path:
+        return self.detections_directory / Path("detections-" + date_str + ".jsonl")
+
+    def rollup_file_for(self, date_str: str) -> Path:
+        ''' None when rollups are only kept in memory '''
+        if self.rollup_directory is None:
+            return None
+        return self.rollup_directory / Path("rollup-" + date_str + ".json")
+
+    def build_day(self, date_str: str) -> dict:
+        ''' summarize one day's detections file per node and write its rollup '''
+        file_path = self.detections_file_for(date_str)
+        size = os.path.getsize(file_path)
+        with open(file_path, "rb") as filein:
+            data = filein.read(size) # bytes appended after the stat are left for the next rebuild
+
+        nodes = {}
+        seen_keys = set() # a row both pushed to /api/ingest and synced into the directory is counted once
+        for line in data.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                key = detection_key(row)
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                node_name = row.get('node_name') or "unknown"
+                if node_name not in nodes:
+                    nodes[node_name] = DetectionAggregates()
+                nodes[node_name].add(row)
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                logger.error(f"Skipping malformed detection line in {file_path}: {e}")
+
+        rollup = {
+            'version': ROLLUP_VERSION,
+            'date': date_str,
+            'source_size': size,
+            'nodes': {node_name: aggregates.to_rollup() for node_name, aggregates in nodes.items()},
+        }
+        rollup_path = self.rollup_file_for(date_str)
+        if rollup_path is not None:
+            tmp_path = rollup_path.with_suffix(".json.tmp")
+            try:
+                with open(tmp_path, "w") as fileout:
+                    json.dump(rollup, fileout, separators=(",", ":"))
+                os.replace(tmp_path, rollup_path)
+            except OSError as e:
+                logger.error(f"Could not write rollup {rollup_path}, keeping it in memory only: {e}")
+        logger.debug(f"Built rollup for {date_str} ({sum(node['total_count'] for node in rollup['nodes'].values())} detections)")
+        return rollup
+
+    def load_day(self, date_str: str) -> dict:
+        ''' rollup of a closed day, (re)built if missing or the day's detections file has grown. None if there is no file '''
+        try:
+            size = os.path.getsize(self.detections_file_for(date_str))
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.cache.get(date_str)
+        if cached is not None and cached['source_size'] == size:
+            return cached
+
+        rollup = None
+        rollup_path = self.rollup_file_for(date_str)
+        try:
+            if rollup_path is not None:
+                with open(rollup_path, "r") as filein:
+                    rollup = json.load(filein)
+            if rollup is not None and (rollup.get('version') != ROLLUP_VERSION or rollup.get('source_size') != size):
+                rollup = None
+        except (OSError, ValueError, AttributeError):
+            rollup = None
+        if rollup is None:
+            rollup = self.build_day(date_str)
+        with self.lock:
+            self.cache[date_str] = rollup
+        return rollup
+
+    def build_closed_days(self) -> int:
+        ''' make sure every day before today has an up to date rollup, returns number of days checked '''
+        date_today_str = datetime.now().strftime("%Y-%m-%d")
+        checked = 0
+        for file_path in sorted(self.detections_directory.glob("detections-*.jsonl")):
+            date_str = file_path.stem[len("detections-"):]
+            if date_str >= date_today_str:
+                continue
+            try:
+                self.load_day(date_str)
+                checked += 1
+            except Exception as e:
+                logger.error(f"Exception while building rollup for {date_str}: {e}")
+        return checked
+
+    def start(self, interval: float = 600):
+        ''' build rollups in a background thread, rechecking every interval so the day that just closed is picked up '''
+        if self.poll_thread is not None:
+            return
+
+        def poll():
+            while True:
+                started = time.perf_counter()
+                checked = self.build_closed_days()
+                logger.debug(f"Checked rollups of {checked} closed days in {time.perf_counter() - started:.1f}s")
+                time.sleep(interval)
+
+        self.poll_thread = threading.Thread(target=poll, daemon=True)
+        self.poll_thread.start()
+
+    def query(self, from_date_str: str, to_date_str: str, species: str = None) -> DetectionAggregates:
+        ''' aggregates of an inclusive YYYY-MM-DD date range, merged from the daily rollups '''
+        aggregates = DetectionAggregates()
+        date_today_str = datetime.now().strftime("%Y-%m-%d")
+        day = datetime.strptime(from_date_str, "%Y-%m-%d")
+        last_day = datetime.strptime(min(to_date_str, date_today_str), "%Y-%m-%d")
+        while day <= last_day:
+            date_str = day.strftime("%Y-%m-%d")
+            if date_str == date_today_str:
+                rollups = [self.detections_store.get_aggregates().to_rollup()]
+            else:
+                rollup = self.load_day(date_str)
+                rollups = list(rollup['nodes'].values()) if rollup else []
+            aggregates.add_rollups(date_str, rollups, species)
+            day += timedelta(days=1)
+        return aggregates
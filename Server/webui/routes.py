@@ -1,114 +1,140 @@
-import os, logging
-from pathlib import Path
-from datetime import datetime
+import gzip, json, logging
+from datetime import datetime, timedelta
 from typing import Optional
-from fastapi.responses import RedirectResponse
-from nicegui import app, ui
+from fastapi import Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response
+from nicegui import app, run, ui
 
 from webui import datacharts #internal package
+from webui.aggregates import DetectionAggregates #internal package
+from webui.auth import bearer_token_matches #internal package
+from webui.detectionsdb import DETECTION_FIELDS #internal package
+from webui.pagemetrics import sample_stacks #internal package
+from webui.querycache import etag_matches #internal package
 
 logger = logging.getLogger(__name__)
 
 ''' MAIN ROUTE / '''
-def generateRouteMain(authentication: bool, detections_data: list, directory_watcher: Path):
+def generateRouteMain(authentication: bool, detections_store, detections_db, storage_monitor, page_metrics):
     @ui.page('/')
+    @page_metrics.timed_page('/')
     def main_page() -> None:
+        with page_metrics.phase('/', 'load'):
+            detections_data = detections_store.get_rows() # today's detections, a copy so the polling thread can keep appending
+            aggregates = detections_store.get_aggregates()
+            latest_id = detections_db.detection_id(detections_data[-1]) if detections_data else None # for the clip of the most recent detection
+        with page_metrics.phase('/', 'widgets'):
+            build_main_page(authentication, detections_data, aggregates, storage_monitor, latest_id)
+
+def build_main_page(authentication: bool, detections_data: list, aggregates, storage_monitor, latest_id: int = None):
+    if authentication:
+        def logout() -> None:
+            app.storage.user.clear()
+            ui.navigate.to('/login')
+    
+    
+    ''' title of page '''
+    ui.page_title('Bird Identification Tool')          
+
+    ''' call function to generate header bar '''
+    with ui.header():
+        generate_header(route='/',ui=ui, authentication=authentication) 
         if authentication:
-            def logout() -> None:
-                app.storage.user.clear()
-                ui.navigate.to('/login')
-        
-        
-        ''' title of page '''
-        ui.page_title('Bird Identification Tool')          
+            ui.button(on_click=logout, icon='logout').classes("h-11") # logout button
     
-        ''' call function to generate header bar '''
-        with ui.header():
-            generate_header(route='/',ui=ui, authentication=authentication) 
-            if authentication:
-                ui.button(on_click=logout, icon='logout').classes("h-11") # logout button
+    ''' MAIN DASHBOARD CARDS '''
+    with ui.card().classes('absolute-center').style('align-items: center;'):
+        with ui.column():
+            with ui.row():
+                ''' today's date card '''
+                with ui.card():
+                    ui.label(datetime.now().strftime("%A, %B %-d, %Y")).style('font-size: 36px; font-weight: bold;')
         
-        ''' MAIN DASHBOARD CARDS '''
-        with ui.card().classes('absolute-center').style('align-items: center;'):
-            with ui.column():
-                with ui.row():
-                    ''' today's date card '''
-                    with ui.card():
-                        ui.label(datetime.now().strftime("%A, %B %-d, %Y")).style('font-size: 36px; font-weight: bold;')
+        with ui.column():
+            with ui.row():
+                ''' total detections today card '''
+                with ui.card():
+                    with ui.column().style('align-items: center;'):
+                        ui.label('Audio Detections').style('font-weight: bold')
+                        ui.label(str(aggregates.total_count)).style('font-size: 36px; font-weight: bold; color: #6E93D6;')
+                        # .style('color: #6E93D6; font-size: 200%; font-weight: 300').classes('absolute-center')
             
-            with ui.column():
-                with ui.row():
-                    ''' total detections today card '''
-                    with ui.card():
-                        with ui.column().style('align-items: center;'):
-                            ui.label('Audio Detections').style('font-weight: bold')
-                            ui.label(str(len(detections_data))).style('font-size: 36px; font-weight: bold; color: #6E93D6;')
-                            # .style('color: #6E93D6; font-size: 200%; font-weight: 300').classes('absolute-center')
+                ''' recent identification card '''
+                with ui.card():
+                    with ui.column().style('align-items: center;'):
+                        ui.label('Most Recent Identification').style('font-weight: bold')
+                        try:
+                            ui.label(detections_data[-1]["common_name"]).style('font-size: 36px; font-weight: bold; color: #6E93D6;')
+                            if latest_id is not None:
+                                ui.audio(f"/api/clips/{latest_id}") # just the detection, cut from the recording
+                            #ui.markdown(str(detections_data[-1]["start_ts"]))
+                        except:
+                            ui.label("None").style('font-size: 36px; font-weight: bold; color: #6E93D6;')
+                        
+                ''' average model confidence card '''
+                with ui.card():
+                    with ui.column().style('align-items: center;'):
+                        ui.label('Model Confidence').style('font-weight: bold')
+                        ''' calculate average '''
+                        if aggregates.total_count:
+                            model_conf = round(aggregates.mean_confidence(),2)
+                            ''' conditional formatting color for model confidence '''
+                            if model_conf < .25:
+                                model_color = "red"
+                            elif model_conf < .5:
+                                model_color = "orange"
+                            elif model_conf < .75:
+                                model_color = "orange"
+                            else:
+                                model_color = "green"
                 
-                    ''' recent identification card '''
-                    with ui.card():
-                        with ui.column().style('align-items: center;'):
-                            ui.label('Most Recent Identification').style('font-weight: bold')
-                            try:
-                                ui.label(detections_data[-1]["common_name"]).style('font-size: 36px; font-weight: bold; color: #6E93D6;')
-                                ui.audio(detections_data[-1]["filename"])# later use .seek() to start 1s before the start of detection
-                                #ui.markdown(str(detections_data[-1]["start_ts"]))
-                            except:
-                                ui.label("None").style('font-size: 36px; font-weight: bold; color: #6E93D6;')
-                            
-                    ''' average model confidence card '''
+                            #ui.label(str(model_conf)).style(f'font-size: 36px; font-weight: bold; color: {model_color};')
+                            ui.circular_progress(value=model_conf,color=model_color)
+                        else:
+                            ''' default style for model confidence '''
+                            ui.label("-").style('font-size: 36px; font-weight: bold; color: #6E93D6;')
+                
+                ''' directory watcher card, usage is kept up to date in the background by the storage monitor '''
+                if storage_monitor:    
                     with ui.card():
-                        with ui.column().style('align-items: center;'):
-                            ui.label('Model Confidence').style('font-weight: bold')
-                            ''' calculate average '''
-                            if detections_data:
-                                conf = 0
-                                for entry in detections_data:
-                                    conf = conf + float(entry["confidence"])                        
-                                model_conf = round(conf/len(detections_data),2)
-                                ''' conditional formatting color for model confidence '''
-                                if model_conf < .25:
-                                    model_color = "red"
-                                elif model_conf < .5:
-                                    model_color = "orange"
-                                elif model_conf < .75:
-                                    model_color = "orange"
-                                else:
-                                    model_color = "green"
-                    
-                                #ui.label(str(model_conf)).style(f'font-size: 36px; font-weight: bold; color: {model_color};')
-                                ui.circular_progress(value=model_conf,color=model_color)
+                        with ui.row():
+                            ''' get dir size, color icon depending on disk usage '''
+                            dir_size = storage_monitor.total_gb()
+                            if dir_size > 5: #critical 5gb used
+                                color_usage = 'red'
+                            elif dir_size > 3: #warning 3gb used
+                                color_usage = 'orange'
                             else:
-                                ''' default style for model confidence '''
-                                ui.label("-").style('font-size: 36px; font-weight: bold; color: #6E93D6;')
-                    
-                    ''' directory watcher card '''
-                    if directory_watcher:    
-                        with ui.card():
-                            with ui.row():
-                                ''' get dir size, color icon depending on disk usage '''
-                                dir_size = get_directory_size(directory_watcher)
-                                if dir_size > 5: #critical 5gb used
-                                    color_usage = 'red'
-                                elif dir_size > 3: #warning 3gb used
-                                    color_usage = 'orange'
-                                else:
-                                    color_usage = 'green'
-                                    
-                                with ui.column().style('align-items: center;'):
-                                    ui.label('Storage Usage').style('font-weight: bold')
-                                    ui.icon('folder_open', color=color_usage).classes('text-5xl')
-                                    ui.markdown(str(dir_size) + "GB Used" )           
-                            
-        ''' queries '''
-        ui.query('header').style(f'background-color: #292f48')
-        ui.query('body').style(f'background-color: #42849b')
+                                color_usage = 'green'
+                                
+                            with ui.column().style('align-items: center;'):
+                                ui.label('Storage Usage').style('font-weight: bold')
+                                ui.icon('folder_open', color=color_usage).classes('text-5xl')
+                                ui.markdown(str(dir_size) + "GB Used" )
+                                growth_rate = storage_monitor.growth_rate_gb_per_day()
+                                if growth_rate is not None:
+                                    ui.label(f"{growth_rate:+}GB/day")
+                                ''' breakdown by subdirectory and file type on hover '''
+                                breakdown = storage_monitor.breakdown()
+                                with ui.tooltip():
+                                    for name, size in list(breakdown['subdirectory'].items())[:5]:
+                                        ui.label(f"{name}/: {size}GB")
+                                    for name, size in list(breakdown['extension'].items())[:5]:
+                                        ui.label(f"{name}: {size}GB")
+                        
+    ''' queries '''
+    ui.query('header').style(f'background-color: #292f48')
+    ui.query('body').style(f'background-color: #42849b')
 
 
 ''' FULL ANALYSIS ROUTE /analysis '''
-def generateRouteAnalysis(authentication: bool, detections_data: list):
+def generateRouteAnalysis(authentication: bool, detections_store, detections_db, rollup_store, page_metrics):
     @ui.page('/analysis')
+    @page_metrics.timed_page('/analysis')
     def analysis_page() -> None:
+        with page_metrics.phase('/analysis', 'load'):
+            detections_store.refresh() # make sure today's newest detections are in the database
+            species_names = detections_db.species_names()
         def logout() -> None:
             app.storage.user.clear()
             ui.navigate.to('/login')
@@ -120,34 +146,117 @@ def generateRouteAnalysis(authentication: bool, detections_data: list):
             generate_header(route='/analysis',ui=ui, authentication=authentication) 
             if authentication:
                 ui.button(on_click=logout, icon='logout').classes("h-11") # logout button
-            
+
+        ''' date range and species filters, default is today for all species '''
+        date_today_str = datetime.now().strftime("%Y-%m-%d")
+        filters = {'from': date_today_str, 'to': date_today_str, 'species': None}
+
+        @ui.refreshable
+        def analysis_tabs() -> None:
+            start, end = date_range_bounds(filters['from'], filters['to'])
+            if filters['from'] == filters['to'] == detections_store.date_str and not filters['species']:
+                aggregates = detections_store.get_aggregates() # today for all species is kept up to date by the store
+            else:
+                with page_metrics.phase('/analysis', 'rollups'):
+                    aggregates = rollup_store.query(filters['from'], filters['to'], species=filters['species']) # charts merge daily summaries, the table pages through the database
+            with page_metrics.phase('/analysis', 'widgets'):
+                analysis_widgets(start, end, aggregates)
+
+        def analysis_widgets(start, end, aggregates) -> None:
+            with ui.tabs() as tabs:
+                one = ui.tab('Detections')
+                two = ui.tab('Species Distribution')
+                three = ui.tab('Model Confidence')
+                four = ui.tab('Detections over Time')
+                five = ui.tab('Detections by Hour')
+            with ui.tab_panels(tabs, value=one):
+                with ui.tab_panel(one):
+                    ''' server side pagination, sorting/filtering/paging run in the database and only the current page is sent to the client '''
+                    table_filters = {'min_confidence': 0.0}
+                    pagination = {'rowsPerPage': 10, 'descending': True, 'sortBy': 'start_ts', 'page': 1, 'rowsNumber': 0}
+
+                    def load_page(new_pagination: dict = None) -> None:
+                        if new_pagination:
+                            pagination.update(new_pagination)
+                        query_filters = {'start': start, 'end': end, 'species': filters['species'], 'min_confidence': table_filters['min_confidence'] or None}
+                        with page_metrics.phase('/analysis', 'table'):
+                            pagination['rowsNumber'] = detections_db.count_detections(**query_filters)
+                            rows_per_page = pagination['rowsPerPage'] or pagination['rowsNumber'] # 0 means all rows
+                            table.rows = detections_db.query_page(
+                                **query_filters,
+                                sort_by=pagination['sortBy'] or 'start_ts',
+                                descending=pagination['descending'],
+                                offset=(pagination['page'] - 1) * rows_per_page,
+                                limit=rows_per_page,
+                            )
+                            table.pagination = dict(pagination)
+
+                    def change_min_confidence(value) -> None:
+                        table_filters['min_confidence'] = value
+                        load_page({'page': 1})
+
+                    with ui.row().style('align-items: center;'):
+                        ui.label('Min Confidence').style('font-weight: bold')
+                        ui.slider(min=0, max=1, step=0.05, value=0).props('label').classes('w-48').on('change', lambda e: change_min_confidence(e.args))
+                    ''' create table object using headers, rows are loaded one page at a time '''
+                    columns = [{'name': field, 'label': field, 'field': field, 'sortable': True, 'align': 'left'} for field in DETECTION_FIELDS]
+                    table = ui.table(columns=columns, rows=[], row_key='id', pagination=pagination)
+                    table.on('request', lambda e: load_page(e.args['pagination']))
+                    load_page()
+                    ''' play a clip of the detection, nothing is fetched until play is pressed '''
+                    table.add_slot('body-cell-filename', '''
+                    <q-td key="filename" :props="props">
+                        <audio controls preload="none" :src="'/api/clips/' + props.row.id" style="height: 32px;"></audio>
+                    </q-td>
+                    ''')
+                    ''' add quasar conditional formatting for model confidence '''
+                    table.add_slot('body-cell-confidence', '''
+                    <q-td key="confidence" :props="props">
+                        <q-badge :color="props.value < 0.25 ? 'red' : props.value < 0.5 ? 'orange' : props.value < 0.75 ? 'yellow' : 'green'">
+                            {{ props.value }}
+                        </q-badge>
+                    </q-td>
+                    ''')
+                with ui.tab_panel(two):
+                    ''' distribution by species pie chart '''
+                    piechart =  datacharts.generate_pie_chart_object(pie_type="species-distro", input_data=aggregates)
+                with ui.tab_panel(three):
+                    ''' avg model confidence bar chart '''
+                    barchart = datacharts.generate_bar_chart_object(bar_type="species-confidence", input_data=aggregates)
+                with ui.tab_panel(four):
+                    linechart = datacharts.generate_line_chart_object(input_data=aggregates)
+                with ui.tab_panel(five):
+                    hourchart = datacharts.generate_bar_chart_object(bar_type="hourly-detections", input_data=aggregates)
+
+        def change_date_range(e) -> None:
+            ''' quasar range picker gives a string for a single day, or a from/to dict for a range '''
+            if not e.value:
+                return
+            if isinstance(e.value, dict):
+                filters['from'], filters['to'] = e.value['from'].replace('/', '-'), e.value['to'].replace('/', '-')
+            else:
+                filters['from'] = filters['to'] = e.value.replace('/', '-')
+            date_label.set_text(f"{filters['from']} to {filters['to']}")
+            analysis_tabs.refresh()
+
+        def change_preset(e) -> None:
+            from_date_str, to_date_str = preset_date_range(e.value)
+            date_picker.set_value({'from': from_date_str, 'to': to_date_str}) # picker's on_change refreshes the tabs
+
+        def change_species(e) -> None:
+            filters['species'] = None if e.value == 'All Species' else e.value
+            analysis_tabs.refresh()
+
         with ui.card().classes('overflow-auto fixed-center'):
+            with ui.row().style('align-items: center;'):
+                with ui.button(icon='edit_calendar'):
+                    with ui.menu():
+                        date_picker = ui.date(value={'from': date_today_str, 'to': date_today_str}, on_change=change_date_range).props('range')
+                date_label = ui.label(f"{date_today_str} to {date_today_str}").style('font-weight: bold')
+                ui.select(list(DATE_PRESETS), value='Today', on_change=change_preset).classes('w-40')
+                ui.select(['All Species'] + species_names, value='All Species', with_input=True, on_change=change_species).classes('w-64')
             with ui.card():
-                with ui.tabs() as tabs:
-                    one = ui.tab('Detections Today')
-                    two = ui.tab('Species Distribution')
-                    three = ui.tab('Model Confidence')
-                    four = ui.tab('Detections over Time')
-                with ui.tab_panels(tabs, value=one):
-                    with ui.tab_panel(one):
-                        ''' create table object using data and headers '''
-                        table = ui.table(rows=detections_data, pagination={'rowsPerPage': 10, 'descending': True, 'sortBy': 'start_ts'},)
-                        ''' add quasar conditional formatting for model confidence '''
-                        table.add_slot('body-cell-confidence', '''
-                        <q-td key="confidence" :props="props">
-                            <q-badge :color="props.value < 0.25 ? 'red' : props.value < 0.5 ? 'orange' : props.value < 0.75 ? 'yellow' : 'green'">
-                                {{ props.value }}
-                            </q-badge>
-                        </q-td>
-                        ''')
-                    with ui.tab_panel(two):
-                        ''' distribution by species pie chart '''
-                        piechart =  datacharts.generate_pie_chart_object(pie_type="species-distro", input_data=detections_data)
-                    with ui.tab_panel(three):
-                        ''' avg model confidence bar chart '''
-                        barchart = datacharts.generate_bar_chart_object(bar_type="species-confidence", input_data=detections_data)
-                    with ui.tab_panel(four):
-                        linechart = datacharts.generate_line_chart_object(input_data=detections_data)
+                analysis_tabs()
            
         #queries 
         ui.query('header').style(f'background-color: #292f48')
@@ -223,6 +332,139 @@ def generateReadmeRoute(authentication: bool):
         ui.query('header').style(f'background-color: #292f48')
         ui.query('body').style(f'background-color: #42849b')
 
+''' INGEST API /api/ingest '''
+def generateRouteIngest(detections_db, detections_store, ingest_token: str = None):
+    ''' nodes POST (optionally gzipped) batches of detections: {"batch_id": str, "node_name": str, "detections": [rows]} '''
+    @app.post('/api/ingest')
+    async def ingest(request: Request):
+        if ingest_token and not bearer_token_matches(request, ingest_token):
+            return JSONResponse({'error': 'unauthorized'}, status_code=401)
+
+        body = await request.body()
+        try:
+            if request.headers.get('content-encoding') == 'gzip':
+                body = gzip.decompress(body)
+            batch = json.loads(body)
+            batch_id = str(batch['batch_id'])
+            rows = [row for row in batch['detections'] if isinstance(row, dict) and row.get('start_ts')]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Rejected malformed detections batch: {e}")
+            return JSONResponse({'error': 'malformed batch'}, status_code=400)
+
+        ''' sqlite and file writes block, so keep them off the event loop '''
+        new_rows = await run.io_bound(detections_db.ingest_batch, batch_id, batch.get('node_name'), rows)
+        if new_rows is None:
+            logger.info(f"Detections batch {batch_id} already ingested, ignoring")
+            return {'batch_id': batch_id, 'received': len(rows), 'inserted': 0, 'duplicate': True}
+        if new_rows:
+            ''' today's dashboard tails the daily files, so rows the database didn't already have are appended there too
+            (the store and rollups skip a row a node also wrote into a shared detections directory) '''
+            await run.io_bound(detections_store.append_rows, new_rows)
+        logger.info(f"Ingested batch {batch_id} from {batch.get('node_name')}: {len(new_rows)} new of {len(rows)} detections")
+        return {'batch_id': batch_id, 'received': len(rows), 'inserted': len(new_rows), 'duplicate': False}
+
+''' JSON QUERY API /api/detections /api/aggregates '''
+def generateRouteQueryApi(detections_db, detections_store, rollup_store, query_cache, page_metrics):
+    '''
+    detections and the aggregates behind the charts as json for scripts and other displays. responses are
+    cached until the data version changes and carry an etag, so a poll with If-None-Match gets a 304
+    '''
+    async def cached_json(request: Request, route: str, key: str, compute) -> Response:
+        await run.io_bound(detections_store.refresh) # today's file is tailed, so pick up new lines before reading the version
+        version = detections_db.data_version()
+        etag = query_cache.etag_for(key, version)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'} # clients may keep the response but must revalidate it
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            page_metrics.inc('birdserver_api_responses_total', route=route, result='not_modified')
+            return Response(status_code=304, headers=headers)
+        body = query_cache.get(key, version)
+        if body is None:
+            body = json.dumps(await run.io_bound(compute), separators=(",", ":")).encode()
+            query_cache.put(key, version, body)
+            page_metrics.inc('birdserver_api_responses_total', route=route, result='computed')
+        else:
+            page_metrics.inc('birdserver_api_responses_total', route=route, result='cached')
+        return Response(body, media_type='application/json', headers=headers)
+
+    @app.get('/api/detections')
+    async def api_detections(request: Request, from_date: str = Query(None, alias='from'), to_date: str = Query(None, alias='to'), species: str = None,
+                             node: str = None, min_confidence: float = None, cursor: str = None, limit: int = 100):
+        ''' newest first, pass next_cursor back as cursor for the following page '''
+        try:
+            start, end = date_range_bounds(*api_date_range(from_date, to_date))
+            after = None
+            if cursor:
+                start_ts, row_id = cursor.rsplit(',', 1)
+                after = (start_ts, int(row_id))
+        except ValueError:
+            return JSONResponse({'error': 'dates are YYYY-MM-DD and cursor is a next_cursor value'}, status_code=400)
+        limit = min(max(limit, 1), 1000)
+
+        def compute():
+            rows = detections_db.query_cursor(start=start, end=end, species=species, node_name=node, min_confidence=min_confidence, after=after, limit=limit)
+            next_cursor = f"{rows[-1]['start_ts']},{rows[-1]['id']}" if len(rows) == limit else None
+            return {'detections': rows, 'next_cursor': next_cursor}
+
+        key = f"detections|{start}|{end}|{species}|{node}|{min_confidence}|{cursor}|{limit}"
+        return await cached_json(request, '/api/detections', key, compute)
+
+    @app.get('/api/aggregates')
+    async def api_aggregates(request: Request, from_date: str = Query(None, alias='from'), to_date: str = Query(None, alias='to'), species: str = None, node: str = None):
+        ''' totals, per species stats, hourly histograms and the cumulative series of a date range (default today) '''
+        try:
+            from_date_str, to_date_str = api_date_range(from_date, to_date)
+            start, end = date_range_bounds(from_date_str, to_date_str)
+        except ValueError:
+            return JSONResponse({'error': 'dates are YYYY-MM-DD'}, status_code=400)
+
+        def compute():
+            if node:
+                ''' rollups of today aren't split by node, so one node's aggregates come from the database '''
+                aggregates = DetectionAggregates(detections_db.query_detections(start=start, end=end, species=species, node_name=node))
+            else:
+                aggregates = rollup_store.query(from_date_str, to_date_str, species=species)
+            payload = {'from': from_date_str, 'to': to_date_str}
+            payload.update(aggregates.to_rollup())
+            payload['cumulative'] = aggregates.cumulative_series()
+            return payload
+
+        key = f"aggregates|{from_date_str}|{to_date_str}|{species}|{node}"
+        return await cached_json(request, '/api/aggregates', key, compute)
+
+''' DETECTION CLIPS /api/clips/<id> '''
+def generateRouteClips(detections_db, clip_store):
+    ''' audio clip of one detection, served with range support (206 partial content) so players can seek '''
+    @app.get('/api/clips/{detection_id}')
+    async def clip(detection_id: int):
+        row = await run.io_bound(detections_db.get_detection, detection_id)
+        if row is None:
+            return JSONResponse({'error': 'detection not found'}, status_code=404)
+        try:
+            found = await run.io_bound(clip_store.clip_for, row) # cutting a clip blocks, so keep it off the event loop
+        except (RuntimeError, OSError) as e:
+            logger.error(f"Could not cut a clip of detection {detection_id}: {e}")
+            return JSONResponse({'error': 'recording could not be read'}, status_code=500)
+        if found is None:
+            return JSONResponse({'error': 'recording not found'}, status_code=404)
+        clip_path, media_type = found
+        return FileResponse(clip_path, media_type=media_type, headers={'Cache-Control': 'private, max-age=86400'}) # starlette answers Range requests
+
+''' METRICS /metrics '''
+def generateRouteMetrics(page_metrics):
+    ''' page timings and client traffic in the prometheus text format '''
+    @app.get('/metrics')
+    def metrics() -> PlainTextResponse:
+        return PlainTextResponse(page_metrics.render(), media_type='text/plain; version=0.0.4')
+
+''' PROFILER /debug/profile '''
+def generateRouteProfiler():
+    ''' on demand sampling profiler, /debug/profile?seconds=10 returns collapsed stacks for flamegraph.pl or speedscope '''
+    @app.get('/debug/profile')
+    async def profile(seconds: float = 10, interval_ms: float = 5) -> PlainTextResponse:
+        seconds = min(max(seconds, 1), 60)
+        stacks = await run.io_bound(sample_stacks, seconds, max(interval_ms, 1) / 1000) # sampled from a thread, so the event loop shows up as it runs
+        return PlainTextResponse("\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n")
+
 ''' LOGIN ROUTE /login '''
 def generateLoginRoute(passwords: dict):
     @ui.page('/login')
@@ -274,15 +516,28 @@ def generate_header(route: str, ui, authentication: bool):
             ui.button('Analysis', on_click=lambda: ui.navigate.to('/analysis')).classes("h-11")
             ui.button('Readme', on_click=lambda: ui.navigate.to('/readme')).classes("h-11")
 
-def get_directory_size(path: Path):
-    path = str(path)
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            # skip if it is symbolic link
-            if not os.path.islink(fp):
-                total_size += os.path.getsize(fp)
-    size_gb = round(float(total_size / 1000000000),2)
-    return size_gb
+''' quick date ranges on /analysis, days back from today (inclusive), None is the current season '''
+DATE_PRESETS = {'Today': 0, 'Last 7 Days': 6, 'Last 30 Days': 29, 'Last 90 Days': 89, 'This Season': None}
+
+def preset_date_range(preset: str):
+    ''' inclusive YYYY-MM-DD range of a DATE_PRESETS entry, seasons are meteorological (Dec-Feb, Mar-May, Jun-Aug, Sep-Nov) '''
+    today = datetime.now()
+    days_back = DATE_PRESETS[preset]
+    if days_back is not None:
+        start = today - timedelta(days=days_back)
+    elif today.month < 3:
+        start = datetime(today.year - 1, 12, 1)
+    else:
+        start = datetime(today.year, today.month - today.month % 3, 1)
+    return start.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
+
+def api_date_range(from_date_str: str = None, to_date_str: str = None):
+    ''' YYYY-MM-DD range of the query api, a missing end is today and a missing start is the end '''
+    to_date_str = to_date_str or datetime.now().strftime("%Y-%m-%d")
+    return from_date_str or to_date_str, to_date_str
 
+def date_range_bounds(from_date_str: str, to_date_str: str):
+    ''' convert an inclusive YYYY-MM-DD date range into start (inclusive) and end (exclusive) datetimes '''
+    start = datetime.strptime(from_date_str, "%Y-%m-%d")
+    end = datetime.strptime(to_date_str, "%Y-%m-%d") + timedelta(days=1)
+    return start, end
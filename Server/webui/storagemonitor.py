@@ -0,0 +1,172 @@
+import logging, os, threading, time
+from collections import deque
+from pathlib import Path
+
+try:
+    import watchfiles
+except ImportError: # fall back to periodic rescans only
+    watchfiles = None
+
+logger = logging.getLogger(__name__)
+
+class StorageMonitor:
+    """
+    Background monitor of the disk space used by a directory tree, served to the dashboard from memory.
+
+    A full scan runs once at start and then every rescan_interval seconds, and in between the
+    running total is updated incrementally from filesystem events (if watchfiles is installed).
+    Usage is also broken down by top level subdirectory and by file type, and sampled over time
+    to give a growth rate.
+
+    Args:
+        directory (Path): Directory tree to monitor.
+        rescan_interval (float): Seconds between full rescans that correct any missed events.
+        sample_interval (float): Seconds between usage samples used for the growth rate.
+    """
+
+    def __init__(self, directory: Path, rescan_interval: float = 1800, sample_interval: float = 60):
+        self.directory = Path(directory).resolve()
+        self.rescan_interval = rescan_interval
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        self.files = {} # path -> size in bytes
+        self.total_bytes = 0
+        self.by_subdirectory = {}
+        self.by_extension = {}
+        self.history = deque(maxlen=int(24 * 3600 / sample_interval)) # (time, total bytes) over the last day
+        self.last_scan = None
+        self.scan_changes = None # filesystem events seen while a rescan walks the tree, replayed on top of its result
+        self.started = False
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        threading.Thread(target=self._scan_loop, daemon=True).start()
+        if watchfiles is not None:
+            threading.Thread(target=self._watch_loop, daemon=True).start()
+        else:
+            logger.warning("watchfiles not installed, storage usage is only updated by periodic rescans")
+
+    def _keys_for(self, path: str):
+        relative = os.path.relpath(path, self.directory)
+        parts = relative.split(os.sep)
+        subdirectory = parts[0] if len(parts) > 1 else "."
+        extension = os.path.splitext(path)[1].lower() or "(none)"
+        return subdirectory, extension
+
+    def _add(self, path: str, size: int):
+        ''' must be called with the lock held '''
+        old_size = self.files.get(path, 0)
+        self.files[path] = size
+        delta = size - old_size
+        subdirectory, extension = self._keys_for(path)
+        self.total_bytes += delta
+        self.by_subdirectory[subdirectory] = self.by_subdirectory.get(subdirectory, 0) + delta
+        self.by_extension[extension] = self.by_extension.get(extension, 0) + delta
+
+    def _remove(self, path: str):
+        ''' must be called with the lock held, path may be a file or a deleted directory '''
+        if path in self.files:
+            removed = [path]
+        else:
+            prefix = path.rstrip(os.sep) + os.sep
+            removed = [p for p in self.files if p.startswith(prefix)]
+        for p in removed:
+            size = self.files.pop(p)
+            subdirectory, extension = self._keys_for(p)
+            self.total_bytes -= size
+            self.by_subdirectory[subdirectory] -= size
+            self.by_extension[extension] -= size
+
+    def _apply_change(self, change, path: str):
+        ''' must be called with the lock held, the file's current size is read so replaying an event is safe '''
+        if change == watchfiles.Change.deleted:
+            self._remove(path)
+            return
+        try:
+            if os.path.isfile(path) and not os.path.islink(path):
+                self._add(path, os.path.getsize(path))
+        except OSError:
+            self._remove(path)
+
+    def rescan(self):
+        ''' full walk of the directory tree, swaps in fresh totals when done (plus any changes seen during the walk) '''
+        started = time.time()
+        with self.lock:
+            self.scan_changes = []
+        files = {}
+        stack = [str(self.directory)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                files[entry.path] = entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue # file removed while scanning
+            except OSError as e:
+                logger.warning(f"Storage monitor could not scan directory: {e}")
+
+        with self.lock:
+            self.files = {}
+            self.total_bytes = 0
+            self.by_subdirectory = {}
+            self.by_extension = {}
+            for path, size in files.items():
+                self._add(path, size)
+            ''' the walk may have passed a directory before a change in it, so events seen meanwhile are applied again '''
+            for change, path in self.scan_changes:
+                self._apply_change(change, path)
+            replayed = len(self.scan_changes)
+            self.scan_changes = None
+            self.last_scan = time.time()
+        logger.debug(f"Storage monitor rescanned {len(files)} files in {time.time() - started:.1f}s ({replayed} changes during the scan replayed)")
+
+    def _scan_loop(self):
+        while True:
+            if self.last_scan is None or time.time() - self.last_scan >= self.rescan_interval:
+                try:
+                    self.rescan()
+                except Exception as e:
+                    logger.error(f"Exception while rescanning storage: {e}")
+            with self.lock:
+                self.history.append((time.time(), self.total_bytes))
+            time.sleep(self.sample_interval)
+
+    def _watch_loop(self):
+        try:
+            for changes in watchfiles.watch(self.directory, recursive=True, raise_interrupt=False):
+                with self.lock:
+                    for change, path in changes:
+                        self._apply_change(change, path)
+                        if self.scan_changes is not None:
+                            self.scan_changes.append((change, path))
+        except Exception as e:
+            logger.error(f"Storage monitor stopped watching for changes, falling back to rescans: {e}")
+
+    def total_gb(self) -> float:
+        return round(self.total_bytes / 1000000000, 2)
+
+    def growth_rate_gb_per_day(self) -> float:
+        ''' growth over the sampled history, None until there are at least two samples '''
+        with self.lock:
+            if len(self.history) < 2:
+                return None
+            (first_time, first_bytes), (last_time, last_bytes) = self.history[0], self.history[-1]
+        if last_time <= first_time:
+            return None
+        return round((last_bytes - first_bytes) / (last_time - first_time) * 86400 / 1000000000, 2)
+
+    def breakdown(self) -> dict:
+        ''' usage in GB by top level subdirectory and by file extension, largest first '''
+        with self.lock:
+            by_subdirectory = sorted(self.by_subdirectory.items(), key=lambda item: item[1], reverse=True)
+            by_extension = sorted(self.by_extension.items(), key=lambda item: item[1], reverse=True)
+        return {
+            'subdirectory': {name: round(size / 1000000000, 2) for name, size in by_subdirectory if size > 0},
+            'extension': {name: round(size / 1000000000, 2) for name, size in by_extension if size > 0},
+        }
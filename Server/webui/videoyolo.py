@@ -1,17 +1,23 @@
 import cv2
+import math
+import numpy as np
 import warnings
 import logging
+import threading
+import time
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
 import uvicorn
 from urllib.parse import urlparse
-from ultralytics import YOLO
+
+from webui.yolobackend import load_yolo_model #internal package
 
 logger = logging.getLogger(__name__)
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-def start_yolo_stream_server(stream_urls: list[str], port: int = 8001, model_path: str = 'yolov8n.pt', skip_frames: int = 2) -> list[str]:
+def start_yolo_stream_server(stream_urls: list[str], port: int = 8001, model_path: str = 'yolov8n.pt', skip_frames: int = 0, inference_fps: float = 0, cpu_budget: float = 0.5, motion_area: float = 0.002, backend: str = 'pytorch', imgsz: int = 640,
+                             onnx_dynamic: bool = False, calibration_directory: str = None) -> list[str]:
     """
     Starts a FastAPI server that streams YOLOv8-annotated video frames for each stream URL.
 
@@ -19,82 +25,432 @@ def start_yolo_stream_server(stream_urls: list[str], port: int = 8001, model_pat
         stream_urls (list[str]): List of input video stream URLs.
         port (int): Port to run the FastAPI server on.
         model_path (str): Path to YOLOv8 model file (e.g., 'yolov8n.pt' or 'best.pt').
-        skip_frames (int): Number of frames to skip between detections.
+        skip_frames (int): Infer every nth frame, 0 adapts the interval to the measured load.
+        inference_fps (float): Max YOLO inferences per second for each stream (0 for no limit).
+        cpu_budget (float): Fraction of time inference may keep the server busy when adapting (0-1).
+        motion_area (float): Fraction of a frame that has to change before it is inferred (0 disables motion gating).
+        backend (str): Inference backend, one of YOLO_BACKENDS (pytorch, onnx or onnx-int8).
+        imgsz (int): Input size frames are letterboxed to for inference (the size ONNX models are exported at).
+        onnx_dynamic (bool): Export ONNX models with dynamic shapes instead of a fixed batch x imgsz x imgsz input.
+        calibration_directory (str): Folder of images int8 activations are calibrated on (onnx-int8), omit for weight only quantization.
 
     Returns:
         List[str]: List of processed stream URLs (e.g., http://localhost:8001/laptop)
     """
 
     app = FastAPI()
-    model = YOLO(model_path)
+    ''' every stream's frames go through one scheduler, so N cameras share batched forward passes (at most one frame per stream) '''
+    max_batch = max(min(len(stream_urls or []), 8), 1)
+    model = load_yolo_model(model_path, backend, imgsz, batch=max_batch, dynamic=onnx_dynamic, calibration_directory=calibration_directory)
+    scheduler = InferenceScheduler(model, target_fps=inference_fps, max_batch=max_batch, imgsz=imgsz)
+    scheduler.start()
 
     # TEST
     #results = model("bird.jpg", verbose=False)
     #results[0].show()
 
     processed_urls = []
-
-    def make_generator(stream_url):
-        cap = cv2.VideoCapture(stream_url)
-        if not cap.isOpened():
-            raise RuntimeError(f"Failed to open stream: {stream_url}")
-
-        frame_count = 0
-        last_detections = []
-
-        def generate():
-            nonlocal frame_count, last_detections
-            while True:
-                success, frame = cap.read()
-                if not success:
-                    continue
-
-                frame_count += 1
-
-                if frame_count % skip_frames == 0:
-                    # Optional: convert to RGB if needed
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    results = model(rgb_frame, verbose=False)[0]
-                    last_detections = results.boxes.data.cpu().numpy()
-                detections = last_detections
-
-                for det in detections:
-                    x1, y1, x2, y2, conf, cls = det[:6]
-                    logger.debug(f"Detected {model.names[int(cls)]} with confidence {conf:.2f}")
-                    if conf < 0.3:
-                        continue
-                    x1, y1, x2, y2 = map(int, [x1, y1, x2, y2])
-                    label = f"{model.names[int(cls)]} {conf:.2f}"
-                    color = confidence_to_color(conf) # color gradient box color based on confidence level
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                    cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-
-                ret, buffer = cv2.imencode('.jpg', frame)
-                frame_bytes = buffer.tobytes()
-
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        return generate
+    workers = {}
 
     for stream_url in stream_urls:
         parsed = urlparse(stream_url)
         endpoint_name = parsed.path.strip("/").split("/")[-1] or "stream"
-        generator = make_generator(stream_url)
+        motion_gate = MotionGate(min_area=motion_area) if motion_area > 0 else None
+        worker = StreamWorker(stream_url, scheduler, FrameSkipController(scheduler, skip_frames, cpu_budget), motion_gate)
+        worker.start()
+        workers[endpoint_name] = worker
 
         @app.get(f"/{endpoint_name}")
-        def stream_endpoint(gen=generator):
-            return StreamingResponse(gen(), media_type='multipart/x-mixed-replace; boundary=frame')
+        def stream_endpoint(worker=worker):
+            return StreamingResponse(worker.subscribe(), media_type='multipart/x-mixed-replace; boundary=frame')
 
         full_url = f"http://localhost:{port}/{endpoint_name}"
         processed_urls.append(full_url)
         logger.info(f"Registered endpoint /{endpoint_name} for stream: {stream_url}")
 
-    import threading
+    @app.get("/stats")
+    def stats_endpoint():
+        ''' capture rate and the inference rate chosen for each stream '''
+        return {
+            'scheduler': scheduler.stats(),
+            'streams': {endpoint_name: worker.stats() for endpoint_name, worker in workers.items()},
+        }
+
     threading.Thread(target=lambda: uvicorn.run(app, host="0.0.0.0", port=port), daemon=True).start()
 
     return processed_urls
 
+class InferenceScheduler:
+    """
+    Runs the shared YOLO model over the newest submitted frame of every stream as one batch, and
+    keeps the latest detections of each stream for its worker to draw.
+
+    Streams submit frames without waiting for inference. Only the newest frame per stream is kept,
+    so a stream never queues up stale frames, and target_fps caps how often each stream is
+    inferred.
+
+    Args:
+        model (YOLO): Shared YOLO model.
+        target_fps (float): Max inferences per second for each stream (0 for no limit).
+        max_batch (int): Max number of frames per forward pass.
+        imgsz (int): Input size frames are letterboxed to.
+    """
+
+    def __init__(self, model, target_fps: float = 0, max_batch: int = 8, imgsz: int = 640):
+        self.model = model
+        self.imgsz = imgsz
+        self.target_fps = target_fps
+        self.max_batch = max_batch
+        self.condition = threading.Condition()
+        self.pending = {} # stream id -> newest rgb frame waiting for inference
+        self.detections = {} # stream id -> latest detections
+        self.last_submit = {}
+        self.batches = 0
+        self.frames_inferred = 0
+        self.frame_latency = None # seconds of inference per frame (moving average)
+        self.busy_secs = 0.0
+        self.started = time.time()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, stream_id: str, frame) -> bool:
+        ''' queue a (BGR) frame for inference, returns False if the stream is over its target rate '''
+        now = time.time()
+        with self.condition:
+            if self.target_fps and now - self.last_submit.get(stream_id, 0) < 1 / self.target_fps:
+                return False
+            self.last_submit[stream_id] = now
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) # also a copy, so the worker can draw on its frame
+        with self.condition:
+            self.pending[stream_id] = rgb_frame
+            self.condition.notify()
+        return True
+
+    def latest_detections(self, stream_id: str):
+        ''' detections as rows of (x1, y1, x2, y2, conf, cls) from the stream's most recent inference '''
+        with self.condition:
+            return self.detections.get(stream_id, [])
+
+    def active_streams(self) -> int:
+        ''' number of streams that submitted a frame in the last few seconds (streams without viewers don't) '''
+        now = time.time()
+        with self.condition:
+            return sum(1 for last in self.last_submit.values() if now - last < 30.0)
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'batches': self.batches,
+                'frames_inferred': self.frames_inferred,
+                'frame_latency_ms': round(self.frame_latency * 1000, 1) if self.frame_latency else None,
+                'busy_fraction': round(self.busy_secs / max(time.time() - self.started, 1e-6), 3),
+            }
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                batch = list(self.pending.items())[:self.max_batch]
+                for stream_id, _ in batch:
+                    del self.pending[stream_id]
+
+            started = time.perf_counter()
+            try:
+                results = self.model([frame for _, frame in batch], imgsz=self.imgsz, verbose=False)
+            except Exception as e:
+                logger.error(f"Exception during YOLO inference: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+
+            with self.condition:
+                for (stream_id, _), result in zip(batch, results):
+                    self.detections[stream_id] = result.boxes.data.cpu().numpy()
+                self.batches += 1
+                self.frames_inferred += len(batch)
+                self.busy_secs += elapsed
+                ''' latency rises when something else (e.g. rendering /analysis) competes for the cpu '''
+                latency = elapsed / len(batch)
+                self.frame_latency = latency if self.frame_latency is None else 0.8 * self.frame_latency + 0.2 * latency
+            logger.debug(f"Inferred batch of {len(batch)} frames")
+
+
+class FrameSkipController:
+    """
+    Decides which captured frames of a stream are sent for inference.
+
+    With a fixed skip_frames every nth frame is inferred. Otherwise the interval adapts to load:
+    from the measured capture fps and the scheduler's per frame inference latency, it picks the
+    smallest interval that keeps inference for all active streams within cpu_budget (and under
+    the scheduler's target fps). When inference slows down because the server is busy, the
+    interval grows on its own, so the stream keeps flowing with older boxes instead of lagging.
+
+    Args:
+        scheduler (InferenceScheduler): Scheduler whose latency is measured.
+        skip_frames (int): Infer every nth frame, 0 adapts the interval.
+        cpu_budget (float): Fraction of time inference may keep the server busy (0-1).
+        max_interval (int): Largest interval when adapting.
+    """
+
+    def __init__(self, scheduler: InferenceScheduler, skip_frames: int = 0, cpu_budget: float = 0.5, max_interval: int = 60):
+        self.scheduler = scheduler
+        self.adaptive = skip_frames <= 0
+        self.cpu_budget = max(0.01, min(cpu_budget, 1.0))
+        self.max_interval = max_interval
+        self.interval = 1 if self.adaptive else skip_frames
+        self.frame_secs = None # time between captured frames (moving average)
+        self.last_frame_time = None
+        self.last_update = 0.0
+        self.frames_since_inference = 0
+
+    @property
+    def capture_fps(self) -> float:
+        return 1 / self.frame_secs if self.frame_secs else None
+
+    @property
+    def inference_fps(self) -> float:
+        ''' rate this stream is being sent for inference at '''
+        return self.capture_fps / self.interval if self.capture_fps else None
+
+    def on_frame(self) -> bool:
+        ''' call for every decoded frame, returns True if it should be inferred '''
+        now = time.perf_counter()
+        if self.last_frame_time is not None:
+            secs = now - self.last_frame_time
+            self.frame_secs = secs if self.frame_secs is None else 0.9 * self.frame_secs + 0.1 * secs
+        self.last_frame_time = now
+
+        if self.adaptive and now - self.last_update >= 1.0:
+            self.last_update = now
+            self._update_interval()
+
+        self.frames_since_inference += 1
+        if self.frames_since_inference >= self.interval:
+            self.frames_since_inference = 0
+            return True
+        return False
+
+    def _update_interval(self):
+        latency = self.scheduler.frame_latency
+        if latency is None or self.capture_fps is None:
+            return # infer every frame until there is something to measure
+        affordable_fps = self.cpu_budget / (latency * max(1, self.scheduler.active_streams()))
+        if self.scheduler.target_fps:
+            affordable_fps = min(affordable_fps, self.scheduler.target_fps)
+        interval = min(self.max_interval, max(1, math.ceil(self.capture_fps / affordable_fps)))
+        if interval != self.interval:
+            logger.debug(f"Inference interval {self.interval} -> {interval} frames (capture {self.capture_fps:.1f}fps, {latency * 1000:.0f}ms per frame)")
+            self.interval = interval
+
+    def stats(self) -> dict:
+        return {
+            'adaptive': self.adaptive,
+            'interval': self.interval,
+            'capture_fps': round(self.capture_fps, 1) if self.capture_fps else None,
+            'inference_fps': round(self.inference_fps, 2) if self.inference_fps else None,
+        }
+
+
+class MotionGate:
+    """
+    Cheap change detector that decides whether a frame is worth running YOLO on.
+
+    Frames are downscaled to grayscale and compared against a slowly updated background, a frame
+    has motion when more than min_area of its pixels changed by more than threshold. Frames are
+    inferred while there is motion and for quiet_secs after it, then once more to confirm (which
+    clears stale boxes when whatever moved has left), and every refresh_secs while static.
+
+    Args:
+        threshold (int): Change in pixel value (0-255) that counts as changed.
+        min_area (float): Fraction of changed pixels that counts as motion.
+        quiet_secs (float): Seconds without motion before inference stops.
+        refresh_secs (float): Seconds between inferences of a static scene.
+        width (int): Width frames are downscaled to before comparing.
+        learning_rate (float): How fast the background follows the scene (0-1).
+    """
+
+    def __init__(self, threshold: int = 25, min_area: float = 0.002, quiet_secs: float = 5.0, refresh_secs: float = 60.0, width: int = 160, learning_rate: float = 0.05):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.quiet_secs = quiet_secs
+        self.refresh_secs = refresh_secs
+        self.width = width
+        self.learning_rate = learning_rate
+        self.background = None
+        self.last_motion = 0.0
+        self.last_inference = 0.0
+        self.confirmed = True # inferred once since motion stopped
+        self.frames_checked = 0
+        self.frames_gated = 0
+
+    def has_motion(self, frame) -> bool:
+        height = max(1, int(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0).astype(np.float32)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return True
+        changed = np.count_nonzero(np.abs(gray - self.background) > self.threshold) / gray.size
+        self.background += self.learning_rate * (gray - self.background)
+        return changed >= self.min_area
+
+    def check(self, frame) -> bool:
+        ''' returns True if the (BGR) frame should be inferred '''
+        now = time.time()
+        self.frames_checked += 1
+        if self.has_motion(frame):
+            self.last_motion = now
+            self.confirmed = False
+        if now - self.last_motion < self.quiet_secs:
+            infer = True
+        elif not self.confirmed:
+            self.confirmed = True # one inference after things settle, clears boxes of what left
+            infer = True
+        else:
+            infer = now - self.last_inference >= self.refresh_secs
+        if infer:
+            self.last_inference = now
+        else:
+            self.frames_gated += 1
+        return infer
+
+    def stats(self) -> dict:
+        return {
+            'frames_checked': self.frames_checked,
+            'frames_gated': self.frames_gated,
+            'seconds_since_motion': round(time.time() - self.last_motion, 1) if self.last_motion else None,
+        }
+
+
+class StreamWorker:
+    """
+    One background worker per stream that captures, runs YOLO, annotates and JPEG encodes each
+    frame once, then publishes the latest encoded frame to every viewer.
+
+    Viewers always get the newest frame, a slow viewer skips the frames it missed instead of
+    falling behind or slowing the others down. While nobody is watching, frames are only grabbed
+    (to keep the stream current) without decoding, inference or encoding.
+
+    Args:
+        stream_url (str): Input video stream URL.
+        scheduler (InferenceScheduler): Scheduler that runs YOLO for every stream.
+        skipper (FrameSkipController): Decides which frames are inferred.
+        motion_gate (MotionGate): Skips inference of frames without motion, optional.
+        jpeg_quality (int): Quality of the JPEG frames sent to viewers (0-100).
+    """
+
+    def __init__(self, stream_url: str, scheduler: InferenceScheduler, skipper: FrameSkipController, motion_gate: MotionGate = None, jpeg_quality: int = 80):
+        self.stream_url = stream_url
+        self.scheduler = scheduler
+        self.skipper = skipper
+        self.motion_gate = motion_gate
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+        self.condition = threading.Condition()
+        self.frame_bytes = None
+        self.frame_id = 0
+        self.subscribers = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.stream_url)
+        if not cap.isOpened():
+            raise RuntimeError(f"Failed to open stream: {self.stream_url}")
+        return cap
+
+    def _run(self):
+        cap = None
+        failed_reads = 0
+        while True:
+            if cap is None:
+                try:
+                    cap = self._open()
+                except RuntimeError as e:
+                    logger.error(f"{e}, retrying in 5s")
+                    time.sleep(5)
+                    continue
+
+            ''' nobody watching, keep the stream current without decoding or inference '''
+            if not self.subscribers:
+                success, frame = cap.grab(), None
+            else:
+                success, frame = cap.read()
+            if not success:
+                failed_reads += 1
+                if failed_reads >= 100:
+                    logger.warning(f"Lost stream {self.stream_url}, reconnecting")
+                    cap.release()
+                    cap = None
+                    failed_reads = 0
+                time.sleep(0.01)
+                continue
+            failed_reads = 0
+            if frame is None:
+                continue
+
+            if self.skipper.on_frame() and (self.motion_gate is None or self.motion_gate.check(frame)):
+                self.scheduler.submit(self.stream_url, frame)
+            ''' draw the newest results, capture doesn't wait for the batch this frame is in '''
+            draw_detections(frame, self.scheduler.latest_detections(self.stream_url), self.scheduler.model.names)
+
+            ''' encode once, every viewer is sent the same bytes '''
+            ret, buffer = cv2.imencode('.jpg', frame, self.encode_params)
+            if not ret:
+                continue
+            with self.condition:
+                self.frame_bytes = buffer.tobytes()
+                self.frame_id += 1
+                self.condition.notify_all()
+
+    def stats(self) -> dict:
+        stats = self.skipper.stats()
+        stats['subscribers'] = self.subscribers
+        if self.motion_gate is not None:
+            stats.update(self.motion_gate.stats())
+        return stats
+
+    def wait_for_frame(self, last_frame_id: int, timeout: float = 5.0):
+        ''' block until a frame newer than last_frame_id is published, returns (frame_id, jpeg bytes) or (last_frame_id, None) on timeout '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frame_id > last_frame_id, timeout=timeout):
+                return last_frame_id, None
+            return self.frame_id, self.frame_bytes
+
+    def subscribe(self):
+        ''' multipart jpeg generator for one viewer '''
+        with self.condition:
+            self.subscribers += 1
+        last_frame_id = 0
+        try:
+            while True:
+                last_frame_id, frame_bytes = self.wait_for_frame(last_frame_id)
+                if frame_bytes is None:
+                    continue
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
 ''' Helper Functions '''
+def draw_detections(frame, detections, names: dict):
+    ''' draw boxes and labels of detections above the confidence threshold on the (BGR) frame '''
+    for det in detections:
+        x1, y1, x2, y2, conf, cls = det[:6]
+        logger.debug(f"Detected {names[int(cls)]} with confidence {conf:.2f}")
+        if conf < 0.3:
+            continue
+        x1, y1, x2, y2 = map(int, [x1, y1, x2, y2])
+        label = f"{names[int(cls)]} {conf:.2f}"
+        color = confidence_to_color(conf) # color gradient box color based on confidence level
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
 def confidence_to_color(conf):
     """
     Maps confidence (0.0 to 1.0) to a BGR color from red to green.
@@ -0,0 +1,229 @@
+import logging, os, shutil, statistics, time
+import numpy as np
+from pathlib import Path
+from ultralytics import YOLO
+
+logger = logging.getLogger(__name__)
+
+YOLO_BACKENDS = ["pytorch", "onnx", "onnx-int8"]
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+def onnx_cache_path(model_path: Path, imgsz: int, batch: int = 1, dynamic: bool = False, int8: bool = False, calibrated: bool = False, cache_directory: Path = None) -> Path:
+    ''' <model>-<imgsz>-b<batch>[-int8[-qdq]].onnx for a fixed input shape, <model>-<imgsz>-dynamic[...].onnx when every axis is dynamic '''
+    model_path = Path(model_path)
+    cache_directory = Path(cache_directory) if cache_directory else model_path.parent
+    shape = "dynamic" if dynamic else f"b{batch}"
+    quantization = ("-int8-qdq" if calibrated else "-int8") if int8 else ""
+    return cache_directory / f"{model_path.stem}-{imgsz}-{shape}{quantization}.onnx"
+
+def letterbox_image(image: np.ndarray, imgsz: int) -> np.ndarray:
+    ''' resize keeping the aspect ratio and pad to imgsz x imgsz the way ultralytics does, returns a 3 x imgsz x imgsz float32 rgb array '''
+    import cv2
+    scale = imgsz / max(image.shape[:2])
+    height, width = round(image.shape[0] * scale), round(image.shape[1] * scale)
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - height) // 2, (imgsz - width) // 2
+    padded[top:top + height, left:left + width] = cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+    return padded[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255
+
+def quantize_onnx(onnx_path: Path, target_path: Path, imgsz: int, batch: int, calibration_directory: Path = None):
+    '''
+    quantize to int8. with a folder of calibration images the activations are calibrated and the model is
+    saved with QDQ nodes, which onnxruntime fuses into int8 convolutions. without one only the weights are
+    quantized (dynamic quantization), which turns convolutions into ConvInteger ops that are often slower
+    on the cpu than fp32, compare both with --benchmark-images before using it
+    '''
+    try:
+        import onnx
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    except ImportError as e:
+        raise RuntimeError("int8 quantization needs the onnx and onnxruntime packages (pip install onnx onnxruntime)") from e
+    source = onnx.load(str(onnx_path))
+
+    if calibration_directory:
+        import cv2
+        image_paths = sorted(p for p in Path(calibration_directory).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        if not image_paths:
+            raise ValueError(f"No calibration images found in {calibration_directory}")
+        input_name = source.graph.input[0].name
+
+        class ImageCalibrationReader(CalibrationDataReader):
+            """ Feeds the calibration images to the model in batches of its input size """
+            def __init__(self):
+                self.next_image = 0
+            def get_next(self):
+                if self.next_image >= len(image_paths):
+                    return None
+                chunk = image_paths[self.next_image:self.next_image + batch]
+                self.next_image += batch
+                chunk += [chunk[-1]] * (batch - len(chunk))
+                return {input_name: np.stack([letterbox_image(cv2.imread(str(p)), imgsz) for p in chunk])}
+
+        logger.info(f"Quantizing {onnx_path} to int8 (QDQ) with {len(image_paths)} calibration images")
+        quantize_static(str(onnx_path), str(target_path), ImageCalibrationReader(), quant_format=QuantFormat.QDQ,
+                        per_channel=True, weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8)
+    else:
+        logger.warning(f"Quantizing {onnx_path} weights only (no --calibration-images), its ConvInteger ops are often slower than fp32 on the cpu")
+        quantize_dynamic(str(onnx_path), str(target_path), weight_type=QuantType.QUInt8)
+
+    ''' ultralytics reads class names, stride and imgsz from the model metadata, which quantizing drops '''
+    quantized = onnx.load(str(target_path))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, str(target_path))
+
+def export_onnx(model_path: Path, imgsz: int = 640, batch: int = 1, dynamic: bool = False, int8: bool = False, calibration_directory: Path = None, cache_directory: Path = None) -> Path:
+    '''
+    export the .pt model to onnx (optionally int8 quantized) once, returns the cached file.
+    the export is redone when the .pt file is newer than the cache.
+
+    by default the input shape is fixed (batch x 3 x imgsz x imgsz), so frames are letterboxed to the same
+    square and onnxruntime plans the graph once. dynamic exports accept any shape, but ultralytics then
+    letterboxes every frame to its own rectangle and onnxruntime re-plans for each new shape
+    '''
+    model_path = Path(model_path)
+    onnx_path = onnx_cache_path(model_path, imgsz, batch, dynamic, cache_directory=cache_directory)
+    target_path = onnx_cache_path(model_path, imgsz, batch, dynamic, int8, bool(calibration_directory), cache_directory)
+    if target_path.exists() and (not model_path.exists() or target_path.stat().st_mtime >= model_path.stat().st_mtime):
+        logger.info(f"Using cached ONNX model {target_path}")
+        return target_path
+
+    if not model_path.exists():
+        if not onnx_path.exists():
+            raise FileNotFoundError(f"YOLO model {model_path} not found, and there is no cached ONNX export of it at {onnx_path}")
+        logger.info(f"{model_path} not found, using the cached ONNX export {onnx_path}")
+    os.makedirs(onnx_path.parent, exist_ok=True)
+    if not onnx_path.exists() or (model_path.exists() and onnx_path.stat().st_mtime < model_path.stat().st_mtime):
+        logger.info(f"Exporting {model_path} to ONNX at imgsz={imgsz}, " + ("dynamic shape" if dynamic else f"batch={batch}"))
+        exported = YOLO(str(model_path)).export(format="onnx", imgsz=imgsz, batch=batch, dynamic=dynamic, simplify=True)
+        shutil.move(str(exported), str(onnx_path))
+
+    if int8:
+        quantize_onnx(onnx_path, target_path, imgsz, batch, calibration_directory)
+    return target_path
+
+class FixedBatchModel:
+    """
+    Calls a model exported with a fixed batch size with any number of frames, a short batch is
+    padded with copies of its last frame and the padded results are dropped.
+
+    Args:
+        model (YOLO): Model loaded from a fixed shape ONNX export.
+        batch (int): Batch size the model was exported with.
+    """
+
+    def __init__(self, model, batch: int):
+        self.model = model
+        self.batch = batch
+
+    def __getattr__(self, name):
+        ''' names, predictor etc. come from the wrapped model, so this stands in for it everywhere '''
+        return getattr(self.model, name)
+
+    def __call__(self, frames, **kwargs):
+        if not isinstance(frames, list):
+            frames = [frames]
+        results = []
+        for start in range(0, len(frames), self.batch):
+            chunk = frames[start:start + self.batch]
+            results.extend(self.model(chunk + [chunk[-1]] * (self.batch - len(chunk)), **kwargs)[:len(chunk)])
+        return results
+
+def warm_up(model, imgsz: int = 640, batch: int = 1):
+    ''' first calls allocate buffers and pick kernels, so run them before the streams start '''
+    frames = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(batch)]
+    started = time.perf_counter()
+    model(frames, imgsz=imgsz, verbose=False)
+    model(frames, imgsz=imgsz, verbose=False)
+    logger.info(f"Warmed up YOLO model in {time.perf_counter() - started:.2f}s")
+
+def load_yolo_model(model_path: Path, backend: str = "pytorch", imgsz: int = 640, batch: int = 1, dynamic: bool = False, calibration_directory: Path = None,
+                    cache_directory: Path = None, warmup: bool = True):
+    '''
+    load the YOLO model with the chosen backend, every backend is called the same way (model(frames)).
+    batch is the most frames the caller sends at once (warm up runs at that size)
+    '''
+    if backend not in YOLO_BACKENDS:
+        raise ValueError(f"Unknown YOLO backend: {backend}")
+    if backend == "pytorch":
+        model = YOLO(str(model_path))
+    else:
+        try:
+            import onnxruntime # noqa: F401
+        except ImportError as e:
+            raise RuntimeError(f"the {backend} YOLO backend needs the onnx and onnxruntime packages (pip install -r requirements.txt)") from e
+        onnx_path = export_onnx(model_path, imgsz, batch, dynamic, int8=(backend == "onnx-int8"), calibration_directory=calibration_directory, cache_directory=cache_directory)
+        model = YOLO(str(onnx_path), task="detect") # runs with onnxruntime on the cpu
+        if not dynamic:
+            model = FixedBatchModel(model, batch)
+    if warmup:
+        warm_up(model, imgsz, batch)
+    return model
+
+''' Benchmark '''
+def box_iou(box_a, box_b) -> float:
+    x1, y1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    x2, y2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1]) + (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+def compare_detections(reference, candidate, min_confidence: float = 0.3, min_iou: float = 0.5):
+    ''' greedy match of candidate boxes to reference boxes of the same class, returns (matched, reference count, candidate count) '''
+    reference = [d for d in reference if d[4] >= min_confidence]
+    candidate = [d for d in candidate if d[4] >= min_confidence]
+    unmatched = list(candidate)
+    matched = 0
+    for ref in sorted(reference, key=lambda d: -d[4]):
+        best, best_iou = None, min_iou
+        for cand in unmatched:
+            if int(cand[5]) == int(ref[5]):
+                iou = box_iou(ref, cand)
+                if iou >= best_iou:
+                    best, best_iou = cand, iou
+        if best is not None:
+            unmatched.remove(best)
+            matched += 1
+    return matched, len(reference), len(candidate)
+
+def benchmark_backends(model_path: Path, image_directory: Path, backends: list = None, imgsz: int = 640, dynamic: bool = False, calibration_directory: Path = None, cache_directory: Path = None) -> dict:
+    '''
+    time every backend on a folder of images and compare its detections to the .pt model's.
+    returns {backend: {mean_ms, p95_ms, recall, precision}}, recall/precision are relative to the pytorch model
+    '''
+    import cv2
+    image_paths = sorted(p for p in Path(image_directory).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not image_paths:
+        raise ValueError(f"No images found in {image_directory}")
+    images = [cv2.imread(str(p)) for p in image_paths]
+    backends = backends or YOLO_BACKENDS
+
+    reference = None
+    results = {}
+    for backend in ["pytorch"] + [b for b in backends if b != "pytorch"]:
+        model = load_yolo_model(model_path, backend, imgsz, dynamic=dynamic, calibration_directory=calibration_directory, cache_directory=cache_directory)
+        timings = []
+        detections = []
+        for image in images:
+            started = time.perf_counter()
+            result = model(image, imgsz=imgsz, verbose=False)[0]
+            timings.append((time.perf_counter() - started) * 1000)
+            detections.append(result.boxes.data.cpu().numpy())
+        if reference is None:
+            reference = detections
+
+        matched = reference_count = candidate_count = 0
+        for ref, cand in zip(reference, detections):
+            m, r, c = compare_detections(ref, cand)
+            matched += m
+            reference_count += r
+            candidate_count += c
+        results[backend] = {
+            'mean_ms': round(statistics.mean(timings), 1),
+            'p95_ms': round(sorted(timings)[int(0.95 * (len(timings) - 1))], 1),
+            'recall': round(matched / reference_count, 3) if reference_count else None,
+            'precision': round(matched / candidate_count, 3) if candidate_count else None,
+        }
+        logger.info(f"{backend}: {results[backend]}")
+    return results